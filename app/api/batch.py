@@ -0,0 +1,211 @@
+from fastapi import Request, Response
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Tuple
+from ..core.config import settings
+from ..utils.helpers import create_response_data
+from .options import completion_params
+from .streaming import CancellableStreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# 断点文件名即批次 ID，只允许安全的字符
+_BATCH_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+class Batch:
+    """
+    批量聊天补全接口
+
+    请求体为 JSONL，每行一个 Ollama 格式的聊天请求，可带 id 字段（没有时为行号）。
+    最多 concurrency 个请求同时进行，每个请求经过 chat_completion 的提供商选择、速率限制和失败切换，
+    因此整体速度由各提供商共享的速率限制决定。结果按完成顺序以 JSONL 返回：
+        {"id": ..., "response": {...}}   成功，response 与非流式 /api/chat 的响应相同
+        {"id": ..., "error": "..."}      失败
+
+    指定 batch_id 时，成功的结果同时追加到 batch_checkpoint_dir/<batch_id>.jsonl；
+    用同一 batch_id 重新提交时，已完成的结果直接从断点文件返回，只执行剩余的请求。
+    """
+
+    def __init__(self, db, api_client):
+        """
+        初始化批量接口
+
+        Args:
+            db: 数据库管理器（模型映射）
+            api_client: API 客户端
+        """
+        self.db = db
+        self.api_client = api_client
+
+    async def run(self, request: Request) -> Response:
+        """批量聊天补全（/api/batch?concurrency=N&batch_id=...）"""
+        batch_id = request.query_params.get("batch_id")
+        if batch_id is not None and not _BATCH_ID.match(batch_id):
+            return self._error(400, "Invalid batch_id")
+        limit = max(1, settings.server.batch_concurrency)
+        try:
+            concurrency = min(limit, int(request.query_params.get("concurrency") or limit))
+        except ValueError:
+            return self._error(400, "Invalid concurrency")
+        if concurrency < 1:
+            return self._error(400, "Invalid concurrency")
+
+        # 请求体必须在返回流式响应之前读完，响应期间 receive 由断开检测使用
+        items, errors = self._parse(await request.body())
+        checkpoint = self._checkpoint_path(batch_id) if batch_id else None
+        completed = self._load_checkpoint(checkpoint) if checkpoint else {}
+        pending = [(item_id, data) for item_id, data in items if _key(item_id) not in completed]
+
+        async def stream_response():
+            # 断点中已完成的结果和无效的行先返回
+            for item_id, _ in items:
+                line = completed.get(_key(item_id))
+                if line is not None:
+                    yield line
+            for item_id, message in errors:
+                yield json.dumps({"id": item_id, "error": message}) + "\n"
+            if not pending:
+                return
+
+            results: asyncio.Queue = asyncio.Queue()
+            queue = iter(pending)
+            out = self._open_checkpoint(checkpoint) if checkpoint else None
+
+            async def worker():
+                for item_id, data in queue:
+                    line, ok = await self._complete(item_id, data)
+                    # 只记录成功的结果，失败的请求在恢复时重新执行
+                    if ok and out is not None:
+                        out.write(line.encode())
+                        out.flush()
+                    results.put_nowait(line)
+
+            workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(pending)))]
+            try:
+                for _ in range(len(pending)):
+                    yield await results.get()
+            finally:
+                # 客户端断开时停止剩余的请求，已完成的结果保留在断点文件中
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                if out is not None:
+                    out.close()
+
+        return CancellableStreamingResponse(
+            stream_response(),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    @staticmethod
+    def _parse(body: bytes) -> Tuple[List[Tuple[Any, Dict[str, Any]]], List[Tuple[Any, str]]]:
+        """
+        解析 JSONL 请求体
+
+        Returns:
+            (有效的请求 [(id, 请求)], 无效的行 [(id, 错误信息)])
+        """
+        items, errors = [], []
+        seen = set()
+        for number, line in enumerate(body.decode("utf-8", errors="replace").splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                errors.append((number, "Invalid JSON"))
+                continue
+            if not isinstance(data, dict):
+                errors.append((number, "Each line must be a JSON object"))
+                continue
+            item_id = data.pop("id", number)
+            if _key(item_id) in seen:
+                errors.append((item_id, "Duplicate id"))
+            elif not data.get("model") or not data.get("messages"):
+                errors.append((item_id, "Fields 'model' and 'messages' are required"))
+            else:
+                seen.add(_key(item_id))
+                items.append((item_id, data))
+        return items, errors
+
+    async def _complete(self, item_id: Any, data: Dict[str, Any]) -> Tuple[str, bool]:
+        """执行一个请求，返回 (结果行, 是否成功)，失败时为错误行"""
+        start_time = time.time_ns()
+        chunks = None
+        try:
+            chunks = self.api_client.chat_completion(
+                model=self.db.get_model_mapping(data["model"]),
+                messages=data["messages"],
+                stream=False,
+                **completion_params(data)
+            )
+            content = []
+            stats = {}
+            async for response in chunks:
+                if not response["done"]:
+                    content.append(response["message"]["content"])
+                else:
+                    stats = {k: v for k, v in response.items() if k not in ("message", "done")}
+                    break
+            stats.setdefault("total_duration", time.time_ns() - start_time)
+            return json.dumps({"id": item_id, "response": create_response_data(
+                model=data["model"],
+                content="".join(content),
+                done=True,
+                **stats
+            )}) + "\n", True
+        except Exception as e:
+            logger.error(f"Batch item {item_id!r} error: {str(e)}")
+            return json.dumps({"id": item_id, "error": str(e)}) + "\n", False
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+
+    @staticmethod
+    def _checkpoint_path(batch_id: str) -> str:
+        directory = settings.server.batch_checkpoint_dir
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{batch_id}.jsonl")
+
+    @staticmethod
+    def _load_checkpoint(path: str) -> Dict[str, str]:
+        """读取断点文件，返回 id 到结果行的映射；中断时写了一半的最后一行被忽略"""
+        completed: Dict[str, str] = {}
+        if not os.path.exists(path):
+            return completed
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    continue
+                try:
+                    completed[_key(json.loads(line)["id"])] = line
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Ignoring invalid checkpoint line in {path}")
+        return completed
+
+    @staticmethod
+    def _open_checkpoint(path: str):
+        """以追加方式打开断点文件；上次中断时写了一半的行单独成行，不影响之后的记录"""
+        out = open(path, "ab+")
+        if out.seek(0, os.SEEK_END) > 0:
+            out.seek(-1, os.SEEK_END)
+            if out.read(1) != b"\n":
+                out.write(b"\n")
+        return out
+
+    @staticmethod
+    def _error(status_code: int, message: str) -> Response:
+        return Response(
+            content=json.dumps({"error": message}),
+            status_code=status_code,
+            media_type="application/json"
+        )
+
+def _key(item_id: Any) -> str:
+    """id 的比较键（区分 1 和 "1"）"""
+    return json.dumps(item_id)
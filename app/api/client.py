@@ -1,137 +1,876 @@
-from openai import OpenAI
+import json
 import logging
-import time
 import random
-from typing import List, Dict, Any, AsyncGenerator
+import re
+import time
+from typing import List, Dict, Any, AsyncGenerator, AsyncIterator, Optional, Set, Tuple
 import asyncio
-from ..core.config import ApiProvider
+import httpx
+from ..core.config import ApiProvider, CoordinationSettings
+from ..core.tracing import current_trace, span
+from ..utils.tokens import estimate_messages, estimate_tokens, TokenCounter
+from .coordination import CircuitBreaker, Coordinator, create_coordinator
+from .keys import KEY_ERROR_STATUS, KeyPool
+from .limiter import RateLimiter, Reservation
+from .pool import ProviderPool, UpstreamError, iter_sse
 
 logger = logging.getLogger(__name__)
 
+# 未指定 num_predict 时预估的生成 token 数
+DEFAULT_COMPLETION_TOKENS = 256
+# OpenAI 接口最多接受的停止序列数，其余的只在本地执行
+MAX_UPSTREAM_STOP = 4
+# 每个候选提供商最多尝试的次数，全部失败后向调用方抛出最后一个错误
+MAX_ATTEMPTS_PER_PROVIDER = 2
+# 已加载请求模型的 Ollama 提供商的权重倍数（避免在其他服务器上冷加载模型）
+LOADED_MODEL_WEIGHT = 4
+
+# 这些字段不变时，热加载会复用原有的速率限制器 / 客户端
+LIMITER_FIELDS = {"rate_limit", "rpm", "tpm", "api_keys", "key_cooldown"}
+CLIENT_FIELDS = {
+    "type", "base_url", "api_key", "api_keys", "max_connections", "max_keepalive", "keepalive_expiry",
+    "http2", "min_warm", "ping_interval", "dns_ttl"
+}
+
+class StallError(Exception):
+    """上游在限定时间内没有返回响应或新的 token"""
+
+class DeadlineExceeded(Exception):
+    """超过请求的截止时间"""
+
+def _limit(deadline: Optional[float], timeout: float) -> Optional[float]:
+    """从现在起 timeout 秒（0 表示不限制）与截止时间中较早的一个"""
+    limit = time.monotonic() + timeout if timeout > 0 else None
+    if deadline is None:
+        return limit
+    return deadline if limit is None else min(limit, deadline)
+
+class _Watchdog:
+    """
+    可重复设置的超时，到期时取消当前任务
+
+    每个分块只需重设一个定时器；asyncio.wait_for 每次调用都会创建一个任务，逐个分块使用时开销大得多。
+    用法：arm(limit) 后 await，随后在 finally 中 disarm()；收到 CancelledError 时用 check() 区分超时和外部取消。
+    """
+
+    __slots__ = ("_deadline", "_handle", "_task", "fired")
+
+    def __init__(self, deadline: Optional[float]):
+        """
+        Args:
+            deadline: 请求的截止时间（time.monotonic()），用于区分截止和停顿
+        """
+        self._deadline = deadline
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self.fired = False
+
+    def arm(self, limit: Optional[float]) -> None:
+        """在 limit（time.monotonic()）时取消当前任务，None 表示不限制"""
+        if limit is None:
+            return
+        loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        # 事件循环的时钟与 time.monotonic() 相同
+        self._handle = loop.call_at(limit, self._fire)
+
+    def disarm(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self) -> None:
+        self._handle = None
+        self.fired = True
+        self._task.cancel()
+
+    def check(self) -> None:
+        """
+        处理 CancelledError：外部取消时直接返回（调用方继续抛出），超时时抛出对应的异常
+
+        Raises:
+            DeadlineExceeded: 到达请求的截止时间
+            StallError: 到达 TTFT / token 间隔超时
+        """
+        if not self.fired:
+            return
+        self.fired = False
+        if hasattr(self._task, "uncancel"):
+            # Python 3.11+：撤销本次取消请求，不影响任务后续的取消语义
+            self._task.uncancel()
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            raise DeadlineExceeded("Request deadline exceeded")
+        raise StallError("Upstream stalled")
+
+class _PrefixFilter:
+    """
+    续写时过滤上游重复输出的前缀
+
+    上游可能接着前缀续写，也可能忽略前缀从头生成。与前缀一致的输出先暂存，
+    完整重复了前缀时丢弃，中途不一致时说明是续写，连同暂存的内容一起发出。
+    """
+
+    __slots__ = ("_rest", "_held")
+
+    def __init__(self, prefix: str):
+        self._rest = prefix
+        self._held: List[str] = []
+
+    def feed(self, content: str) -> str:
+        """返回应该发给调用方的内容"""
+        if not self._rest:
+            return content
+        if content.startswith(self._rest):
+            content = content[len(self._rest):]
+        elif self._rest.startswith(content):
+            self._rest = self._rest[len(content):]
+            self._held.append(content)
+            return ""
+        else:
+            content = "".join(self._held) + content
+        self._rest = ""
+        self._held = []
+        return content
+
+class _StopFilter:
+    """
+    在本地执行停止序列
+
+    上游可能忽略 stop 或只接受前几个，停止序列也可能跨越多个分块。末尾可能是停止序列开头的内容先暂存，
+    确定不是停止序列后再发出；出现停止序列时截断，之后的内容丢弃。
+    """
+
+    __slots__ = ("_stops", "_keep", "_held")
+
+    def __init__(self, stops: List[str]):
+        self._stops = stops
+        # 最多暂存的长度：比最长的停止序列少一个字符
+        self._keep = max((len(stop) for stop in stops), default=1) - 1
+        self._held = ""
+
+    def feed(self, content: str) -> Tuple[str, bool]:
+        """返回 (应该发给调用方的内容, 是否遇到停止序列)"""
+        if not self._stops:
+            return content, False
+        text = self._held + content
+        positions = [i for i in (text.find(stop) for stop in self._stops) if i >= 0]
+        if positions:
+            self._held = ""
+            return text[:min(positions)], True
+        for n in range(min(self._keep, len(text)), 0, -1):
+            if any(stop.startswith(text[-n:]) for stop in self._stops):
+                self._held = text[-n:]
+                return text[:-n], False
+        self._held = ""
+        return text, False
+
+    def flush(self) -> str:
+        """上游结束时取出暂存的内容"""
+        held, self._held = self._held, ""
+        return held
+
+def _client_error(error: Exception) -> bool:
+    """上游认为请求本身有误（4xx，429 除外），换用其他提供商也不会成功"""
+    return isinstance(error, UpstreamError) and 400 <= error.status_code < 500 and error.status_code != 429
+
+# 响应中的 token 用量，透传时不解析 JSON，只在字节中查找（OpenAI 的 usage / Ollama 最后一个分块的统计）
+_TOTAL_TOKENS = re.compile(rb'"total_tokens"\s*:\s*(\d+)')
+_OLLAMA_COUNTS = re.compile(rb'"(prompt_eval_count|eval_count)"\s*:\s*(\d+)')
+
+class Relay:
+    """
+    透传的上游响应
+
+    按原样转发上游的字节；上游模型名与客户端请求的模型名不同时，按行把 "上游模型名" 替换为 "客户端模型名"
+    （JSON 字符串内容中的引号会被转义，不会误替换）。关闭时按响应中的 usage 校正额度，没有 usage 时按预估扣除。
+    """
+
+    def __init__(
+        self,
+        client: "Client",
+        provider_set: "ProviderSet",
+        limiter: RateLimiter,
+        reservation,
+        response: httpx.Response,
+        provider_model: str,
+        client_model: str
+    ):
+        self.status_code = response.status_code
+        self.media_type = response.headers.get("content-type", "application/json")
+        self._client = client
+        self._provider_set = provider_set
+        self._limiter = limiter
+        self._reservation = reservation
+        self._response = response
+        self._total_tokens: Optional[int] = None
+        self._closed = False
+        self._rewrite = None
+        if provider_model != client_model:
+            self._rewrite = (
+                json.dumps(provider_model).encode(),
+                json.dumps(client_model).encode()
+            )
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            if self._rewrite is None:
+                async for chunk in self._response.aiter_raw():
+                    self._scan(chunk)
+                    yield chunk
+                return
+
+            # 需要改写时按行处理，避免替换目标被分块截断
+            old, new = self._rewrite
+            tail = b""
+            async for chunk in self._response.aiter_raw():
+                data = tail + chunk
+                cut = data.rfind(b"\n") + 1
+                tail = data[cut:]
+                if cut:
+                    lines = data[:cut]
+                    self._scan(lines)
+                    yield lines.replace(old, new)
+            if tail:
+                self._scan(tail)
+                yield tail.replace(old, new)
+        finally:
+            await self.aclose()
+
+    def _scan(self, data: bytes) -> None:
+        if b"total_tokens" in data:
+            match = _TOTAL_TOKENS.search(data)
+            if match:
+                self._total_tokens = int(match.group(1))
+        elif b"eval_count" in data:
+            counts = _OLLAMA_COUNTS.findall(data)
+            if counts:
+                self._total_tokens = sum(int(count) for _, count in counts)
+
+    async def aclose(self) -> None:
+        """关闭上游响应，校正额度并释放提供商集合"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._response.aclose()
+        finally:
+            tokens = self._total_tokens
+            self._limiter.reconcile(self._reservation, self._reservation.tokens if tokens is None else tokens)
+            self._client._release(self._provider_set)
+
+def _create_limiter(provider: ApiProvider, coordinator: Optional[Coordinator], lease_fraction: float):
+    """有多个 api_keys 时为 key 池（每个 key 单独限速），否则为单个速率限制器"""
+    if len(set(provider.api_keys)) > 1:
+        return KeyPool(provider, coordinator, lease_fraction)
+    return RateLimiter.from_provider(provider, coordinator, lease_fraction)
+
+def _auth_headers(reservation: Reservation) -> Optional[Dict[str, str]]:
+    """使用 key 池时本次请求的 Authorization 请求头"""
+    return {"Authorization": f"Bearer {reservation.key}"} if reservation.key else None
+
+def _key_error(limiter, reservation: Reservation, error: BaseException) -> bool:
+    """
+    上游拒绝了本次请求使用的 key（限流、额度或鉴权错误）时暂停该 key
+
+    Returns:
+        同一提供商还有其他可用的 key，可以直接换 key 重试（不计为提供商失败）
+    """
+    if not isinstance(error, UpstreamError) or error.status_code not in KEY_ERROR_STATUS:
+        return False
+    return limiter.penalize(reservation, error.retry_after)
+
+class ProviderSet:
+    """一组提供商及其连接池、速率限制器，热加载时整体替换"""
+
+    def __init__(
+        self,
+        providers: List[ApiProvider],
+        previous: Optional["ProviderSet"] = None,
+        coordinator: Optional[Coordinator] = None,
+        lease_fraction: float = 0.1
+    ):
+        """
+        构建提供商集合
+
+        Args:
+            providers: API 提供商列表
+            previous: 旧的提供商集合，未变化的提供商复用其连接池和速率限制器状态
+            coordinator: 速率限制使用的共享存储
+            lease_fraction: 每次从共享存储领取的额度比例
+        """
+        self.providers = providers
+        self.by_name = {p.provider_name: p for p in providers}
+        self.clients: Dict[str, ProviderPool] = {}
+        self.limiters = {}
+        # 本集合新建的连接池，替换前需要预热
+        self.new_clients: List[ProviderPool] = []
+        # 正在使用该集合的请求数，被替换后归零时关闭不再使用的客户端
+        self.active = 0
+        self.retired = False
+
+        for provider in providers:
+            name = provider.provider_name
+            old = previous.get(name) if previous else None
+
+            if old and old.model_dump(include=LIMITER_FIELDS) == provider.model_dump(include=LIMITER_FIELDS):
+                self.limiters[name] = previous.limiters[name]
+            else:
+                self.limiters[name] = _create_limiter(provider, coordinator, lease_fraction)
+
+            if old and old.model_dump(include=CLIENT_FIELDS) == provider.model_dump(include=CLIENT_FIELDS):
+                self.clients[name] = previous.clients[name]
+            else:
+                self.clients[name] = ProviderPool(provider)
+                self.new_clients.append(self.clients[name])
+
+    def get(self, provider_name: str) -> Optional[ApiProvider]:
+        """获取指定名称的提供商"""
+        return self.by_name.get(provider_name)
+
+    async def warm(self) -> None:
+        """预热本集合新建的连接池"""
+        await asyncio.gather(*(pool.warm() for pool in self.new_clients))
+
+    def start(self) -> None:
+        """启动本集合新建连接池的保活任务"""
+        for pool in self.new_clients:
+            pool.start()
+
+    def close_unused(self, in_use: Set[int], closed: Set[int]) -> None:
+        """
+        关闭不再被任何集合使用的客户端
+
+        Args:
+            in_use: 仍在使用中的集合所引用的客户端 id
+            closed: 已经关闭的客户端 id，关闭后会加入其中
+        """
+        for name, client in self.clients.items():
+            if id(client) in in_use or id(client) in closed:
+                continue
+            closed.add(id(client))
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"Error closing client for {name}: {str(e)}")
+
 class Client:
     """API 客户端"""
     
-    def __init__(self, providers: List[ApiProvider]):
+    def __init__(self, providers: List[ApiProvider], coordination: Optional[CoordinationSettings] = None):
         """
         初始化客户端
         
         Args:
             providers: API 提供商列表
+            coordination: 多实例协调配置，默认只在本实例内限制
         """
-        self.providers = providers
-        self.clients = {}
-        for provider in providers:
-            self.clients[provider.provider_name] = OpenAI(
-                base_url=provider.base_url,
-                api_key=provider.api_key,
-                default_headers={
-                    "HTTP-Referer": "http://localhost:11434",
-                    "X-Title": "Ollama Mock Server",
-                }
-            )
+        # 未指定时使用默认值（不读取环境变量），只在本实例内限制
+        coordination = coordination or CoordinationSettings.model_construct()
+        self.coordinator = create_coordinator(coordination)
+        self.lease_fraction = coordination.lease_fraction
+        self.breaker = CircuitBreaker(self.coordinator, coordination)
+        self.provider_set = ProviderSet(providers, None, self.coordinator, self.lease_fraction)
+        # 已被替换但仍有进行中请求的集合
+        self._retired: List[ProviderSet] = []
+
+    @property
+    def providers(self) -> List[ApiProvider]:
+        return self.provider_set.providers
+
+    @property
+    def clients(self) -> Dict[str, ProviderPool]:
+        return self.provider_set.clients
+
+    @property
+    def limiters(self) -> Dict[str, RateLimiter]:
+        return self.provider_set.limiters
+
+    async def start(self) -> None:
+        """启动时预热所有连接池并开始保活"""
+        await self.provider_set.warm()
+        self.provider_set.start()
+        self.breaker.start(lambda: self.provider_set.by_name)
+
+    async def aclose(self) -> None:
+        """关闭所有连接池"""
+        for provider_set in [self.provider_set] + self._retired:
+            for pool in provider_set.clients.values():
+                pool.close()
+        await self.breaker.aclose()
+        await self.coordinator.aclose()
+        await asyncio.sleep(0)
+
+    async def build_provider_set(self, providers: List[ApiProvider]) -> ProviderSet:
+        """
+        在后台线程中构建新的提供商集合并预热新建的连接池，
+        未变化的提供商复用当前集合的连接池和速率限制器
+
+        Args:
+            providers: 新的 API 提供商列表
+        """
+        new_set = await asyncio.to_thread(
+            ProviderSet, providers, self.provider_set, self.coordinator, self.lease_fraction
+        )
+        await new_set.warm()
+        return new_set
+
+    def swap_provider_set(self, new_set: ProviderSet) -> None:
+        """
+        原子替换提供商集合
+
+        进行中的请求继续使用旧集合；客户端在没有任何进行中的集合引用它之后才会关闭。
+
+        Args:
+            new_set: 新的提供商集合
+        """
+        old_set, self.provider_set = self.provider_set, new_set
+        new_set.start()
+        old_set.retired = True
+        self._retired.append(old_set)
+        self._close_drained()
+        logger.info(f"Provider set updated: {[p.provider_name for p in new_set.providers]}")
+
+    async def update_providers(self, providers: List[ApiProvider]) -> None:
+        """
+        热加载提供商配置
+
+        Args:
+            providers: 新的 API 提供商列表
+        """
+        self.swap_provider_set(await self.build_provider_set(providers))
+
+    def _close_drained(self) -> None:
+        """关闭已排空的旧集合中、不再被当前集合或其他未排空集合使用的客户端"""
+        live = [self.provider_set] + [s for s in self._retired if s.active]
+        in_use = {id(client) for provider_set in live for client in provider_set.clients.values()}
+        closed: Set[int] = set()
+        for provider_set in self._retired:
+            if not provider_set.active:
+                provider_set.close_unused(in_use, closed)
+        self._retired = [s for s in self._retired if s.active]
+
+    def _release(self, provider_set: ProviderSet) -> None:
+        """请求结束，释放对提供商集合的引用"""
+        provider_set.active -= 1
+        if provider_set.retired and not provider_set.active:
+            self._close_drained()
 
-    def _select_provider(self) -> ApiProvider:
+    def _select_provider(
+        self,
+        tokens: int = 0,
+        provider_set: Optional[ProviderSet] = None,
+        candidates: Optional[Dict[str, str]] = None,
+        exclude: Optional[Set[str]] = None,
+        provider_type: Optional[str] = None
+    ) -> ApiProvider:
         """
         选择一个可用的 API 提供商（加权轮询）
+
+        Ollama 提供商已加载请求的模型时（/api/ps），权重乘以 LOADED_MODEL_WEIGHT。
+        处于熔断状态的提供商不被选择，除非没有其他提供商。
+
+        Args:
+            tokens: 本次请求估算的 token 数
+            provider_set: 使用的提供商集合，默认为当前集合
+            candidates: 能够服务该模型的提供商（路由结果），为空时考虑所有提供商
+            exclude: 优先避开的提供商（本次请求中失败过的），没有其他选择时仍会使用
+            provider_type: 只考虑该类型的提供商，为空时不限制
+
+        Raises:
+            LookupError: 没有该类型的提供商
         """
-        current_time = time.time()
+        provider_set = provider_set or self.provider_set
+        providers = provider_set.providers
+        if candidates:
+            routed = [p for p in providers if p.provider_name in candidates]
+            if not routed:
+                # 路由表与提供商集合不一致（不应发生），退回到所有提供商的 default_model
+                logger.warning(
+                    f"No provider in the current set serves route {list(candidates)}, "
+                    f"falling back to all providers"
+                )
+            providers = routed or providers
+        if provider_type:
+            providers = [p for p in providers if p.type == provider_type]
+            if not providers:
+                raise LookupError(f"No {provider_type} provider serves this model")
+        if exclude:
+            providers = [p for p in providers if p.provider_name not in exclude] or providers
+        providers = [p for p in providers if not self.breaker.is_open(p.provider_name)] or providers
+        wait_times = {
+            p.provider_name: provider_set.limiters[p.provider_name].wait_time(tokens)
+            for p in providers
+        }
+
+        # 只将当前可用的提供商添加到候选列表中
         available_providers = []
-        
-        # 计算所有提供商中等待时间最短的
-        min_wait_time = min(
-            (1.0 / p.rate_limit) - (current_time - p.last_request_time)
-            for p in self.providers
-        )
-        
+        for provider in providers:
+            if wait_times[provider.provider_name] <= 0:
+                weight = provider.weight
+                if provider.type == "ollama" and self._model_loaded(provider_set, provider, candidates):
+                    weight *= LOADED_MODEL_WEIGHT
+                available_providers.extend([provider] * weight)
+
         # 如果所有提供商都需要等待，直接返回等待时间最短的
-        if min_wait_time > 0:
-            return min(self.providers, key=lambda p: 
-                (1.0 / p.rate_limit) - (current_time - p.last_request_time))
-        
-        # 只将当前可用的提供商添加到候选列表中
-        for provider in self.providers:
-            wait_time = (1.0 / provider.rate_limit) - (current_time - provider.last_request_time)
-            if wait_time <= 0:
-                available_providers.extend([provider] * provider.weight)
-        
         if not available_providers:
-            return min(self.providers, key=lambda p: 
-                p.last_request_time + (1.0 / p.rate_limit))
-            
+            return min(providers, key=lambda p: wait_times[p.provider_name])
+
         return random.choice(available_providers)
 
+    @staticmethod
+    def _model_loaded(
+        provider_set: ProviderSet,
+        provider: ApiProvider,
+        candidates: Optional[Dict[str, str]]
+    ) -> bool:
+        """Ollama 提供商是否已加载本次请求的模型（没有标签的名称按 :latest 处理）"""
+        loaded = provider_set.clients[provider.provider_name].loaded_models
+        if not loaded:
+            return False
+        name = (candidates or {}).get(provider.provider_name) or provider.default_model
+        return name in loaded or f"{name}:latest" in loaded
+
+    def choose_type(self, model: Dict[str, str], tokens: int = 0) -> str:
+        """
+        按正常的加权选择确定本次请求使用的提供商类型（不预扣额度）
+
+        Args:
+            model: 路由结果
+            tokens: 估算的 token 数
+
+        Returns:
+            "openai" 或 "ollama"
+        """
+        return self._select_provider(tokens, self.provider_set, model).type
+
     async def chat_completion(
         self, 
         model: Dict[str, str],
         messages: list,
         stream: bool = True,
+        num_predict: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
         **kwargs
     ) -> AsyncGenerator[Dict[Any, Any], None]:
-        """调用 API 进行聊天补全"""
-        while True:
-            provider = self._select_provider()
-            logger.info(f"Selected provider: {provider.provider_name}")
-            
-            current_time = time.time()
-            # 计算等待时间，如果等待时间小于0，则不等待，直接请求，否则等待.等待时间为1/rate_limit - (当前时间 - 上次请求时间),rate 为 1000的时候，等待时间为1/1000 - (当前时间 - 上次请求时间)
-            wait_time = (1.0 / provider.rate_limit) - (current_time - provider.last_request_time)
-            
-            if wait_time > 0:
-                await asyncio.sleep(wait_time)
-            
-            try:
-                provider.last_request_time = time.time()
-                client = self.clients[provider.provider_name]
-                
-                # 从映射中获取当前提供商的模型
-                provider_model = model[provider.provider_name]
-                
-                stream = client.chat.completions.create(
-                    model=provider_model,
-                    messages=messages,
-                    stream=True,
-                    **kwargs
-                )
-                
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        yield {
-                            "message": {
-                                "role": "assistant",
-                                "content": chunk.choices[0].delta.content
-                            },
-                            "done": False
-                        }
+        """
+        调用 API 进行聊天补全
+
+        上游在 ttft_timeout 内没有返回第一个 token、两个 token 之间超过 stall_timeout 或中途出错时，
+        换用其他提供商，并把已经发出的内容作为 assistant 前缀续写，调用方看到的是一个连续、不重复的流。
+
+        num_predict 和 stop 转发给上游（max_tokens、前 MAX_UPSTREAM_STOP 个 stop），同时在本地执行：
+        上游忽略限制时，生成到 num_predict 个分块（流式接口一个分块通常是一个 token）或遇到停止序列就关闭上游连接，
+        done_reason 分别为 length 和 stop。
+
+        Args:
+            model: 路由结果，能够服务该模型的提供商到上游模型名的映射
+            messages: 消息列表
+            stream: 是否流式
+            num_predict: 请求的最大生成 token 数，同时用于估算速率限制额度
+            stop: 停止序列，输出中不包含停止序列本身
+            deadline: 整个请求的截止时间（time.monotonic()），为 None 时不限制
+            **kwargs: 原样合并到上游请求体中的参数（temperature、response_format 等）
+
+        Raises:
+            DeadlineExceeded: 超过截止时间
+
+        最后一个分块带有 Ollama 格式的统计信息（纳秒）：
+            total_duration: 整个请求的耗时，包括速率限制等待和失败的提供商尝试
+            load_duration: 最后一次尝试从发出请求到收到响应头的时间（含连接、TLS 和上游排队）
+            prompt_eval_duration: 最后一次尝试从收到响应头到第一个 token 的时间
+            eval_duration: 从调用方收到第一个 token 到最后一个 token 的时间
+        """
+        start_time = time.monotonic_ns()
+        # 预估本次请求的 token 消耗：prompt 长度 + 最大生成长度
+        prompt_tokens = estimate_messages(messages)
+        estimated_tokens = prompt_tokens + (num_predict or DEFAULT_COMPLETION_TOKENS)
+        # 已经发给调用方的内容，换用提供商时作为续写前缀
+        emitted: List[str] = []
+        emitted_counter = TokenCounter()
+        # 已经发给调用方的分块数，本地执行 num_predict
+        emitted_chunks = 0
+        first_token_time = last_token_time = 0
+        # 本次请求中失败过的提供商，重试时优先避开
+        failed: Set[str] = set()
+        # TTFT / token 间隔超时，在 yield 之前总是解除，不会影响调用方
+        watchdog = _Watchdog(deadline)
+        trace = current_trace()
+
+        # 固定本次请求使用的提供商集合，热加载不影响进行中的请求
+        provider_set = self.provider_set
+        provider_set.active += 1
+        try:
+            max_attempts = MAX_ATTEMPTS_PER_PROVIDER * max(1, len(model) or len(provider_set.providers))
+            for attempt in range(1, max_attempts + 1):
+                with span("select"):
+                    provider = self._select_provider(
+                        estimated_tokens, provider_set, model, exclude=failed, provider_type="openai"
+                    )
+                logger.info(f"Selected provider: {provider.provider_name}")
+
+                limiter = provider_set.limiters[provider.provider_name]
+                reservation = limiter.reserve(estimated_tokens)
+                counter = TokenCounter()
+                usage = None
+                dispatched = False
+                prefix = "".join(emitted)
+                attempt_prompt_tokens = prompt_tokens + estimate_tokens(prefix)
+                try:
+                    if reservation.wait > 0:
+                        if deadline is not None and time.monotonic() + reservation.wait >= deadline:
+                            raise DeadlineExceeded("Deadline exceeded while waiting for rate limit")
+                        with span("rate_limit_wait"):
+                            await asyncio.sleep(reservation.wait)
+
+                    pool = provider_set.clients[provider.provider_name]
                 
-                yield {
-                    "message": {"role": "assistant", "content": ""},
-                    "done": True,
-                    "done_reason": "stop"
-                }
-                break
+                    # 从映射中获取当前提供商的模型
+                    provider_model = model.get(provider.provider_name) or provider.default_model
+
+                    request_messages = messages
+                    if prefix:
+                        request_messages = list(messages) + [{"role": "assistant", "content": prefix}]
+                    payload = dict(kwargs, model=provider_model, messages=request_messages, stream=True)
+                    if num_predict:
+                        # 续写时只需要生成剩余的部分
+                        payload["max_tokens"] = max(1, num_predict - emitted_chunks)
+                    if stop:
+                        payload["stop"] = stop[:MAX_UPSTREAM_STOP]
+                    if provider.stream_usage:
+                        payload["stream_options"] = {"include_usage": True}
+
+                    dispatch_time = time.monotonic_ns()
+                    ttft_limit = _limit(deadline, provider.ttft_timeout)
+                    finish_reason = None
+                    attempt_first_token_time = 0
+                    prefix_filter = _PrefixFilter(prefix)
+                    stop_filter = _StopFilter(stop or [])
+                    dispatched = True
+                    watchdog.arm(ttft_limit)
+                    try:
+                        response = await pool.open_chat(payload, _auth_headers(reservation))
+                    except asyncio.CancelledError:
+                        watchdog.check()
+                        raise
+                    finally:
+                        watchdog.disarm()
+                    # 上游已返回响应头，视为模型已就绪
+                    headers_time = time.monotonic_ns()
+                    if trace is not None:
+                        trace.add("upstream_headers", headers_time - dispatch_time)
+
+                    chunks = iter_sse(response)
+                    try:
+                        while True:
+                            limit = _limit(deadline, provider.stall_timeout) if attempt_first_token_time else ttft_limit
+                            watchdog.arm(limit)
+                            try:
+                                chunk = await chunks.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            except asyncio.CancelledError:
+                                watchdog.check()
+                                raise
+                            finally:
+                                watchdog.disarm()
+                            if chunk.get("usage"):
+                                usage = chunk["usage"]
+                            if not chunk.get("choices"):
+                                continue
+                            choice = chunk["choices"][0]
+                            if choice.get("finish_reason"):
+                                finish_reason = choice["finish_reason"]
+                            content = (choice.get("delta") or {}).get("content")
+                            if not content:
+                                continue
+                            counter.add(content)
+                            now = time.monotonic_ns()
+                            if not attempt_first_token_time:
+                                attempt_first_token_time = now
+                            # 续写时丢弃上游重复输出的前缀
+                            content = prefix_filter.feed(content)
+                            if not content:
+                                continue
+                            content, stopped = stop_filter.feed(content)
+                            if content:
+                                last_token_time = now
+                                if not first_token_time:
+                                    first_token_time = now
+                                emitted.append(content)
+                                emitted_counter.add(content)
+                                emitted_chunks += 1
+                                yield {
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": content
+                                    },
+                                    "done": False
+                                }
+                            # 上游没有执行限制时在本地结束，关闭连接停止生成
+                            if stopped:
+                                finish_reason = "stop"
+                                break
+                            if num_predict and emitted_chunks >= num_predict:
+                                finish_reason = "length"
+                                break
+                    finally:
+                        # 提前结束（出错、超时或调用方关闭生成器）时立即释放上游连接
+                        await chunks.aclose()
+                        await response.aclose()
+
+                    # 暂存的末尾内容不是停止序列
+                    content = stop_filter.flush()
+                    if content:
+                        last_token_time = time.monotonic_ns()
+                        if not first_token_time:
+                            first_token_time = last_token_time
+                        emitted.append(content)
+                        emitted_counter.add(content)
+                        yield {"message": {"role": "assistant", "content": content}, "done": False}
+
+                    end_time = time.monotonic_ns()
+                    if not attempt_first_token_time:
+                        attempt_first_token_time = end_time
+                    if not first_token_time:
+                        first_token_time = last_token_time = end_time
+                    if trace is not None:
+                        trace.add("ttft", attempt_first_token_time - headers_time)
+                        trace.add("stream", last_token_time - first_token_time)
                 
-            except Exception as e:
-                logger.error(f"Error with provider {provider.provider_name}: {str(e)}")
-                # 如果有错误，尝试下一个提供商
-                continue
+                    yield {
+                        "message": {"role": "assistant", "content": ""},
+                        "done": True,
+                        "done_reason": finish_reason or "stop",
+                        "total_duration": end_time - start_time,
+                        "load_duration": headers_time - dispatch_time,
+                        "prompt_eval_count": usage["prompt_tokens"] if usage and not prefix else prompt_tokens,
+                        "prompt_eval_duration": attempt_first_token_time - headers_time,
+                        "eval_count": usage["completion_tokens"] if usage and not prefix else emitted_counter.count,
+                        "eval_duration": last_token_time - first_token_time
+                    }
+                    break
+
+                except DeadlineExceeded:
+                    logger.error(f"Deadline exceeded with provider {provider.provider_name}")
+                    raise
+                except Exception as e:
+                    logger.error(f"Error with provider {provider.provider_name}: {str(e) or type(e).__name__}")
+                    if _key_error(limiter, reservation, e) and attempt < max_attempts:
+                        # 换用同一提供商的其他 key
+                        continue
+                    failed.add(provider.provider_name)
+                    if not _client_error(e):
+                        self.breaker.record_failure(provider.provider_name)
+                    if attempt == max_attempts:
+                        raise
+                    # 如果有错误，尝试下一个提供商（已发出的内容由下一个提供商续写）
+                    continue
+                finally:
+                    # 用上游返回的实际用量校正预扣额度，没有 usage 时使用本地统计；
+                    # 请求已经发出时上游可能已按 prompt 计费，至少扣除 prompt 部分
+                    if usage is not None:
+                        limiter.reconcile(reservation, usage["total_tokens"])
+                    elif dispatched:
+                        limiter.reconcile(reservation, attempt_prompt_tokens + counter.count)
+                    else:
+                        limiter.reconcile(reservation, 0)
+        finally:
+            self._release(provider_set)
+
+    async def open_relay(
+        self,
+        path: str,
+        model: Dict[str, str],
+        body: Dict[str, Any],
+        client_model: str,
+        estimated_tokens: int,
+        provider_type: str = "openai"
+    ) -> "Relay":
+        """
+        选择提供商并打开透传请求（OpenAI 兼容接口）
 
-    async def embeddings(self, model: str, input_text: str) -> Dict[str, Any]:
+        与 chat_completion 使用相同的提供商选择、速率限制和模型映射；收到响应头之前的失败会换用其他提供商重试，
+        之后上游的字节原样转发，不做解析。
+
+        Args:
+            path: 上游路径，如 /chat/completions
+            model: 路由结果，能够服务该模型的提供商到上游模型名的映射
+            body: 客户端的请求体，除 model 外原样转发
+            client_model: 客户端请求的模型名，响应中的上游模型名会改回该名称
+            estimated_tokens: 预估的 token 消耗，用于速率限制
+            provider_type: 使用的提供商类型；ollama 提供商的 path 为 Ollama 原生路径（如 /api/chat）
+
+        Returns:
+            已收到响应头的 Relay，调用方负责迭代并关闭
+
+        Raises:
+            UpstreamError: 所有尝试都失败时，最后一次上游返回的错误
+        """
+        provider_set = self.provider_set
+        provider_set.active += 1
+        failed: Set[str] = set()
+        try:
+            max_attempts = MAX_ATTEMPTS_PER_PROVIDER * max(1, len(model) or len(provider_set.providers))
+            for attempt in range(1, max_attempts + 1):
+                with span("select"):
+                    provider = self._select_provider(
+                        estimated_tokens, provider_set, model, exclude=failed, provider_type=provider_type
+                    )
+                logger.info(f"Selected provider: {provider.provider_name}")
+                limiter = provider_set.limiters[provider.provider_name]
+                reservation = limiter.reserve(estimated_tokens)
+                try:
+                    if reservation.wait > 0:
+                        with span("rate_limit_wait"):
+                            await asyncio.sleep(reservation.wait)
+                    provider_model = model.get(provider.provider_name) or provider.default_model
+                    with span("upstream_headers"):
+                        response = await provider_set.clients[provider.provider_name].open(
+                            "POST", path, dict(body, model=provider_model), _auth_headers(reservation)
+                        )
+                except BaseException as e:
+                    # 请求没有成功，上游最多按 prompt 计费；这里不区分，直接退回额度
+                    limiter.reconcile(reservation, 0)
+                    if _key_error(limiter, reservation, e) and attempt < max_attempts:
+                        logger.error(f"Error with provider {provider.provider_name}: {str(e)}")
+                        continue
+                    if isinstance(e, Exception) and not _client_error(e):
+                        self.breaker.record_failure(provider.provider_name)
+                    if not isinstance(e, Exception) or attempt == max_attempts or _client_error(e):
+                        raise
+                    logger.error(f"Error with provider {provider.provider_name}: {str(e)}")
+                    failed.add(provider.provider_name)
+                    continue
+                return Relay(self, provider_set, limiter, reservation, response, provider_model, client_model)
+        except BaseException:
+            self._release(provider_set)
+            raise
+
+    async def embeddings(self, model: Dict[str, str], input_text: Any) -> List[List[float]]:
         """
         生成文本嵌入向量
         
         Args:
-            model: 模型名称
-            input_text: 输入文本
+            model: 路由结果，能够服务该模型的提供商到上游模型名的映射
+            input_text: 输入文本或文本列表
         
         Returns:
-            嵌入向量数据
+            嵌入向量列表
         """
+        provider_set = self.provider_set
+        provider = self._select_provider(0, provider_set, model, provider_type="openai")
+        pool = provider_set.clients[provider.provider_name]
         try:
-            response = await self.client.embeddings.create(
-                model=model,
-                input=input_text
-            )
-            return response.data[0].embedding
+            response = await pool.open("POST", "/embeddings", {
+                "model": model.get(provider.provider_name) or provider.default_model,
+                "input": input_text
+            })
+            try:
+                data = json.loads(await response.aread())
+            finally:
+                await response.aclose()
+            return [item["embedding"] for item in data["data"]]
         except Exception as e:
             logger.error(f"Embeddings error: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
@@ -0,0 +1,318 @@
+"""
+多实例协调
+
+多个实例共用同一组提供商 API key 时，速率限制和熔断状态需要在实例之间共享。Coordinator 是共享存储的接口：
+    LocalCoordinator  进程内实现（单实例，默认；速率限制只在本地执行）
+    RedisCoordinator  Redis 协议实现，Redis / Valkey / KeyDB 等兼容服务均可，不依赖第三方库
+
+速率限制按时间窗口计数，实例一次领取一批额度（limiter._LeasedBucket），请求在本地扣除，
+额度不足时在后台续租，请求路径上没有网络往返。熔断状态由各实例上报失败、定期同步到本地。
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import unquote, urlparse
+from ..core.config import CoordinationSettings
+
+logger = logging.getLogger(__name__)
+
+class CoordinationError(Exception):
+    """共享存储返回错误或不可用"""
+
+class Coordinator:
+    """共享存储接口"""
+
+    # 是否在实例之间共享；为 False 时速率限制只使用本地令牌桶
+    shared = False
+
+    async def take(self, key: str, amount: int, limit: int, ttl: float) -> int:
+        """
+        从计数器 key 领取最多 amount 个额度，计数器总量不超过 limit
+
+        Args:
+            key: 计数器（通常带有时间窗口编号）
+            amount: 申请的数量
+            limit: 计数器上限
+            ttl: 计数器的过期时间（秒）
+
+        Returns:
+            实际领取的数量，0 表示已用完
+        """
+        raise NotImplementedError
+
+    async def incr(self, key: str, ttl: float) -> int:
+        """计数器加一并设置过期时间，返回新的值"""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        """设置带过期时间的值"""
+        raise NotImplementedError
+
+    async def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """批量读取，不存在的键为 None"""
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+class LocalCoordinator(Coordinator):
+    """进程内实现"""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, float]] = {}
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry[0]
+
+    def _put(self, key: str, value: str, ttl: float) -> None:
+        self._values[key] = (value, time.monotonic() + ttl)
+        # 过期的键在读取时删除；数量较多时顺便清理，避免以窗口编号命名的键不断累积
+        if len(self._values) > 10000:
+            now = time.monotonic()
+            self._values = {k: v for k, v in self._values.items() if v[1] > now}
+
+    async def take(self, key: str, amount: int, limit: int, ttl: float) -> int:
+        used = int(self._get(key) or 0)
+        granted = max(0, min(amount, limit - used))
+        self._put(key, str(used + granted), ttl)
+        return granted
+
+    async def incr(self, key: str, ttl: float) -> int:
+        value = int(self._get(key) or 0) + 1
+        self._put(key, str(value), ttl)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._put(key, value, ttl)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        return [self._get(key) for key in keys]
+
+class RedisCoordinator(Coordinator):
+    """
+    Redis 协议实现
+
+    只使用 INCRBY、INCR、PEXPIRE、SET PX、MGET 等基础命令，兼容实现也可以使用。
+    所有命令通过一个连接按顺序发送，同一操作的多条命令在一次往返中发出；出错时断开，下次使用时重连。
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "", timeout: float = 2.0):
+        """
+        Args:
+            url: redis://[:password@]host[:port][/db]
+            prefix: 所有键的前缀
+            timeout: 单次往返的超时（秒）
+        """
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported coordination url: {url}")
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = f"{prefix}:" if prefix else ""
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await self._roundtrip(setup)
+
+    async def execute(self, *commands: Tuple) -> List:
+        """
+        在一次往返中执行多条命令
+
+        Returns:
+            各命令的返回值
+
+        Raises:
+            CoordinationError: 连接失败、超时或任一命令返回错误
+        """
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await asyncio.wait_for(self._connect(), self.timeout)
+                return await asyncio.wait_for(self._roundtrip(commands), self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, CoordinationError) as e:
+                self._disconnect()
+                if isinstance(e, CoordinationError):
+                    raise
+                raise CoordinationError(f"Redis {self.host}:{self.port} unavailable: {str(e) or type(e).__name__}")
+            except asyncio.CancelledError:
+                # 回复可能还在路上，连接状态未知
+                self._disconnect()
+                raise
+
+    async def _roundtrip(self, commands) -> List:
+        self._writer.write(b"".join(_encode(command) for command in commands))
+        await self._writer.drain()
+        replies = [await _read_reply(self._reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, CoordinationError):
+                raise reply
+        return replies
+
+    def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def take(self, key: str, amount: int, limit: int, ttl: float) -> int:
+        key = self.prefix + key
+        used, _ = await self.execute(("INCRBY", key, amount), ("PEXPIRE", key, int(ttl * 1000)))
+        # 超出上限的部分不退回：该窗口已用完，多计的数量不影响结果
+        return max(0, min(amount, limit - (used - amount)))
+
+    async def incr(self, key: str, ttl: float) -> int:
+        key = self.prefix + key
+        value, _ = await self.execute(("INCR", key), ("PEXPIRE", key, int(ttl * 1000)))
+        return value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self.execute(("SET", self.prefix + key, value, "PX", int(ttl * 1000)))
+
+    async def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        (values,) = await self.execute(("MGET", *(self.prefix + key for key in keys)))
+        return [value.decode() if value is not None else None for value in values]
+
+    async def aclose(self) -> None:
+        async with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                try:
+                    await self._writer.wait_closed()
+                except OSError:
+                    pass
+            self._reader = self._writer = None
+
+def _encode(command: Tuple) -> bytes:
+    parts = [str(arg).encode() if not isinstance(arg, bytes) else arg for arg in command]
+    return b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+
+async def _read_reply(reader: asyncio.StreamReader):
+    """读取一个 RESP 回复；错误回复以 CoordinationError 返回（不抛出，保证读完同一批的所有回复）"""
+    line = await reader.readuntil(b"\r\n")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return CoordinationError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise CoordinationError(f"Unexpected reply: {line!r}")
+
+def create_coordinator(config: CoordinationSettings) -> Coordinator:
+    """根据配置创建共享存储"""
+    if config.backend == "redis":
+        return RedisCoordinator(config.redis_url, config.key_prefix)
+    return LocalCoordinator()
+
+class CircuitBreaker:
+    """
+    提供商熔断
+
+    circuit_window 秒内失败 circuit_threshold 次的提供商在 circuit_cooldown 秒内不再被选择（没有其他提供商时仍会使用）。
+    失败在后台上报到共享存储；熔断状态保存在本地，共享时每 sync_interval 秒同步一次，请求路径上只读本地状态。
+    """
+
+    def __init__(self, coordinator: Coordinator, config: CoordinationSettings):
+        """
+        Args:
+            coordinator: 共享存储
+            config: 协调配置（阈值、时间窗口、冷却时间、同步间隔）
+        """
+        self.coordinator = coordinator
+        self.threshold = config.circuit_threshold
+        self.window = config.circuit_window
+        self.cooldown = config.circuit_cooldown
+        self.sync_interval = config.sync_interval
+        # 提供商名称 -> 熔断结束时间（time.time()）
+        self._open_until: Dict[str, float] = {}
+        self._pending: Set[asyncio.Task] = set()
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def is_open(self, provider_name: str) -> bool:
+        """提供商是否处于熔断状态"""
+        return self._open_until.get(provider_name, 0.0) > time.time()
+
+    def record_failure(self, provider_name: str) -> None:
+        """记录一次失败（后台上报，不等待）"""
+        if self.threshold <= 0:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._report(provider_name))
+        except RuntimeError:
+            return
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _report(self, provider_name: str) -> None:
+        try:
+            failures = await self.coordinator.incr(f"cb:{provider_name}:failures", self.window)
+            if failures >= self.threshold and not self.is_open(provider_name):
+                until = time.time() + self.cooldown
+                self._open_until[provider_name] = until
+                await self.coordinator.set(f"cb:{provider_name}:open", repr(until), self.cooldown)
+                logger.warning(f"Circuit opened for provider {provider_name} for {self.cooldown}s")
+        except CoordinationError as e:
+            logger.warning(f"Failed to report failure of {provider_name}: {str(e)}")
+
+    async def sync(self, provider_names: Iterable[str]) -> None:
+        """从共享存储读取各提供商的熔断状态"""
+        names = list(provider_names)
+        values = await self.coordinator.get_many([f"cb:{name}:open" for name in names])
+        for name, value in zip(names, values):
+            if value is not None:
+                self._open_until[name] = max(self._open_until.get(name, 0.0), float(value))
+
+    def start(self, provider_names: Callable[[], Iterable[str]]) -> None:
+        """开始定期同步（只在共享存储时需要）"""
+        if not self.coordinator.shared or self.threshold <= 0 or self._sync_task is not None:
+            return
+        self._sync_task = asyncio.get_running_loop().create_task(self._sync_loop(provider_names))
+
+    async def _sync_loop(self, provider_names: Callable[[], Iterable[str]]) -> None:
+        while True:
+            try:
+                await self.sync(provider_names())
+            except CoordinationError as e:
+                logger.warning(f"Circuit state sync failed: {str(e)}")
+            await asyncio.sleep(self.sync_interval)
+
+    async def aclose(self) -> None:
+        tasks = list(self._pending)
+        if self._sync_task is not None:
+            tasks.append(self._sync_task)
+            self._sync_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
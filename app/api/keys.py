@@ -0,0 +1,117 @@
+import hashlib
+import heapq
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from ..core.config import ApiProvider
+from .coordination import Coordinator
+from .limiter import RateLimiter, Reservation
+
+logger = logging.getLogger(__name__)
+
+# 换用同一提供商其他 key 的状态码：限流 / 额度用完（429）、key 无效或被停用（401、402、403）
+KEY_ERROR_STATUS = {401, 402, 403, 429}
+
+class ApiKey:
+    """key 池中的一个 key 及其速率限制状态"""
+
+    __slots__ = ("value", "limiter", "cooling_until")
+
+    def __init__(self, value: str, limiter: RateLimiter):
+        self.value = value
+        self.limiter = limiter
+        # 冷却结束时间（time.monotonic()），0 表示可用
+        self.cooling_until = 0.0
+
+class KeyPool:
+    """
+    一个提供商的多个 API key，接口与 RateLimiter 相同（wait_time / reserve / reconcile）
+
+    每个 key 有独立的 RateLimiter，rate_limit / rpm / tpm 为每个 key 的限制，总吞吐量随 key 数线性增长。
+    可用的 key 按使用顺序轮换，队首是最久没有使用、余量最多的 key，选择和轮换都是 O(1)。
+    返回 429 或额度、鉴权错误的 key 移入冷却堆，到期后回到队尾。
+    """
+
+    def __init__(self, provider: ApiProvider, coordinator: Optional[Coordinator] = None, lease_fraction: float = 0.1):
+        """
+        Args:
+            provider: 提供商配置（api_keys、速率限制、key_cooldown）
+            coordinator: 速率限制使用的共享存储
+            lease_fraction: 每次从共享存储领取的额度比例
+        """
+        self.provider_name = provider.provider_name
+        self.cooldown = provider.key_cooldown
+        self.keys = [
+            ApiKey(value, RateLimiter(
+                provider.rate_limit, rpm=provider.rpm, tpm=provider.tpm, coordinator=coordinator,
+                # 共享计数器按 key 的摘要命名，各实例中 key 的顺序不同也能对应
+                key=f"{provider.provider_name}:{hashlib.sha256(value.encode()).hexdigest()[:12]}",
+                lease_fraction=lease_fraction
+            ))
+            for value in dict.fromkeys(provider.api_keys)
+        ]
+        self._by_value: Dict[str, ApiKey] = {key.value: key for key in self.keys}
+        self._ready: Deque[ApiKey] = deque(self.keys)
+        # (冷却结束时间, 序号, key)
+        self._cooling: List[Tuple[float, int, ApiKey]] = []
+        self._sequence = 0
+
+    def _head(self) -> Tuple[ApiKey, float]:
+        """下一个使用的 key 及其剩余冷却时间"""
+        now = time.monotonic()
+        while self._cooling and self._cooling[0][0] <= now:
+            _, _, key = heapq.heappop(self._cooling)
+            key.cooling_until = 0.0
+            self._ready.append(key)
+        if self._ready:
+            return self._ready[0], 0.0
+        # 所有 key 都在冷却，使用最早恢复的一个
+        until, _, key = self._cooling[0]
+        return key, until - now
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """发出一个消耗 tokens 的请求需要等待的时间"""
+        key, cooling = self._head()
+        return max(cooling, key.limiter.wait_time(tokens))
+
+    def reserve(self, tokens: int = 0) -> Reservation:
+        """用队首的 key 预扣额度，并把它移到队尾"""
+        key, cooling = self._head()
+        if not cooling:
+            self._ready.rotate(-1)
+        reservation = key.limiter.reserve(tokens)
+        reservation.wait = max(reservation.wait, cooling)
+        reservation.key = key.value
+        return reservation
+
+    def reconcile(self, reservation: Reservation, actual_tokens: int) -> None:
+        """根据实际用量校正预扣的额度"""
+        key = self._by_value.get(reservation.key)
+        if key is not None:
+            key.limiter.reconcile(reservation, actual_tokens)
+
+    def penalize(self, reservation: Reservation, retry_after: Optional[float] = None) -> bool:
+        """
+        暂停使用返回限流或额度错误的 key
+
+        Args:
+            reservation: 出错请求的预扣记录
+            retry_after: 上游要求的等待时间（秒），没有时使用 key_cooldown
+
+        Returns:
+            是否还有其他可用的 key（有时调用方可以换用同一提供商重试）
+        """
+        key = self._by_value.get(reservation.key)
+        if key is None:
+            return False
+        if not key.cooling_until:
+            key.cooling_until = time.monotonic() + (retry_after if retry_after is not None else self.cooldown)
+            self._ready.remove(key)
+            self._sequence += 1
+            heapq.heappush(self._cooling, (key.cooling_until, self._sequence, key))
+            logger.warning(
+                f"API key {key.value[:6]}... of {self.provider_name} paused for "
+                f"{key.cooling_until - time.monotonic():.0f}s, {len(self._ready)} keys left"
+            )
+        return bool(self._ready)
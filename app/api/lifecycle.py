@@ -0,0 +1,172 @@
+"""
+模型生命周期接口（create / pull / push）的进度模拟
+
+两种模式（server.lifecycle_profile）：
+    instant    不等待，立即返回全部进度事件，用于测试
+    realistic  按 lifecycle_bandwidth 模拟逐层传输，模型大小取自数据库中声明的 size
+
+所有进行中的模拟共享一个 ProgressClock：每 lifecycle_tick 秒只有一个定时器，到期时唤醒所有等待者，
+而不是每个请求每一步各自 sleep，上千个并发拉取的开销也很小。
+"""
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from ..core.config import settings
+
+# 数据库中没有声明大小时使用的模型大小（字节）
+DEFAULT_MODEL_SIZE = 4661216384
+
+# 模型权重之外的小文件层（媒体类型, 大小）
+_SMALL_LAYERS = (
+    ("application/vnd.ollama.image.template", 1429),
+    ("application/vnd.ollama.image.license", 7020),
+    ("application/vnd.ollama.image.params", 96),
+)
+
+class ProgressClock:
+    """共享的进度定时器，只在有等待者时运行"""
+
+    def __init__(self, interval: float = 0.2):
+        """
+        Args:
+            interval: 唤醒间隔（秒）
+        """
+        self.interval = interval
+        self._waiter: Optional[asyncio.Future] = None
+
+    async def tick(self) -> float:
+        """
+        等待下一次唤醒
+
+        Returns:
+            唤醒时的事件循环时间
+        """
+        if self._waiter is None:
+            loop = asyncio.get_running_loop()
+            self._waiter = loop.create_future()
+            loop.call_later(self.interval, self._fire)
+        # 单个等待者被取消时不能取消共享的 future
+        return await asyncio.shield(self._waiter)
+
+    def _fire(self) -> None:
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(asyncio.get_running_loop().time())
+
+    async def sleep(self, seconds: float) -> None:
+        """按唤醒间隔等待至少 seconds 秒"""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + seconds
+        while loop.time() < end:
+            await self.tick()
+
+def model_layers(name: str, size: int) -> List[Tuple[str, int]]:
+    """
+    模型的各层（sha256 摘要, 大小），摘要由模型名确定，同一模型每次相同
+
+    Args:
+        name: 模型名称
+        size: 模型总大小（字节）
+
+    Returns:
+        权重层在前，随后是模板、许可证等小文件层
+    """
+    small = [
+        (hashlib.sha256(f"{name}/{media_type}".encode()).hexdigest(), layer_size)
+        for media_type, layer_size in _SMALL_LAYERS
+    ]
+    weights = max(0, size - sum(layer_size for _, layer_size in small))
+    return [(hashlib.sha256(f"{name}/model".encode()).hexdigest(), weights)] + small
+
+class Lifecycle:
+    """按当前配置生成 create / pull / push 的进度事件"""
+
+    def __init__(self, db):
+        """
+        Args:
+            db: 数据库管理器（模型声明的大小）
+        """
+        self.db = db
+        self.clock = ProgressClock()
+
+    def _realistic(self) -> bool:
+        # 每次读取配置，热加载后立即生效
+        server = settings.server
+        self.clock.interval = max(0.01, server.lifecycle_tick)
+        return server.lifecycle_profile == "realistic"
+
+    def model_size(self, name: str) -> int:
+        """数据库中声明的模型大小，没有时为 DEFAULT_MODEL_SIZE"""
+        model = self.db.get_models_db().get(name) or {}
+        return model.get("size") or DEFAULT_MODEL_SIZE
+
+    async def create(self) -> AsyncIterator[Dict[str, Any]]:
+        """创建模型的进度事件"""
+        realistic = self._realistic()
+        steps = ["reading model metadata", "creating system layer", "success"]
+        for i, status in enumerate(steps):
+            if realistic and i:
+                await self.clock.sleep(settings.server.lifecycle_step_delay)
+            yield {"status": status}
+
+    async def pull(self, name: str) -> AsyncIterator[Dict[str, Any]]:
+        """拉取模型的进度事件"""
+        realistic = self._realistic()
+        yield {"status": "pulling manifest"}
+        async for event in self._transfer("pulling", model_layers(name, self.model_size(name)), realistic):
+            yield event
+        for status in ("verifying sha256 digest", "writing manifest", "success"):
+            if realistic:
+                await self.clock.sleep(settings.server.lifecycle_step_delay)
+            yield {"status": status}
+
+    async def push(self, name: str) -> AsyncIterator[Dict[str, Any]]:
+        """推送模型的进度事件"""
+        realistic = self._realistic()
+        yield {"status": "retrieving manifest"}
+        async for event in self._transfer("pushing", model_layers(name, self.model_size(name)), realistic):
+            yield event
+        for status in ("pushing manifest", "success"):
+            if realistic:
+                await self.clock.sleep(settings.server.lifecycle_step_delay)
+            yield {"status": status}
+
+    async def _transfer(
+        self,
+        verb: str,
+        layers: List[Tuple[str, int]],
+        realistic: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        逐层传输的进度事件
+
+        按 lifecycle_bandwidth 计算每次唤醒时已传输的字节数，一层完成后剩余的时间计入下一层。
+        """
+        bandwidth = settings.server.lifecycle_bandwidth
+        if not realistic or bandwidth <= 0:
+            for digest, size in layers:
+                yield _progress(verb, digest, size, size)
+            return
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        offset = 0
+        i = 0
+        while i < len(layers):
+            transferred = (await self.clock.tick() - start) * bandwidth
+            while i < len(layers):
+                digest, size = layers[i]
+                completed = min(size, max(0, int(transferred - offset)))
+                yield _progress(verb, digest, size, completed)
+                if completed < size:
+                    break
+                offset += size
+                i += 1
+
+def _progress(verb: str, digest: str, total: int, completed: int) -> Dict[str, Any]:
+    return {
+        "status": f"{verb} {digest[:12]}",
+        "digest": f"sha256:{digest}",
+        "total": total,
+        "completed": completed,
+    }
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import math
+import time
+from typing import List, Optional
+from ..core.config import ApiProvider
+from .coordination import CoordinationError, Coordinator
+
+logger = logging.getLogger(__name__)
+
+
+class _Bucket:
+    """令牌桶，按固定速率连续补充"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float):
+        """
+        Args:
+            capacity: 桶容量
+            rate: 每秒补充的令牌数
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """获取 cost 个令牌需要等待的时间"""
+        self._refill(now)
+        deficit = min(cost, self.capacity) - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, cost: float, now: float) -> None:
+        """扣除令牌，允许透支（透支部分由后续请求等待补齐）"""
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+    def give(self, amount: float) -> None:
+        """归还令牌（amount 为负时追加扣除）"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _LeasedBucket:
+    """
+    从共享存储领取额度的令牌桶（多个实例共用同一额度）
+
+    额度按时间窗口计算，所有实例在一个窗口内领取的总量不超过 limit。每次领取 lease 个，在本地扣除；
+    余量低于一半时在后台续租。领取的额度在窗口结束时作废；透支的部分留待下一次领取时补齐，
+    因此长期速率不超过限制，短时间内最多超出一次续租往返期间发出的请求。
+    """
+
+    __slots__ = (
+        "coordinator", "key", "limit", "window", "capacity", "rate", "lease",
+        "tokens", "blocked_until", "rtt", "_window_index", "_refill_task"
+    )
+
+    def __init__(self, coordinator: Coordinator, key: str, limit: float, window: float, lease_fraction: float):
+        """
+        Args:
+            coordinator: 共享存储
+            key: 计数器名称（加上窗口编号）
+            limit: 每个窗口的总额度
+            window: 窗口长度（秒）
+            lease_fraction: 每次领取的额度占总额度的比例
+        """
+        self.coordinator = coordinator
+        self.key = key
+        self.limit = max(1, int(limit))
+        self.window = window
+        self.capacity = float(self.limit)
+        self.rate = self.limit / window
+        self.lease = max(1, int(self.limit * lease_fraction))
+        self.tokens = 0.0
+        # 共享额度用完时，到下一个窗口开始（time.time()）前不再续租
+        self.blocked_until = 0.0
+        # 续租往返时间的估计，额度不足而共享额度还有余量时按该时间等待
+        self.rtt = 0.05
+        self._window_index = int(time.time() // window)
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def _roll(self) -> None:
+        """进入新的窗口时作废剩余的额度（透支保留）"""
+        index = int(time.time() // self.window)
+        if index != self._window_index:
+            self._window_index = index
+            self.tokens = min(self.tokens, 0.0)
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """获取 cost 个令牌需要等待的时间（now 不使用，窗口按墙上时间对齐）"""
+        self._roll()
+        if min(cost, self.capacity) <= self.tokens:
+            return 0.0
+        self._schedule_refill()
+        wall = time.time()
+        if wall < self.blocked_until:
+            return self.blocked_until - wall
+        return self.rtt
+
+    def take(self, cost: float, now: float) -> None:
+        """扣除令牌，允许透支；余量不足时在后台续租"""
+        self._roll()
+        self.tokens -= min(cost, self.capacity)
+        if self.tokens < self.lease / 2:
+            self._schedule_refill()
+
+    def give(self, amount: float) -> None:
+        """归还令牌（amount 为负时追加扣除）"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def _schedule_refill(self) -> None:
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        if time.time() < self.blocked_until:
+            return
+        try:
+            self._refill_task = asyncio.get_running_loop().create_task(self._refill())
+        except RuntimeError:
+            # 没有事件循环（同步调用），只能按本地状态执行
+            pass
+
+    async def _refill(self) -> None:
+        index = self._window_index
+        want = self.lease + math.ceil(max(0.0, -self.tokens))
+        start = time.monotonic()
+        try:
+            granted = await self.coordinator.take(
+                f"{self.key}:{index}", want, self.limit, self.window * 2
+            )
+        except CoordinationError as e:
+            # 共享存储不可用时不阻塞请求，只按本地令牌桶限制
+            logger.warning(f"Rate limit lease for {self.key} failed: {str(e)}")
+            granted = want
+        self.rtt = 0.8 * self.rtt + 0.2 * (time.monotonic() - start)
+        self._roll()
+        if index != self._window_index:
+            # 窗口已经结束，领取的额度作废
+            return
+        self.tokens += granted
+        if granted < want:
+            self.blocked_until = (index + 1) * self.window
+
+
+class Reservation:
+    """一次请求预扣的额度"""
+
+    __slots__ = ("wait", "tokens", "key")
+
+    def __init__(self, wait: float, tokens: int):
+        self.wait = wait
+        self.tokens = tokens
+        # 使用 key 池时本次请求使用的 API key，否则为 None（使用提供商的 api_key）
+        self.key: Optional[str] = None
+
+
+class RateLimiter:
+    """
+    提供商速率限制器
+
+    同时限制每秒请求数（rate_limit）、每分钟请求数（rpm）和每分钟 token 数（tpm）。
+    请求发出前按估算的 token 数预扣额度，完成后根据上游返回的实际用量进行校正。
+    使用共享存储时，各项限制同时由多个实例共用的租约令牌桶执行（本地令牌桶仍然保留，用于平滑突发）。
+    """
+
+    def __init__(
+        self,
+        rate_limit: float,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        coordinator: Optional[Coordinator] = None,
+        key: str = "",
+        lease_fraction: float = 0.1
+    ):
+        """
+        初始化速率限制器
+
+        Args:
+            rate_limit: 每秒请求数
+            rpm: 每分钟请求数（可选）
+            tpm: 每分钟 token 数（可选）
+            coordinator: 共享存储，不在实例之间共享时只使用本地令牌桶
+            key: 共享计数器的名称（通常为提供商名称）
+            lease_fraction: 每次从共享存储领取的额度占窗口总额度的比例
+        """
+        self.request_buckets: List = [_Bucket(1.0, rate_limit)]
+        if rpm:
+            self.request_buckets.append(_Bucket(float(rpm), rpm / 60.0))
+        self.token_bucket = _Bucket(float(tpm), tpm / 60.0) if tpm else None
+        self.shared_token_bucket: Optional[_LeasedBucket] = None
+
+        if coordinator is not None and coordinator.shared:
+            # 每秒请求数很低时（如 0.1）窗口相应加长，保证每个窗口至少有一个请求的额度
+            window = max(1.0, 1.0 / rate_limit)
+            self.request_buckets.append(
+                _LeasedBucket(coordinator, f"rl:{key}:rps", rate_limit * window, window, lease_fraction)
+            )
+            if rpm:
+                self.request_buckets.append(_LeasedBucket(coordinator, f"rl:{key}:rpm", rpm, 60.0, lease_fraction))
+            if tpm:
+                self.shared_token_bucket = _LeasedBucket(coordinator, f"rl:{key}:tpm", tpm, 60.0, lease_fraction)
+
+    @classmethod
+    def from_provider(
+        cls,
+        provider: ApiProvider,
+        coordinator: Optional[Coordinator] = None,
+        lease_fraction: float = 0.1
+    ) -> "RateLimiter":
+        """根据提供商配置创建速率限制器"""
+        return cls(
+            provider.rate_limit, rpm=provider.rpm, tpm=provider.tpm,
+            coordinator=coordinator, key=provider.provider_name, lease_fraction=lease_fraction
+        )
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """
+        计算发出一个消耗 tokens 的请求需要等待的时间
+
+        Args:
+            tokens: 估算的 token 数
+
+        Returns:
+            等待时间（秒），0 表示可以立即发出
+        """
+        now = time.monotonic()
+        wait = max(bucket.wait_time(1, now) for bucket in self.request_buckets)
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(tokens, now))
+        if self.shared_token_bucket is not None:
+            wait = max(wait, self.shared_token_bucket.wait_time(tokens, now))
+        return wait
+
+    def reserve(self, tokens: int = 0) -> Reservation:
+        """
+        预扣一个请求的额度
+
+        Args:
+            tokens: 估算的 token 数
+
+        Returns:
+            预扣记录，调用方需要先等待 reservation.wait 秒再发出请求
+        """
+        wait = self.wait_time(tokens)
+        now = time.monotonic()
+        for bucket in self.request_buckets:
+            bucket.take(1, now)
+        if self.token_bucket is not None:
+            tokens = min(tokens, int(self.token_bucket.capacity))
+            self.token_bucket.take(tokens, now)
+        if self.shared_token_bucket is not None:
+            self.shared_token_bucket.take(tokens, now)
+        return Reservation(wait, tokens)
+
+    def reconcile(self, reservation: Reservation, actual_tokens: int) -> None:
+        """
+        根据实际用量校正预扣的 token 额度
+
+        Args:
+            reservation: 预扣记录
+            actual_tokens: 上游返回（或本地统计）的实际 token 数
+        """
+        if self.token_bucket is not None:
+            self.token_bucket.give(reservation.tokens - actual_tokens)
+        if self.shared_token_bucket is not None:
+            self.shared_token_bucket.give(reservation.tokens - actual_tokens)
+        reservation.tokens = actual_tokens
+
+    def penalize(self, reservation: Reservation, retry_after: Optional[float] = None) -> bool:
+        """
+        key 返回限流或额度错误；只有一个 key 时没有其他 key 可换
+
+        Returns:
+            是否还有其他可用的 key
+        """
+        return False
@@ -1,15 +1,47 @@
 from fastapi import Request, Response, HTTPException
 from fastapi.responses import StreamingResponse
 import json
-import asyncio
 import time
 from datetime import datetime
 import logging
 from typing import Dict, Any, Optional, List
 from ..utils.helpers import create_response_data
+from ..core.tracing import current_trace, span
+from ..utils.tokens import estimate_messages
+from .client import DEFAULT_COMPLETION_TOKENS, DeadlineExceeded
+from .lifecycle import Lifecycle
+from .options import completion_params, generate_messages, num_predict
+from .pool import UpstreamError
+from .streaming import CancellableStreamingResponse
 
 logger = logging.getLogger(__name__)
 
+# 客户端指定请求超时（秒）的请求头
+DEADLINE_HEADER = "X-Request-Timeout"
+
+def request_deadline(request: Request) -> Optional[float]:
+    """
+    根据请求头计算请求的截止时间
+
+    Returns:
+        截止时间（time.monotonic()），请求头不存在或无效时为 None
+    """
+    value = request.headers.get(DEADLINE_HEADER)
+    if not value:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {DEADLINE_HEADER} header: {value!r}")
+        return None
+    return time.monotonic() + timeout if timeout > 0 else None
+
+def _shape(response: Dict[str, Any], generate: bool) -> Dict[str, Any]:
+    """/api/generate 的响应中内容在 response 字段，没有 message"""
+    if generate:
+        response["response"] = response.pop("message")["content"]
+    return response
+
 class Mock:
     """Ollama API Mock 实现"""
     
@@ -23,76 +55,124 @@ class Mock:
         """
         self.db = db
         self.api_client = api_client
+        self.lifecycle = Lifecycle(db)
 
     async def chat(self, request: Request) -> StreamingResponse:
         """聊天完成响应"""
-        data = await request.json()
-        
-        if not data.get("messages"):
+        return await self._complete(request, generate=False)
+
+    async def _complete(self, request: Request, generate: bool) -> StreamingResponse:
+        """
+        /api/chat 和 /api/generate 的共同实现
+
+        Args:
+            request: 请求
+            generate: 是否为 /api/generate（消息由 prompt、system 生成，响应内容在 response 字段中）
+        """
+        with span("parse"):
+            data = await request.json()
+
+        # 选中 Ollama 提供商时请求和响应都原样转发（包括加载模型等空消息请求）
+        relayed = await self._relay_ollama(request.url.path, data)
+        if relayed is not None:
+            return relayed
+
+        messages = generate_messages(data) if generate else data.get("messages")
+        if not messages:
             return Response(
-                content=json.dumps(create_response_data(
+                content=json.dumps(_shape(create_response_data(
                     model=data["model"],
                     done=True,
                     done_reason="load"
-                )),
+                ), generate)),
                 media_type="application/json"
             )
 
+        params = completion_params(data)
+        deadline = request_deadline(request)
+
         if data.get("stream") == False:
             # 非流式请求
             try:
                 start_time = time.time_ns()
                 # 获取所有提供商的模型映射
-                model_mappings = self.db.get_model_mapping(data["model"])
+                with span("route"):
+                    model_mappings = self.db.get_model_mapping(data["model"])
                 
-                # 使用 async for 来获取生成器的第一个响应
-                content = ""
+                # 拼接所有分块，最后一个分块中带有耗时和 token 统计
+                content = []
+                stats = {}
                 async for response in self.api_client.chat_completion(
                     model=model_mappings,  # 传递所有模型映射
-                    messages=data["messages"],
-                    stream=False
+                    messages=messages,
+                    stream=False,
+                    deadline=deadline,
+                    **params
                 ):
                     if not response["done"]:
-                        content += response["message"]["content"]
+                        content.append(response["message"]["content"])
                     else:
+                        stats = {k: v for k, v in response.items() if k not in ("message", "done")}
                         break
-                
+
+                stats.setdefault("total_duration", time.time_ns() - start_time)
                 return Response(
-                    content=json.dumps(create_response_data(
+                    content=json.dumps(_shape(create_response_data(
                         model=data["model"],
-                        content=content,
+                        content="".join(content),
                         done=True,
-                        total_duration=time.time_ns() - start_time
-                    )),
+                        **stats
+                    ), generate)),
                     media_type="application/json"
                 )
+            except DeadlineExceeded as e:
+                raise HTTPException(status_code=504, detail=str(e))
             except Exception as e:
                 logger.error(f"Chat error: {str(e)}")
                 raise HTTPException(status_code=500, detail=str(e))
 
         async def stream_response():
+            chunks = None
+            trace = current_trace()
             try:
-                model_mappings = self.db.get_model_mapping(data["model"])
+                with span("route"):
+                    model_mappings = self.db.get_model_mapping(data["model"])
                 logger.info(f"Model mappings for {data['model']}: {model_mappings}")
                 
-                async for response in self.api_client.chat_completion(
+                chunks = self.api_client.chat_completion(
                     model=model_mappings,
-                    messages=data["messages"]
-                ):
+                    messages=messages,
+                    deadline=deadline,
+                    **params
+                )
+                async for response in chunks:
                     response["model"] = data["model"]
-                    yield json.dumps(response) + "\n"
+                    _shape(response, generate)
+                    if trace is None:
+                        yield json.dumps(response) + "\n"
+                        continue
+                    start = time.perf_counter_ns()
+                    if response["done"]:
+                        response["trace"] = trace.summary()
+                    line = json.dumps(response) + "\n"
+                    trace.add("serialize", time.perf_counter_ns() - start)
+                    yield line
                     
             except Exception as e:
                 logger.error(f"Stream response error: {str(e)}")
-                error_data = create_response_data(
+                error_data = _shape(create_response_data(
                     model=data["model"],
                     content=str(e),
                     done=True,
                     done_reason="error"
-                )
+                ), generate)
                 yield json.dumps(error_data) + "\n"
+            finally:
+                # 客户端断开时生成器在 yield 处被关闭，需要同时关闭上游的生成器以释放连接和限额
+                if chunks is not None:
+                    await chunks.aclose()
 
-        return StreamingResponse(
+        return CancellableStreamingResponse(
             stream_response(),
             media_type="application/x-ndjson",
             headers={
@@ -101,9 +181,48 @@ class Mock:
             }
         )
 
+    async def _relay_ollama(self, path: str, data: Dict[str, Any]) -> Optional[Response]:
+        """
+        按加权选择结果，由 Ollama 提供商处理请求时原样转发 ndjson 响应
+
+        Args:
+            path: Ollama 原生路径（/api/chat 或 /api/generate）
+            data: 请求体，除 model 外原样转发
+
+        Returns:
+            转发的响应；选中的不是 Ollama 提供商时返回 None
+        """
+        with span("route"):
+            model_mappings = self.db.get_model_mapping(data["model"])
+            messages = data.get("messages") or generate_messages(data)
+            estimated_tokens = estimate_messages(messages) + (num_predict(data) or DEFAULT_COMPLETION_TOKENS)
+            try:
+                if self.api_client.choose_type(model_mappings, estimated_tokens) != "ollama":
+                    return None
+            except Exception:
+                # 没有可用的提供商，由常规路径报告错误
+                return None
+
+        try:
+            relay = await self.api_client.open_relay(
+                path, model_mappings, data, data["model"], estimated_tokens, provider_type="ollama"
+            )
+        except UpstreamError as e:
+            return Response(content=e.message, status_code=e.status_code, media_type="application/json")
+        except Exception as e:
+            logger.error(f"Ollama relay error: {str(e)}")
+            raise HTTPException(status_code=502, detail=str(e))
+
+        return CancellableStreamingResponse(
+            relay,
+            status_code=relay.status_code,
+            media_type=relay.media_type,
+            headers={"Cache-Control": "no-cache"}
+        )
+
     async def generate(self, request: Request) -> StreamingResponse:
         """生成完成响应"""
-        return await self.chat(request)  # 复用 chat 接口
+        return await self._complete(request, generate=True)
 
     async def create_model(self, request: Request) -> StreamingResponse:
         """创建新模型"""
@@ -118,14 +237,8 @@ class Mock:
         self.db.add_model(data["name"], model_data)
         
         async def stream_response():
-            steps = [
-                {"status": "reading model metadata"},
-                {"status": "creating system layer"},
-                {"status": "success"}
-            ]
-            for step in steps:
+            async for step in self.lifecycle.create():
                 yield json.dumps(step) + "\n"
-                await asyncio.sleep(0.5)
                 
         return StreamingResponse(
             stream_response(),
@@ -207,41 +320,19 @@ class Mock:
         """拉取模型"""
         try:
             data = await request.json()
+            name = data.get("model") or data.get("name") or ""
             if data.get("stream") == False:
+                # 非流式请求同样等待模拟的下载完成
+                async for _ in self.lifecycle.pull(name):
+                    pass
                 return Response(
                     content=json.dumps({"status": "success"}),
                     media_type="application/json"
                 )
             
             async def stream_response():
-                total_size = 4661216384
-                chunks = 3
-                
-                # 1. 拉取清单
-                manifest_msg = json.dumps({"status": "pulling manifest"})
-                yield f"data: {manifest_msg}\n\n"
-                await asyncio.sleep(0.5)
-                
-                # 2. 下载进度
-                for i in range(chunks):
-                    completed = (total_size // chunks) * (i + 1)
-                    download_msg = json.dumps({
-                        'status': 'downloading',
-                        'digest': 'sha256:8eeb52dfb3bb9aefdf9d1ef24b3bdbcfbe82238798c4b918278320b6fcef18fe',
-                        'total': total_size,
-                        'completed': completed
-                    })
-                    yield f"data: {download_msg}\n\n"
-                    await asyncio.sleep(0.2)
-                
-                # 3. 验证
-                verify_msg = json.dumps({"status": "verifying sha256 digest"})
-                yield f"data: {verify_msg}\n\n"
-                await asyncio.sleep(0.5)
-                
-                # 4. 完成
-                success_msg = json.dumps({"status": "success"})
-                yield f"data: {success_msg}\n\n"
+                async for event in self.lifecycle.pull(name):
+                    yield f"data: {json.dumps(event)}\n\n"
             
             return StreamingResponse(
                 stream_response(),
@@ -261,16 +352,11 @@ class Mock:
         """推送模型"""
         try:
             data = await request.json()
+            name = data.get("model") or data.get("name") or ""
             
             async def stream_response():
-                steps = [
-                    {"status": "retrieving manifest"},
-                    {"status": "pushing manifest"},
-                    {"status": "success"}
-                ]
-                for step in steps:
-                    yield json.dumps(step) + "\n"
-                    await asyncio.sleep(1)
+                async for event in self.lifecycle.push(name):
+                    yield json.dumps(event) + "\n"
                     
             return StreamingResponse(
                 stream_response(),
@@ -0,0 +1,82 @@
+"""
+Ollama 请求字段到 OpenAI 兼容参数的映射
+
+    options.num_predict        max_tokens（-1 / -2 表示不限制），上游忽略时在本地截断
+    options.stop / stop        stop（上游最多接受 4 个），全部停止序列在本地执行
+    options.temperature        temperature
+    options.top_p              top_p
+    options.seed               seed
+    options.presence_penalty   presence_penalty
+    options.frequency_penalty  frequency_penalty
+    format                     response_format（"json" 或 JSON Schema）
+    prompt / system / raw      /api/generate 的消息（raw 时不加 system）
+
+其他 options（num_ctx、top_k、repeat_penalty 等）没有通用的 OpenAI 参数，不转发。
+"""
+from typing import Any, Dict, List, Optional
+
+# 名称相同、直接转发的采样参数
+_SAMPLING_OPTIONS = ("temperature", "top_p", "seed", "presence_penalty", "frequency_penalty")
+
+def num_predict(data: Dict[str, Any]) -> Optional[int]:
+    """请求的最大生成 token 数，不限制时为 None"""
+    num_predict = (data.get("options") or {}).get("num_predict")
+    if isinstance(num_predict, int) and num_predict > 0:
+        return num_predict
+    return None
+
+def stop_sequences(data: Dict[str, Any]) -> List[str]:
+    """请求的停止序列（options.stop，兼容顶层的 stop）"""
+    stop = (data.get("options") or {}).get("stop", data.get("stop"))
+    if isinstance(stop, str):
+        stop = [stop]
+    return [s for s in stop or [] if isinstance(s, str) and s]
+
+def completion_params(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把 Ollama 请求中的生成参数转换为 Client.chat_completion 的参数
+
+    Args:
+        data: Ollama 格式的请求体（/api/chat 或 /api/generate）
+
+    Returns:
+        num_predict、stop 由 chat_completion 转换为 max_tokens、stop 并在本地执行，
+        其余为原样合并到上游请求体中的 OpenAI 参数
+    """
+    options = data.get("options") or {}
+    params: Dict[str, Any] = {
+        name: options[name] for name in _SAMPLING_OPTIONS if options.get(name) is not None
+    }
+    limit = num_predict(data)
+    if limit is not None:
+        params["num_predict"] = limit
+    stop = stop_sequences(data)
+    if stop:
+        params["stop"] = stop
+    response_format = data.get("format")
+    if response_format == "json":
+        params["response_format"] = {"type": "json_object"}
+    elif isinstance(response_format, dict):
+        params["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "response", "schema": response_format},
+        }
+    return params
+
+def generate_messages(data: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    /api/generate 的 prompt、system 转换为消息列表
+
+    raw 为 true 时调用方自行套用模板，只发送 prompt 本身。
+
+    Returns:
+        消息列表，prompt 为空时为空列表（加载模型的请求）
+    """
+    prompt = data.get("prompt") or ""
+    if not prompt:
+        return []
+    messages = []
+    if data.get("system") and not data.get("raw"):
+        messages.append({"role": "system", "content": data["system"]})
+    messages.append({"role": "user", "content": prompt})
+    return messages
@@ -0,0 +1,99 @@
+from fastapi import Request, Response
+import json
+import logging
+from typing import Any, Dict
+from ..core.tracing import span
+from ..utils.tokens import estimate_messages, estimate_tokens
+from .client import DEFAULT_COMPLETION_TOKENS
+from .pool import UpstreamError
+from .streaming import CancellableStreamingResponse
+
+logger = logging.getLogger(__name__)
+
+class Passthrough:
+    """
+    OpenAI 兼容接口的透传实现
+
+    请求只解析一次用于路由和额度预估，改写 model 后转发；上游响应的字节原样转发，
+    只在上游模型名与请求的模型名不同时改写 model 字段。
+    """
+
+    def __init__(self, db, api_client):
+        """
+        初始化透传接口
+
+        Args:
+            db: 数据库管理器（模型映射）
+            api_client: API 客户端
+        """
+        self.db = db
+        self.api_client = api_client
+
+    async def chat_completions(self, request: Request) -> Response:
+        """聊天补全接口（/v1/chat/completions）"""
+        body = await self._json(request)
+        if isinstance(body, Response):
+            return body
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        estimated_tokens = estimate_messages(body.get("messages") or []) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+        return await self._relay("/chat/completions", body, estimated_tokens)
+
+    async def embeddings(self, request: Request) -> Response:
+        """嵌入向量接口（/v1/embeddings）"""
+        body = await self._json(request)
+        if isinstance(body, Response):
+            return body
+        inputs = body.get("input")
+        if isinstance(inputs, str):
+            estimated_tokens = estimate_tokens(inputs)
+        elif isinstance(inputs, list):
+            estimated_tokens = sum(estimate_tokens(item) if isinstance(item, str) else len(item) for item in inputs)
+        else:
+            estimated_tokens = 0
+        return await self._relay("/embeddings", body, estimated_tokens)
+
+    async def _json(self, request: Request):
+        """解析请求体，无效时返回 OpenAI 格式的 400 错误"""
+        try:
+            raw = await request.body()
+            with span("parse"):
+                body = json.loads(raw)
+        except ValueError:
+            return self._error(400, "Invalid JSON body")
+        if not isinstance(body, dict) or not body.get("model"):
+            return self._error(400, "Field 'model' is required")
+        return body
+
+    async def _relay(self, path: str, body: Dict[str, Any], estimated_tokens: int) -> Response:
+        client_model = body["model"]
+        try:
+            with span("route"):
+                model = self.db.get_model_mapping(client_model)
+            relay = await self.api_client.open_relay(
+                path,
+                model,
+                body,
+                client_model,
+                estimated_tokens
+            )
+        except UpstreamError as e:
+            # 上游的错误信息原样返回
+            return Response(content=e.message, status_code=e.status_code, media_type="application/json")
+        except Exception as e:
+            logger.error(f"Passthrough error: {str(e)}")
+            return self._error(502, str(e))
+
+        return CancellableStreamingResponse(
+            relay,
+            status_code=relay.status_code,
+            media_type=relay.media_type,
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    @staticmethod
+    def _error(status_code: int, message: str) -> Response:
+        return Response(
+            content=json.dumps({"error": {"message": message, "type": "invalid_request_error"}}),
+            status_code=status_code,
+            media_type="application/json"
+        )
@@ -0,0 +1,277 @@
+import asyncio
+import functools
+import importlib.util
+import ipaddress
+import json
+import logging
+import socket
+import ssl
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import httpcore
+import httpx
+from ..core.config import ApiProvider
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "HTTP-Referer": "http://localhost:11434",
+    "X-Title": "Ollama Mock Server",
+}
+
+# 连接超时；读超时较长，流式响应中的停顿由上层处理
+UPSTREAM_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+
+class UpstreamError(Exception):
+    """上游返回错误状态码"""
+
+    def __init__(self, provider_name: str, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{provider_name} returned {status_code}: {message}")
+        self.provider_name = provider_name
+        self.status_code = status_code
+        self.message = message
+        # Retry-After 响应头（秒），没有或不是秒数时为 None
+        self.retry_after = retry_after
+
+
+class DnsCache:
+    """DNS 解析缓存，多个地址时轮流使用"""
+
+    def __init__(self, ttl: float = 300.0):
+        """
+        Args:
+            ttl: 缓存时间（秒），0 表示不缓存
+        """
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._cursor = 0
+
+    async def resolve(self, host: str, port: int) -> str:
+        """解析主机名，返回一个 IP 地址"""
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+
+        now = time.monotonic()
+        entry = self._entries.get((host, port))
+        if entry is None or entry[0] <= now:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            entry = (now + self.ttl, addresses)
+            if self.ttl > 0:
+                self._entries[(host, port)] = entry
+        addresses = entry[1]
+        self._cursor += 1
+        return addresses[self._cursor % len(addresses)]
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """连接前先查 DNS 缓存的网络后端（TLS 的 SNI 仍使用原主机名）"""
+
+    def __init__(self, dns_cache: DnsCache, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self.dns_cache = dns_cache
+        self._backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = await self.dns_cache.resolve(host, port)
+        return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context(http2: bool) -> ssl.SSLContext:
+    """
+    连接池共用的 SSL 上下文（加载 CA 证书较慢，每个进程只做一次）
+
+    建立连接时会按 HTTP 版本设置上下文的 ALPN，因此 HTTP/1.1 和 HTTP/2 各用一个。
+    """
+    return httpx.create_ssl_context()
+
+
+def _create_transport(provider: ApiProvider) -> httpx.AsyncHTTPTransport:
+    """创建带连接池参数和 DNS 缓存的传输层"""
+    http2 = provider.http2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning(f"HTTP/2 requested for {provider.provider_name} but h2 is not installed, using HTTP/1.1")
+        http2 = False
+
+    transport = httpx.AsyncHTTPTransport(
+        verify=_ssl_context(http2),
+        limits=httpx.Limits(
+            max_connections=provider.max_connections,
+            max_keepalive_connections=provider.max_keepalive,
+            keepalive_expiry=provider.keepalive_expiry,
+        ),
+        http2=http2,
+    )
+    # httpx 没有公开设置网络后端的参数，直接替换连接池的后端
+    pool = getattr(transport, "_pool", None)
+    if provider.dns_ttl > 0 and hasattr(pool, "_network_backend"):
+        pool._network_backend = CachingNetworkBackend(DnsCache(provider.dns_ttl))
+    return transport
+
+
+class ProviderPool:
+    """
+    单个提供商的连接池
+
+    按配置限制连接数和 keep-alive，启动时预先建立 min_warm 个连接，
+    空闲时定期发送轻量请求（GET /models）保持连接。
+    Ollama 提供商改为每隔 ping_interval 轮询 /api/ps，记录已加载的模型供路由参考，同时起到保活作用。
+    """
+
+    def __init__(self, provider: ApiProvider):
+        """
+        Args:
+            provider: API 提供商配置
+        """
+        self.provider_name = provider.provider_name
+        self.type = provider.type
+        self.min_warm = provider.min_warm
+        self.ping_interval = provider.ping_interval
+        headers = dict(DEFAULT_HEADERS)
+        # 使用 key 池时每个请求单独指定 Authorization，这里的默认值只用于保活请求
+        api_key = provider.api_key or next(iter(provider.api_keys), "")
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self.http = httpx.AsyncClient(
+            transport=_create_transport(provider),
+            base_url=provider.base_url.rstrip("/"),
+            headers=headers,
+            timeout=UPSTREAM_TIMEOUT,
+        )
+        self.last_used = 0.0
+        # Ollama 提供商当前已加载的模型（/api/ps）
+        self.loaded_models: Set[str] = set()
+        self._ping_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def _ping(self) -> None:
+        if self.type == "ollama":
+            await self.refresh_loaded_models()
+            return
+        response = await self.http.get("/models")
+        await response.aclose()
+
+    async def refresh_loaded_models(self) -> None:
+        """从 Ollama 的 /api/ps 更新已加载的模型"""
+        response = await self.http.get("/api/ps")
+        response.raise_for_status()
+        self.loaded_models = {model["name"] for model in response.json().get("models", [])}
+
+    async def warm(self) -> None:
+        """并发发送 min_warm 个轻量请求，预先建立连接（DNS、TCP、TLS）"""
+        if self.min_warm <= 0 or self._closed:
+            return
+        results = await asyncio.gather(
+            *(self._ping() for _ in range(self.min_warm)), return_exceptions=True
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.warning(f"Warm-up of {self.provider_name} failed: {errors[0]!r}")
+
+    def start(self) -> None:
+        """启动空闲保活任务（需要在事件循环中调用）"""
+        if self._closed or self._ping_task is not None or self.ping_interval <= 0:
+            return
+        if self.min_warm > 0 or self.type == "ollama":
+            self._ping_task = asyncio.get_running_loop().create_task(self._keepalive())
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            if self.type == "ollama":
+                # 模型加载状态随时变化，无论是否空闲都要轮询
+                try:
+                    await self.refresh_loaded_models()
+                except Exception as e:
+                    logger.debug(f"Polling /api/ps of {self.provider_name} failed: {e!r}")
+            # 最近有请求时连接本身就是热的，不需要额外请求
+            elif time.monotonic() - self.last_used >= self.ping_interval:
+                await self.warm()
+
+    async def open_chat(self, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """
+        发起聊天补全请求
+
+        收到响应头后返回，调用方负责读取并关闭响应（await response.aclose()）。
+
+        Raises:
+            UpstreamError: 上游返回错误状态码
+        """
+        return await self.open("POST", "/chat/completions", payload, headers)
+
+    async def open(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> httpx.Response:
+        """发起流式请求，收到响应头后返回；状态码错误时读取错误信息并抛出 UpstreamError"""
+        self.last_used = time.monotonic()
+        request = self.http.build_request(method, path, json=payload, headers=headers)
+        response = await self.http.send(request, stream=True)
+        if response.status_code >= 400:
+            try:
+                body = (await response.aread()).decode("utf-8", "replace")
+            finally:
+                await response.aclose()
+            raise UpstreamError(
+                self.provider_name, response.status_code, body[:500], _retry_after(response.headers.get("retry-after"))
+            )
+        return response
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        """关闭连接池（异步释放连接）"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            self._ping_task = None
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有运行中的事件循环，连接随对象回收
+            return
+        loop.create_task(self.http.aclose())
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """解析秒数形式的 Retry-After（HTTP 日期形式不处理）"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+async def iter_sse(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """
+    解析 OpenAI 格式的 SSE 流
+
+    Args:
+        response: 流式响应
+
+    Yields:
+        每个 data 事件解析后的 JSON 对象，遇到 [DONE] 结束
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        if data:
+            yield json.loads(data)
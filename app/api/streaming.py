@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+class CancellableStreamingResponse(StreamingResponse):
+    """
+    客户端断开后立即停止的流式响应
+
+    Starlette 在 ASGI 2.4 的服务器（新版 uvicorn）上只在下一次发送失败时才发现客户端断开，
+    等待上游期间不会察觉。这里始终并发监听断开事件，断开后取消正在等待上游的生成器并关闭它，
+    生成器的 finally 随即关闭上游连接、校正速率限制额度。
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stream_task = asyncio.ensure_future(self.stream_response(send))
+        disconnect_task = asyncio.ensure_future(self.listen_for_disconnect(receive))
+        try:
+            await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnect_task.cancel()
+            if not stream_task.done():
+                logger.info("Client disconnected, cancelling stream")
+                stream_task.cancel()
+            await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+            # 生成器停在 yield 处（正在等待发送）时取消不会进入生成器，需要显式关闭
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        if stream_task.cancelled():
+            return
+        error = stream_task.exception()
+        # 发送失败（OSError）说明客户端已经断开
+        if error is not None and not isinstance(error, OSError):
+            raise error
+        if error is None and self.background is not None:
+            await self.background()
@@ -0,0 +1,270 @@
+"""
+请求和响应压缩
+
+CompressionMiddleware 按 Accept-Encoding 协商响应压缩（zstd 需要安装 zstandard，优先于 gzip）：
+    有 Content-Length 的响应（非流式）不小于 server.compression_min_size 时整体压缩，
+    不小于 server.compression_offload_size 时在线程中压缩，不阻塞事件循环；
+    没有 Content-Length 的流式响应只在 server.compression_streams 开启时压缩，每个分块单独刷新，
+    客户端收到的每个分块都可以立即解压。
+带有 Content-Encoding（gzip、deflate、zstd）的请求体在进入路由之前解压，解压后的大小不超过
+server.max_request_body。压缩和解压的耗时记录在 compress / decompress 阶段。
+"""
+import asyncio
+import io
+import json
+import zlib
+from typing import Callable, List, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .config import settings
+from .tracing import span
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，没有安装时只使用 gzip
+    zstandard = None
+
+# 级别 1 的压缩率与默认的 6 相差不多（嵌入向量约 15MB 对 14MB），速度约快 6 倍
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+class DecodeError(Exception):
+    """请求体无法解压"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def supported_encodings() -> List[str]:
+    """可以用于响应的编码，按优先顺序"""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择响应编码
+
+    Returns:
+        q 值最高的可用编码，相同时按 supported_encodings 的顺序；都不接受时为 None
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """整体压缩"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def stream_compressor(encoding: str) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    """
+    流式压缩
+
+    Returns:
+        (压缩一个分块并刷新, 结束压缩流)；每次刷新后已发出的数据可以完整解压
+    """
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return (
+            lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush,
+        )
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+def decompress(data: bytes, encoding: str, limit: int) -> bytes:
+    """
+    解压请求体
+
+    Args:
+        data: 压缩的请求体
+        encoding: Content-Encoding
+        limit: 解压后的最大字节数
+
+    Raises:
+        DecodeError: 不支持的编码（415）、数据损坏（400）或超过 limit（413）
+    """
+    try:
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # 47 = 32 + 15：自动识别 gzip 和 zlib 头
+            decompressor = zlib.decompressobj(47)
+            out = decompressor.decompress(data, limit + 1)
+            if len(out) <= limit and not decompressor.unconsumed_tail:
+                out += decompressor.flush()
+        elif encoding == "zstd" and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+                out = reader.read(limit + 1)
+        else:
+            raise DecodeError(415, f"Unsupported Content-Encoding: {encoding}")
+    except (zlib.error, ValueError) as e:
+        raise DecodeError(400, f"Invalid {encoding} request body: {str(e)}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise DecodeError(400, f"Invalid {encoding} request body: {str(e)}")
+        raise
+    if len(out) > limit:
+        raise DecodeError(413, f"Decompressed request body exceeds {limit} bytes")
+    return out
+
+async def _offload(func: Callable[..., bytes], *args, size: int) -> bytes:
+    """较大的数据在线程中处理（zlib 和 zstandard 在处理期间释放 GIL）"""
+    if size >= settings.server.compression_offload_size:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+class CompressionMiddleware:
+    """请求解压和响应压缩（纯 ASGI 中间件，不缓冲流式响应）"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # 每次读取，热加载修改配置后立即生效
+        config = settings.server
+        headers = Headers(scope=scope)
+
+        content_encoding = headers.get("content-encoding", "identity").strip().lower()
+        if content_encoding != "identity":
+            try:
+                scope, receive = await self._decode_request(scope, receive, content_encoding, config.max_request_body)
+            except DecodeError as e:
+                await _error(send, e.status_code, e.detail)
+                return
+
+        encoding = choose_encoding(headers.get("accept-encoding", "")) if config.compression else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(send, encoding, config.compression_min_size, config.compression_streams))
+
+    @staticmethod
+    async def _decode_request(scope: Scope, receive: Receive, encoding: str, limit: int) -> Tuple[Scope, Receive]:
+        """读取并解压整个请求体，返回去掉 Content-Encoding 的 scope 和重放解压结果的 receive"""
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise DecodeError(400, "Client disconnected while sending request body")
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        with span("decompress"):
+            body = await _offload(decompress, body, encoding, limit, size=len(body))
+
+        headers = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        replayed = False
+
+        async def decoded_receive() -> Message:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # 之后的调用（等待断开）交给服务器
+            return await receive()
+
+        return dict(scope, headers=headers), decoded_receive
+
+class _Responder:
+    """包装 send，按响应类型决定是否压缩"""
+
+    def __init__(self, send: Send, encoding: str, min_size: int, streams: bool):
+        self.send = send
+        self.encoding = encoding
+        self.min_size = min_size
+        self.streams = streams
+        # 整体压缩时暂存的响应头，收到响应体后再发出
+        self.start: Optional[Message] = None
+        self.stream: Optional[Tuple[Callable[[bytes], bytes], Callable[[], bytes]]] = None
+        self.passthrough = False
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            await self._start(message)
+        elif message["type"] == "http.response.body" and not self.passthrough:
+            await self._body(message)
+        else:
+            await self.send(message)
+
+    async def _start(self, message: Message) -> None:
+        headers = Headers(raw=message.get("headers", []))
+        length = headers.get("content-length")
+        if (
+            "content-encoding" in headers
+            or message["status"] in (204, 304)
+            or (length is not None and int(length) < self.min_size)
+            or (length is None and not self.streams)
+        ):
+            self.passthrough = True
+            await self.send(message)
+            return
+        if length is not None:
+            self.start = message
+            return
+        # 流式响应：立即发出响应头，不等待第一个分块
+        self.stream = stream_compressor(self.encoding)
+        await self.send(self._encoded(message))
+
+    async def _body(self, message: Message) -> None:
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.stream is not None:
+            compress_chunk, finish = self.stream
+            with span("compress"):
+                body = (compress_chunk(body) if body else b"") + (b"" if more_body else finish())
+            await self.send(dict(message, body=body))
+            return
+        if more_body:
+            # 有 Content-Length 但分多次发送（如文件），不做整体缓冲
+            self.passthrough = True
+            await self.send(self.start)
+            await self.send(message)
+            return
+        with span("compress"):
+            compressed = await _offload(compress, body, self.encoding, size=len(body))
+        start = self._encoded(self.start)
+        MutableHeaders(scope=start)["content-length"] = str(len(compressed))
+        await self.send(start)
+        await self.send(dict(message, body=compressed))
+
+    def _encoded(self, message: Message) -> Message:
+        """加上 Content-Encoding 的响应头"""
+        message = dict(message, headers=list(message.get("headers", [])))
+        headers = MutableHeaders(scope=message)
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "content-length" in headers:
+            del headers["content-length"]
+        return message
+
+async def _error(send: Send, status_code: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
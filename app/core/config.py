@@ -1,26 +1,42 @@
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Literal, Optional
 import yaml
 import logging
 from pydantic import Field
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from .routing import RoutingTable
 
 logger = logging.getLogger(__name__)
 
 class ApiProvider(BaseSettings):
     provider_name: str
+    # openai: OpenAI 兼容接口（base_url 指向 /v1）；ollama: Ollama 服务器（base_url 指向根地址），原样转发 ndjson
+    type: Literal["openai", "ollama"] = "openai"
     base_url: str
-    api_key: str
+    api_key: str = ""
+    # API key 池：配置多个 key 时每个 key 单独计算 rate_limit / rpm / tpm，按余量轮换，
+    # 返回 429 或额度、鉴权错误的 key 暂停使用 Retry-After 秒（没有时为 key_cooldown 秒）
+    api_keys: List[str] = []
+    key_cooldown: float = 60.0
     rate_limit: float = 2.0
+    rpm: Optional[int] = None  # 每分钟请求数限制
+    tpm: Optional[int] = None  # 每分钟 token 数限制
+    stream_usage: bool = False  # 流式请求是否发送 stream_options 要求上游返回 usage（上游需支持该参数）
     weight: int = 1
+    # 连接池
+    max_connections: int = 100  # 最大连接数
+    max_keepalive: int = 20  # 最大空闲 keep-alive 连接数
+    keepalive_expiry: float = 60.0  # 空闲连接保留时间（秒）
+    http2: bool = False  # 是否使用 HTTP/2（需要安装 h2）
+    min_warm: int = 1  # 启动时预先建立、空闲时保持的连接数
+    ping_interval: float = 30.0  # 空闲保活请求间隔（秒），0 表示不保活
+    dns_ttl: float = 300.0  # DNS 缓存时间（秒），0 表示不缓存
+    # 超时（秒），0 表示不限制；超时后换用其他提供商续写
+    ttft_timeout: float = 60.0  # 从发出请求到第一个 token 的最长时间
+    stall_timeout: float = 30.0  # 两个 token 之间的最长间隔
     default_model: str
     provider_mappings: Dict[str, str] = {}
-    last_request_time: float = 0.0
-
-    def get_model(self, ollama_model: str) -> str:
-        """获取对应的模型名称"""
-        return self.provider_mappings.get(ollama_model, self.default_model)
 
     class Config:
         env_file = ".env"
@@ -31,23 +47,77 @@ class ServerSettings(BaseSettings):
     port: int = Field(default=11434, env="PORT")
     log_level: str = Field(default="INFO", env="LOG_LEVEL")
     cors_origins: List[str] = Field(default=["*"])
-    workers: int = Field(default=4, env="WORKERS")
+    workers: int = Field(default=4, env="WORKERS")  # 0 表示与 CPU 数相同
+    drain_timeout: float = Field(default=30.0, env="DRAIN_TIMEOUT")  # 退出时等待进行中请求的最长时间
+    pin_workers: bool = Field(default=False, env="PIN_WORKERS")  # 是否将工作进程绑定到 CPU
+    preload_app: bool = Field(default=False, env="PRELOAD_APP")  # 主进程预先导入应用，工作进程启动更快
+    config_reload_interval: float = Field(default=2.0, env="CONFIG_RELOAD_INTERVAL")  # 0 表示只响应 SIGHUP
+    trace_sample_rate: float = Field(default=0.0, env="TRACE_SAMPLE_RATE")  # 没有 X-Debug-Trace 请求头时记录耗时分解的比例
+    debug_endpoints: bool = Field(default=False, env="DEBUG_ENDPOINTS")  # 是否开放 /debug/profile 等调试接口
+    # 模型生命周期接口（create/pull/push）的模拟：instant 不等待；realistic 按带宽模拟逐层传输
+    lifecycle_profile: Literal["instant", "realistic"] = Field(default="realistic", env="LIFECYCLE_PROFILE")
+    lifecycle_bandwidth: float = Field(default=2e9, env="LIFECYCLE_BANDWIDTH")  # 模拟传输速度（字节/秒）
+    lifecycle_step_delay: float = Field(default=0.5, env="LIFECYCLE_STEP_DELAY")  # 其他步骤的耗时（秒）
+    lifecycle_tick: float = Field(default=0.2, env="LIFECYCLE_TICK")  # 进度更新间隔（秒）
+    batch_concurrency: int = Field(default=16, env="BATCH_CONCURRENCY")  # /api/batch 每个批次同时进行的最大请求数
+    batch_checkpoint_dir: str = Field(default="data/batches", env="BATCH_CHECKPOINT_DIR")  # 批次断点文件目录
+    compression: bool = Field(default=True, env="COMPRESSION")  # 是否按 Accept-Encoding 压缩响应（gzip，安装 zstandard 后支持 zstd）
+    compression_min_size: int = Field(default=1024, env="COMPRESSION_MIN_SIZE")  # 小于该字节数的响应不压缩
+    compression_streams: bool = Field(default=False, env="COMPRESSION_STREAMS")  # 是否压缩流式响应（每个分块单独刷新）
+    compression_offload_size: int = Field(default=262144, env="COMPRESSION_OFFLOAD_SIZE")  # 不小于该字节数时在线程中压缩 / 解压
+    max_request_body: int = Field(default=64 * 1024 * 1024, env="MAX_REQUEST_BODY")  # 压缩请求体解压后的最大字节数
+
+    class Config:
+        env_file = ".env"
+        extra = "allow"
+
+    @classmethod
+    def settings_customise_sources(cls, settings_cls, init_settings, env_settings, dotenv_settings, file_secret_settings):
+        """环境变量（如 WORKERS、PORT）优先于配置文件中的 server 配置"""
+        return env_settings, dotenv_settings, init_settings, file_secret_settings
+
+class CoordinationSettings(BaseSettings):
+    """多实例协调：共享速率限制和熔断状态"""
+    # local: 只在本实例内限制；redis: 多个实例通过 Redis 协议的共享存储共用额度
+    backend: Literal["local", "redis"] = Field(default="local", env="COORDINATION_BACKEND")
+    redis_url: str = Field(default="redis://127.0.0.1:6379/0", env="COORDINATION_REDIS_URL")
+    key_prefix: str = Field(default="ollama-mock", env="COORDINATION_KEY_PREFIX")
+    lease_fraction: float = Field(default=0.1, env="COORDINATION_LEASE_FRACTION")  # 每次领取的额度占窗口总额度的比例
+    circuit_threshold: int = Field(default=5, env="CIRCUIT_THRESHOLD")  # 时间窗口内失败多少次后熔断，0 表示不熔断
+    circuit_window: float = Field(default=10.0, env="CIRCUIT_WINDOW")  # 统计失败次数的时间窗口（秒）
+    circuit_cooldown: float = Field(default=30.0, env="CIRCUIT_COOLDOWN")  # 熔断持续时间（秒）
+    sync_interval: float = Field(default=1.0, env="COORDINATION_SYNC_INTERVAL")  # 从共享存储同步熔断状态的间隔（秒）
 
     class Config:
         env_file = ".env"
         extra = "allow"
 
+    @classmethod
+    def settings_customise_sources(cls, settings_cls, init_settings, env_settings, dotenv_settings, file_secret_settings):
+        """环境变量优先于配置文件中的 coordination 配置"""
+        return env_settings, dotenv_settings, init_settings, file_secret_settings
+
 class Settings:
-    def __init__(self, config_path: str = None):
+    def __init__(self, config_path: str = None, strict: bool = False):
+        """
+        加载配置
+
+        Args:
+            config_path: 配置文件路径
+            strict: 严格模式下配置文件或提供商配置有误时抛出异常，而不是跳过（用于热加载校验）
+        """
         self.config_path = config_path or "config/config.yaml"
+        self.strict = strict
         self._load_config()
         self._init_settings()
 
     def _load_config(self) -> None:
         try:
             with open(self.config_path, 'r', encoding='utf-8') as f:
-                self.config = yaml.safe_load(f)
+                self.config = yaml.safe_load(f) or {}
         except Exception as e:
+            if self.strict:
+                raise
             logger.error(f"Error loading config file: {str(e)}")
             self.config = {}
 
@@ -59,23 +129,51 @@ class Settings:
             try:
                 self.api_providers.append(ApiProvider(**provider))
             except Exception as e:
+                if self.strict:
+                    raise ValueError(f"Invalid provider {provider.get('provider_name')}: {str(e)}")
                 logger.error(f"Error initializing provider {provider.get('provider_name')}: {str(e)}")
                 continue
 
+        if self.strict:
+            names = [p.provider_name for p in self.api_providers]
+            if not names:
+                raise ValueError("No api_providers configured")
+            if len(names) != len(set(names)):
+                raise ValueError("Duplicate provider_name in api_providers")
+
+        self._providers_by_name = {p.provider_name: p for p in self.api_providers}
+        self.routing = RoutingTable(self.api_providers)
         self.server = ServerSettings(**self.config.get("server", {}))
+        self.coordination = CoordinationSettings(**self.config.get("coordination", {}))
+
+    def replace(self, other: "Settings") -> None:
+        """
+        用新加载的配置替换当前配置
+
+        同步完成所有赋值，事件循环中不会观察到新旧混合的状态。
+
+        Args:
+            other: 新配置
+        """
+        (
+            self.config, self.api_providers, self._providers_by_name,
+            self.routing, self.server, self.coordination
+        ) = (
+            other.config, other.api_providers, other._providers_by_name,
+            other.routing, other.server, other.coordination
+        )
 
     def get_api_provider(self, provider_name: str) -> Optional[ApiProvider]:
         """获取指定名称的 API 提供商配置"""
-        for provider in self.api_providers:
-            if provider.provider_name == provider_name:
-                return provider
-        return None
+        return self._providers_by_name.get(provider_name)
 
     def get_model_mapping(self, ollama_model: str) -> Dict[str, str]:
-        """获取所有提供商对该模型的映射"""
-        return {
-            provider.provider_name: provider.get_model(ollama_model)
-            for provider in self.api_providers
-        }
+        """
+        获取能够服务该模型的提供商及其模型映射（路由表缓存，调用方不能修改）
+
+        注意：只要有提供商通过 provider_mappings 显式匹配了该模型，其他提供商就不再用
+        default_model 服务它；只有没有任何提供商匹配时才回退到各自的 default_model。
+        """
+        return self.routing.resolve(ollama_model)
 
 settings = Settings() 
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+采样分析器
+
+后台线程按固定间隔采集指定线程（通常是事件循环线程）的调用栈，结果输出为 folded stacks 格式：
+每行一个调用栈（由根到叶，以 ; 分隔）和采样次数，可以直接交给 flamegraph.pl、speedscope 等工具生成火焰图。
+采样期间被分析的线程不受影响，开销只在采样线程中。
+"""
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, Tuple
+
+# 单次分析的最长时间（秒）
+MAX_PROFILE_SECONDS = 60.0
+
+_running = threading.Lock()
+
+class ProfilerBusy(Exception):
+    """已有分析在进行"""
+
+class SamplingProfiler:
+    """按固定间隔采集一个线程的调用栈"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Args:
+            thread_id: 被采样线程的 ident
+            interval: 采样间隔（秒）
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+    def folded(self) -> str:
+        """folded stacks 格式的结果"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+def _stack(frame) -> Tuple[str, ...]:
+    """由根到叶的调用栈，每层为 函数名 (文件:首行号)"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+async def profile(seconds: float, interval: float = 0.005) -> str:
+    """
+    对当前事件循环线程采样 seconds 秒
+
+    Args:
+        seconds: 采样时长（秒），最多 MAX_PROFILE_SECONDS
+        interval: 采样间隔（秒）
+
+    Returns:
+        folded stacks 格式的结果
+
+    Raises:
+        ProfilerBusy: 已有分析在进行
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        profiler = SamplingProfiler(threading.get_ident(), max(0.001, interval))
+        profiler.start()
+        try:
+            await asyncio.sleep(min(max(0.0, seconds), MAX_PROFILE_SECONDS))
+        finally:
+            await asyncio.to_thread(profiler.stop)
+        return profiler.folded()
+    finally:
+        _running.release()
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import signal
+from typing import Awaitable, Callable, Optional, Tuple
+from .config import Settings
+
+logger = logging.getLogger(__name__)
+
+class ConfigWatcher:
+    """配置热加载：轮询配置文件的修改时间，或在收到 SIGHUP 时重新加载"""
+
+    def __init__(
+        self,
+        settings: Settings,
+        on_reload: Callable[[Settings], Awaitable[None]],
+        interval: float = 2.0
+    ):
+        """
+        初始化配置监听器
+
+        Args:
+            settings: 当前配置
+            on_reload: 新配置校验通过后的回调，负责构建并替换提供商集合
+            interval: 轮询间隔（秒），为 0 时只响应 SIGHUP
+        """
+        self.settings = settings
+        self.on_reload = on_reload
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stamp = self._file_stamp()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        """配置文件的修改时间和大小"""
+        try:
+            stat = os.stat(self.settings.config_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    async def start(self) -> None:
+        """开始监听"""
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reload()))
+        except (AttributeError, NotImplementedError, RuntimeError):
+            # Windows 或非主线程中不支持信号处理
+            logger.debug("SIGHUP reload is not available on this platform")
+
+        self._apply_interval()
+
+    def _apply_interval(self) -> None:
+        """按当前的轮询间隔启动或停止轮询任务"""
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+        elif self.interval <= 0 and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def stop(self) -> None:
+        """停止监听"""
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            stamp = self._file_stamp()
+            if stamp is not None and stamp != self._stamp:
+                self._stamp = stamp
+                await self.reload()
+
+    async def reload(self) -> bool:
+        """
+        重新加载配置
+
+        新配置在后台线程中解析并严格校验，校验失败时保留当前配置。
+
+        Returns:
+            是否加载成功
+        """
+        async with self._lock:
+            try:
+                new_settings = await asyncio.to_thread(Settings, self.settings.config_path, True)
+                await self.on_reload(new_settings)
+            except Exception as e:
+                logger.error(f"Config reload failed, keeping current config: {str(e)}")
+                return False
+
+            self._stamp = self._file_stamp()
+            self.interval = self.settings.server.config_reload_interval
+            self._apply_interval()
+            logger.info(f"Config reloaded from {self.settings.config_path}")
+            return True
@@ -0,0 +1,98 @@
+import re
+from fnmatch import translate
+from typing import Dict, List, Optional, Pattern, Tuple
+
+# 路由缓存上限，超过后清空，避免任意模型名导致缓存无限增长
+MAX_CACHED_ROUTES = 4096
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+def strip_tag(model: str) -> str:
+    """去掉模型名中的标签，如 llama2:13b -> llama2"""
+    return model.split(":", 1)[0]
+
+
+class _ProviderRules:
+    """单个提供商编译后的映射规则"""
+
+    __slots__ = ("provider_name", "default_model", "exact", "patterns")
+
+    def __init__(self, provider):
+        self.provider_name = provider.provider_name
+        self.default_model = provider.default_model
+        self.exact: Dict[str, str] = {}
+        self.patterns: List[Tuple[Pattern, str]] = []
+        for source, target in provider.provider_mappings.items():
+            if _GLOB_CHARS.search(source):
+                self.patterns.append((re.compile(translate(source)), target))
+            else:
+                self.exact[source] = target
+
+    def match(self, model: str) -> Optional[str]:
+        """
+        匹配模型名
+
+        依次尝试：完整名称精确匹配、去掉标签后精确匹配、通配符/前缀规则（按配置顺序）。
+        """
+        target = self.exact.get(model)
+        if target is not None:
+            return target
+        base = strip_tag(model)
+        if base != model:
+            target = self.exact.get(base)
+            if target is not None:
+                return target
+        for pattern, target in self.patterns:
+            if pattern.match(model) or pattern.match(base):
+                return target
+        return None
+
+
+class RoutingTable:
+    """
+    模型路由表
+
+    在加载配置时编译所有提供商的 provider_mappings，解析结果按模型名缓存，
+    每次请求的路由只需一次字典查找。
+    """
+
+    def __init__(self, providers: List):
+        """
+        编译路由表
+
+        Args:
+            providers: API 提供商列表
+        """
+        self._rules = [_ProviderRules(provider) for provider in providers]
+        self._routes: Dict[str, Dict[str, str]] = {}
+
+    def resolve(self, model: str) -> Dict[str, str]:
+        """
+        解析模型路由
+
+        Args:
+            model: Ollama 模型名称
+
+        Returns:
+            能够服务该模型的提供商到上游模型名的映射。
+            有提供商显式匹配时只包含这些提供商，否则所有提供商都使用各自的 default_model。
+            返回值是共享的缓存对象，调用方不能修改。
+        """
+        route = self._routes.get(model)
+        if route is None:
+            route = self._compile_route(model)
+            if len(self._routes) >= MAX_CACHED_ROUTES:
+                self._routes.clear()
+            self._routes[model] = route
+        return route
+
+    def _compile_route(self, model: str) -> Dict[str, str]:
+        matched = {}
+        for rules in self._rules:
+            target = rules.match(model)
+            if target is not None:
+                matched[rules.provider_name] = target
+        if matched:
+            return matched
+        return {rules.provider_name: rules.default_model for rules in self._rules}
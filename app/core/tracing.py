@@ -0,0 +1,152 @@
+"""
+请求耗时分解
+
+请求头带有 X-Debug-Trace，或按 server.trace_sample_rate 抽样命中时，记录请求各阶段的耗时：
+    parse             解析请求体
+    route             模型路由
+    select            选择提供商
+    rate_limit_wait   等待速率限制
+    upstream_headers  发出上游请求到收到响应头（含连接、TLS、上游排队）
+    ttft              收到响应头到第一个 token
+    stream            第一个 token 到最后一个 token
+    serialize         序列化响应分块（累计）
+    write             向客户端写出（累计）
+TracingMiddleware 负责开始记录、统计写出耗时，并在响应头中加入 Server-Timing（响应头发出时已完成的阶段）
+和 X-Trace-Id；流式聊天响应在最后一个分块的 trace 字段中返回完整的分解。请求结束后以 JSON 记录到 app.trace 日志。
+"""
+import json
+import logging
+import random
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Mapping, Optional
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .config import settings
+
+TRACE_HEADER = "X-Debug-Trace"
+
+trace_logger = logging.getLogger("app.trace")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+class Trace:
+    """一次请求的耗时记录，同名阶段的耗时累加"""
+
+    __slots__ = ("trace_id", "path", "start", "spans", "_finished")
+
+    def __init__(self, path: str = ""):
+        """
+        Args:
+            path: 请求路径，记录在日志中
+        """
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.path = path
+        self.start = time.perf_counter_ns()
+        self.spans: Dict[str, int] = {}
+        self._finished = False
+
+    def add(self, name: str, duration_ns: int) -> None:
+        """累加一个阶段的耗时（纳秒）"""
+        self.spans[name] = self.spans.get(name, 0) + duration_ns
+
+    def summary(self) -> Dict[str, float]:
+        """各阶段耗时（毫秒），total 为从开始到现在的时间"""
+        result = {name: round(ns / 1e6, 3) for name, ns in self.spans.items()}
+        result["total"] = round((time.perf_counter_ns() - self.start) / 1e6, 3)
+        return result
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头的值"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.summary().items())
+
+    def finish(self) -> None:
+        """记录结构化日志，只记录一次"""
+        if self._finished:
+            return
+        self._finished = True
+        trace_logger.info(json.dumps({
+            "trace_id": self.trace_id,
+            "path": self.path,
+            "spans_ms": self.summary(),
+        }))
+
+def start_trace(headers: Mapping[str, str], path: str = "", sample_rate: float = 0.0) -> Optional[Trace]:
+    """
+    按请求头或抽样率开始记录当前请求
+
+    Args:
+        headers: 请求头
+        path: 请求路径
+        sample_rate: 没有请求头时的抽样率（0-1）
+
+    Returns:
+        命中时返回 Trace，否则为 None
+    """
+    if headers.get(TRACE_HEADER) or (sample_rate > 0 and random.random() < sample_rate):
+        trace = Trace(path)
+        _current.set(trace)
+        return trace
+    return None
+
+def current_trace() -> Optional[Trace]:
+    """当前请求的 Trace，未记录时为 None"""
+    return _current.get()
+
+class span:
+    """
+    记录一个阶段的耗时；当前请求未记录时几乎没有开销
+
+    用法：
+        with span("route"):
+            ...
+    """
+
+    __slots__ = ("name", "trace", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace = _current.get()
+
+    def __enter__(self) -> "span":
+        if self.trace is not None:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter_ns() - self.start)
+
+class TracingMiddleware:
+    """为命中的请求开始记录耗时（纯 ASGI 中间件，不影响流式响应）"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # 每次读取，热加载修改抽样率后立即生效
+        trace = start_trace(Headers(scope=scope), scope.get("path", ""), settings.server.trace_sample_rate)
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def traced_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [
+                    (b"server-timing", trace.server_timing().encode()),
+                    (b"x-trace-id", trace.trace_id.encode()),
+                ])
+                await send(message)
+                return
+            start = time.perf_counter_ns()
+            await send(message)
+            trace.add("write", time.perf_counter_ns() - start)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            trace.finish()
@@ -11,17 +11,45 @@ logger = logging.getLogger(__name__)
 class Manager:
     """数据库管理器"""
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, load: bool = True):
         """
         初始化数据库管理器
         
         Args:
             file_path: 数据库文件路径
+            load: 是否立即加载；为 False 时由调用方稍后调用 load()（如在后台线程中）
         """
         self.file_path = os.path.join("data", file_path)
         self.lock = threading.Lock()
+        self._data: Dict[str, Any] = {}
+        self._loaded = threading.Event()
+        self._load_error: Optional[Exception] = None
         self._ensure_data_dir()
-        self._load_data()
+        if load:
+            self.load()
+
+    def load(self) -> None:
+        """加载数据库文件，可以在后台线程中调用；加载完成前访问数据的方法会等待"""
+        try:
+            self._load_data()
+        except Exception as e:
+            self._load_error = e
+            raise
+        finally:
+            self._loaded.set()
+
+    @property
+    def ready(self) -> bool:
+        """数据库是否已成功加载"""
+        return self._loaded.is_set() and self._load_error is None
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """数据库内容，加载完成前阻塞等待"""
+        self._loaded.wait()
+        if self._load_error is not None:
+            raise RuntimeError(f"Database {self.file_path} failed to load") from self._load_error
+        return self._data
 
     def _ensure_data_dir(self) -> None:
         """确保数据目录存在"""
@@ -31,10 +59,10 @@ class Manager:
         """加载数据"""
         try:
             with open(self.file_path, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
+                self._data = json.load(f)
         except FileNotFoundError:
             logger.warning(f"Database file not found at {self.file_path}, creating new one")
-            self.data = {
+            self._data = {
                 "models_db": {},
                 "running_models": {},
                 "model_mappings": self._get_default_mappings()
@@ -48,7 +76,7 @@ class Manager:
         """保存数据"""
         try:
             with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=4, ensure_ascii=False)
+                json.dump(self._data, f, indent=4, ensure_ascii=False)
         except Exception as e:
             logger.error(f"Error saving data to {self.file_path}: {str(e)}")
             raise
@@ -105,7 +133,9 @@ class Manager:
         if provider_name:
             provider = settings.get_api_provider(provider_name)
             if provider:
-                return provider.get_model(ollama_model)
+                return settings.get_model_mapping(ollama_model).get(
+                    provider_name, provider.default_model
+                )
             raise ValueError(f"Provider {provider_name} not found")
         
         # 如果没有指定提供商，返回所有提供商的映射
@@ -5,25 +5,88 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT_DIR))
 
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from fastapi.responses import JSONResponse, PlainTextResponse
 import logging
+from app.core import profiler
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
 from app.core.logging import setup_logging
+from app.core.reload import ConfigWatcher
+from app.core.tracing import TracingMiddleware
 from app.db.manager import Manager as DbManager
+from app.api.batch import Batch as ApiBatch
 from app.api.client import Client as ApiClient
 from app.api.mock import Mock as ApiMock
+from app.api.passthrough import Passthrough as ApiPassthrough
 
 # 设置日志
 setup_logging()
 logger = logging.getLogger(__name__)
 
+async def apply_settings(new_settings):
+    """应用热加载的配置：先构建新的提供商集合，再在同一步中替换集合和配置"""
+    new_set = await api_client.build_provider_set(new_settings.api_providers)
+    api_client.swap_provider_set(new_set)
+    settings.replace(new_settings)
+
+# 组件在应用启动时创建，导入本模块不做 I/O，也不创建连接（可以在主进程中预加载后再派生工作进程）
+db: Optional[DbManager] = None
+api_client: Optional[ApiClient] = None
+api_mock: Optional[ApiMock] = None
+api_passthrough: Optional[ApiPassthrough] = None
+api_batch: Optional[ApiBatch] = None
+# 后台预热任务（加载数据库、预热上游连接），完成后 /ready 返回就绪
+warmup_task: Optional[asyncio.Task] = None
+
+def init_components() -> None:
+    """创建组件；数据库只创建管理器，由后台任务加载"""
+    global db, api_client, api_mock, api_passthrough, api_batch
+    try:
+        db = DbManager('db.json', load=False)
+        api_client = ApiClient(providers=settings.api_providers, coordination=settings.coordination)
+        api_mock = ApiMock(db, api_client)
+        api_passthrough = ApiPassthrough(db, api_client)
+        api_batch = ApiBatch(db, api_client)
+    except Exception as e:
+        logger.error(f"Failed to initialize components: {str(e)}")
+        raise
+
+async def warm_up() -> None:
+    """并发加载数据库和预热上游连接"""
+    await asyncio.gather(asyncio.to_thread(db.load), api_client.start())
+    logger.info("Startup warm-up finished, ready")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：创建组件，后台预热，启动配置热加载"""
+    global warmup_task
+    init_components()
+    # 不等待预热完成即开始接受请求；预热前到达的请求自行建立连接
+    warmup_task = asyncio.create_task(warm_up())
+    watcher = ConfigWatcher(
+        settings,
+        on_reload=apply_settings,
+        interval=settings.server.config_reload_interval
+    )
+    await watcher.start()
+    yield
+    await watcher.stop()
+    if not warmup_task.done():
+        warmup_task.cancel()
+    await asyncio.gather(warmup_task, return_exceptions=True)
+    await api_client.aclose()
+
 # 创建应用
 app = FastAPI(
     title="Ollama Mock Server",
     description="A mock server for Ollama API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加 CORS 支持
@@ -33,16 +96,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id"],
 )
-
-# 初始化组件
-try:
-    db = DbManager('db.json')
-    api_client = ApiClient(providers=settings.api_providers)
-    api_mock = ApiMock(db, api_client)
-except Exception as e:
-    logger.error(f"Failed to initialize components: {str(e)}")
-    raise
+# 响应压缩和请求体解压
+app.add_middleware(CompressionMiddleware)
+# 请求耗时分解（X-Debug-Trace 请求头或按抽样率）
+app.add_middleware(TracingMiddleware)
 
 # 路由定义
 @app.post("/api/chat")
@@ -100,20 +159,54 @@ async def list_running_models():
     """列出运行中的模型接口"""
     return await api_mock.list_running_models()
 
+@app.post("/api/batch")
+async def batch(request: Request):
+    """批量聊天补全接口（JSONL 请求，按完成顺序返回 JSONL 结果）"""
+    return await api_batch.run(request)
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    """OpenAI 兼容的聊天补全接口（透传）"""
+    return await api_passthrough.chat_completions(request)
+
+@app.post("/v1/embeddings")
+async def openai_embeddings(request: Request):
+    """OpenAI 兼容的嵌入向量接口（透传）"""
+    return await api_passthrough.embeddings(request)
+
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 5.0, interval_ms: float = 5.0):
+    """
+    对当前工作进程的事件循环采样 seconds 秒，返回 folded stacks（flamegraph.pl / speedscope 可直接读取）
+
+    需要开启 server.debug_endpoints；多进程部署时由接到请求的那个工作进程采样。
+    """
+    if not settings.server.debug_endpoints:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    try:
+        folded = await profiler.profile(seconds, interval_ms / 1000)
+    except profiler.ProfilerBusy as e:
+        return JSONResponse({"detail": str(e)}, status_code=409)
+    return PlainTextResponse(folded)
+
 @app.get("/health")
 async def health_check():
-    """健康检查接口"""
+    """健康检查接口（存活检查，进程能处理请求即返回）"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查接口：数据库加载和上游连接预热完成前返回 503"""
+    if warmup_task is None or not warmup_task.done():
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if warmup_task.cancelled() or warmup_task.exception() is not None:
+        return JSONResponse({"status": "failed"}, status_code=503)
+    return {"status": "ready"}
+
 if __name__ == "__main__":
     try:
-        uvicorn.run(
-            "app.main:app",
-            host="0.0.0.0",
-            port=11434,
-            reload=True,
-            log_config=None  # 使用我们自己的日志配置
-        )
+        from app.server import serve
+        serve()
     except Exception as e:
         logger.error(f"Failed to start server: {str(e)}")
         raise
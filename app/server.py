@@ -0,0 +1,313 @@
+"""
+生产环境启动器
+
+主进程预派生多个工作进程，每个工作进程用 SO_REUSEPORT 绑定同一端口，由内核分配连接。
+不支持 SO_REUSEPORT 负载均衡的平台（Windows、macOS）上由主进程绑定一个套接字，工作进程共享。
+主进程负责转发信号：
+    SIGTERM / SIGINT  优雅退出，工作进程在 drain_timeout 内完成进行中的流式请求
+    SIGHUP            转发给工作进程，热加载配置
+    SIGUSR2           滚动重启，先启动新进程再优雅停止旧进程
+工作进程异常退出时自动重启；启动后很快退出的进程按指数退避重启，连续失败过多时主进程退出。
+开启 preload 时主进程先导入应用模块再派生工作进程，工作进程不再重复导入（只在 fork 时有效；
+滚动重启不会加载新代码）。
+"""
+import importlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+APP = "app.main:app"
+
+# 运行时间短于该值（秒）的退出视为启动失败
+MIN_UPTIME = 5.0
+# 连续启动失败达到该次数时主进程退出
+MAX_CRASHES = 5
+# 重启退避的上限（秒）
+MAX_BACKOFF = 30.0
+# 滚动重启时等待新工作进程开始监听的最长时间（秒）
+STARTUP_TIMEOUT = 60.0
+
+def best_loop() -> str:
+    """可用的最快事件循环"""
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+def best_http() -> str:
+    """可用的最快 HTTP 解析器"""
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+def available_cpus() -> List[int]:
+    """当前进程可以使用的 CPU 列表"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def reuseport_balanced() -> bool:
+    """内核是否会在 SO_REUSEPORT 的多个套接字之间分配连接（目前只有 Linux）"""
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform.startswith("linux")
+
+def bind_socket(host: str, port: int, reuse_port: bool = True) -> socket.socket:
+    """创建监听套接字，reuse_port 为 True 且平台支持时启用 SO_REUSEPORT"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port and hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+class _WorkerServer(uvicorn.Server):
+    """开始监听后通知主进程的 uvicorn 服务"""
+
+    def __init__(self, config: uvicorn.Config, ready):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started:
+            self.ready.set()
+
+
+def run_worker(
+    host: str,
+    port: int,
+    cpu: Optional[int],
+    drain_timeout: float,
+    ready,
+    sock: Optional[socket.socket] = None
+) -> None:
+    """
+    工作进程入口
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        cpu: 绑定的 CPU，None 表示不绑定
+        drain_timeout: 优雅退出的最长时间（秒）
+        ready: 开始监听后设置的事件
+        sock: 主进程共享的套接字，None 时自行用 SO_REUSEPORT 绑定
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+    # 不继承主进程的信号处理；SIGHUP 在应用启动后由配置热加载注册
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+
+    if sock is None:
+        sock = bind_socket(host, port)
+    config = uvicorn.Config(
+        APP,
+        loop=best_loop(),
+        http=best_http(),
+        lifespan="on",
+        timeout_graceful_shutdown=int(drain_timeout),
+        log_config=None  # 使用自定义日志配置
+    )
+    _WorkerServer(config, ready).run(sockets=[sock])
+
+
+class Launcher:
+    """预派生多进程启动器"""
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 11434,
+        workers: int = 0,
+        drain_timeout: float = 30.0,
+        pin_workers: bool = False,
+        preload: bool = False
+    ):
+        """
+        初始化启动器
+
+        Args:
+            host: 监听地址
+            port: 监听端口
+            workers: 工作进程数，0 表示与可用 CPU 数相同
+            drain_timeout: 退出或重启时等待进行中请求完成的最长时间（秒）
+            pin_workers: 是否将每个工作进程绑定到一个 CPU
+            preload: 是否在主进程中预先导入应用模块
+        """
+        self.host = host
+        self.port = port
+        self.cpus = available_cpus()
+        self.workers = workers or len(self.cpus)
+        self.drain_timeout = drain_timeout
+        self.pin_workers = pin_workers
+        self.preload = preload
+        self.processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._ready: Dict[int, Any] = {}
+        self._shared_socket: Optional[socket.socket] = None
+        self._started_at: Dict[int, float] = {}
+        self._crashes: Dict[int, int] = {}
+        self._respawn_at: Dict[int, float] = {}
+        self._should_exit = False
+        self._should_restart = False
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(method)
+
+    def _spawn(self, index: int) -> None:
+        cpu = self.cpus[index % len(self.cpus)] if self.pin_workers else None
+        ready = self._context.Event()
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.host, self.port, cpu, self.drain_timeout, ready, self._shared_socket),
+            name=f"worker-{index}",
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        self._ready[index] = ready
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {process.pid}, cpu {cpu})")
+
+    def _terminate(self, process: multiprocessing.process.BaseProcess) -> None:
+        """通知工作进程优雅退出"""
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+
+    def _wait(self, process: multiprocessing.process.BaseProcess) -> None:
+        """等待工作进程退出，超过期限后强制结束"""
+        process.join(self.drain_timeout + 5)
+        if process.is_alive():
+            logger.warning(f"Worker {process.pid} did not drain in time, killing")
+            process.kill()
+            process.join()
+
+    def _rolling_restart(self) -> None:
+        """逐个替换工作进程：新进程开始监听后再优雅停止旧进程，期间不中断服务"""
+        for index in list(self.processes):
+            old = self.processes[index]
+            old_ready = self._ready[index]
+            self._spawn(index)
+            new = self.processes[index]
+            if not self._ready[index].wait(STARTUP_TIMEOUT) or not new.is_alive():
+                logger.error(f"Replacement for worker {index} did not start, aborting rolling restart")
+                self._terminate(new)
+                self._wait(new)
+                self.processes[index], self._ready[index] = old, old_ready
+                return
+            self._terminate(old)
+            self._wait(old)
+
+    def _handle_exit(self, signum, frame) -> None:
+        self._should_exit = True
+
+    def _handle_restart(self, signum, frame) -> None:
+        self._should_restart = True
+
+    def _handle_reload(self, signum, frame) -> None:
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def run(self) -> None:
+        """启动并监控工作进程，直到收到退出信号"""
+        logger.info(
+            f"Starting {self.workers} workers on {self.host}:{self.port} "
+            f"(loop={best_loop()}, http={best_http()})"
+        )
+        if reuseport_balanced():
+            # 主进程先绑定一次，尽早暴露端口占用等错误
+            bind_socket(self.host, self.port).close()
+        else:
+            self._shared_socket = bind_socket(self.host, self.port, reuse_port=False)
+
+        if self.preload:
+            if self._context.get_start_method() == "fork":
+                importlib.import_module(APP.split(":")[0])
+            else:
+                logger.warning("preload requires the fork start method, ignoring")
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._handle_reload)
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, self._handle_restart)
+
+        while not self._should_exit:
+            if self._should_restart:
+                self._should_restart = False
+                logger.info("Rolling restart")
+                self._rolling_restart()
+            if not self._check_workers():
+                self._shutdown()
+                sys.exit(1)
+            time.sleep(0.5)
+
+        self._shutdown()
+
+    def _check_workers(self) -> bool:
+        """
+        重启退出的工作进程
+
+        Returns:
+            False 表示有工作进程连续启动失败，需要退出
+        """
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            if process.is_alive() or self._should_exit:
+                continue
+
+            if index not in self._respawn_at:
+                if now - self._started_at[index] < MIN_UPTIME:
+                    self._crashes[index] = self._crashes.get(index, 0) + 1
+                else:
+                    self._crashes[index] = 0
+                crashes = self._crashes[index]
+                if crashes >= MAX_CRASHES:
+                    logger.error(f"Worker {index} failed to start {crashes} times in a row, giving up")
+                    return False
+                delay = min(MAX_BACKOFF, 0.5 * (2 ** crashes)) if crashes else 0.0
+                logger.warning(
+                    f"Worker {index} exited with code {process.exitcode}, restarting in {delay:.1f}s"
+                )
+                self._respawn_at[index] = now + delay
+
+            if now >= self._respawn_at[index]:
+                del self._respawn_at[index]
+                self._spawn(index)
+        return True
+
+    def _shutdown(self) -> None:
+        """通知所有工作进程优雅退出并等待完成"""
+        logger.info("Shutting down, draining workers")
+        for process in self.processes.values():
+            self._terminate(process)
+        for process in self.processes.values():
+            self._wait(process)
+        if self._shared_socket is not None:
+            self._shared_socket.close()
+
+
+def serve() -> None:
+    """按配置启动生产环境服务（环境变量优先于配置文件中的 server 配置）"""
+    from .core.config import settings
+    server = settings.server
+    Launcher(
+        host=server.host,
+        port=server.port,
+        workers=server.workers,
+        drain_timeout=server.drain_timeout,
+        pin_workers=server.pin_workers,
+        preload=server.preload_app
+    ).run()
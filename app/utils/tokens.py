@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Tuple
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+# 回复前缀的固定开销
+REPLY_PRIMING = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    快速估算文本的 token 数
+
+    ASCII 字符按约 4 个字符 1 个 token 计算，非 ASCII 字符（如中文）按 1 个字符 1 个 token 计算。
+    只做一次编码，不依赖分词器。
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    ascii_len = len(text.encode("ascii", "ignore"))
+    return (ascii_len + 3) // 4 + (len(text) - ascii_len)
+
+
+# 消息估算缓存上限，超过后清空
+MAX_CACHED_MESSAGES = 8192
+# 缓存键中保留的内容首尾长度
+_KEY_EDGE = 64
+
+_message_cache: Dict[Tuple[str, int, str, str], int] = {}
+
+
+def _estimate_message(role: str, content: str) -> int:
+    """
+    估算单条消息的 token 数
+
+    按消息缓存，重复的对话历史不会重复计算。缓存键只取内容长度和首尾片段，
+    查找开销与消息长度无关，缓存占用的内存也有上限；首尾与长度都相同的不同内容会共用估算值，
+    对估算来说可以接受。
+    """
+    key = (role, len(content), content[:_KEY_EDGE], content[-_KEY_EDGE:])
+    tokens = _message_cache.get(key)
+    if tokens is None:
+        tokens = estimate_tokens(role) + estimate_tokens(content) + MESSAGE_OVERHEAD
+        if len(_message_cache) >= MAX_CACHED_MESSAGES:
+            _message_cache.clear()
+        _message_cache[key] = tokens
+    return tokens
+
+
+def _message_text(content: Any) -> str:
+    """提取消息内容中的文本（兼容多模态的列表格式）"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") for part in content
+            if isinstance(part, dict)
+        )
+    return ""
+
+
+def estimate_messages(messages: List[Dict[str, Any]]) -> int:
+    """
+    估算消息列表的 prompt token 数
+
+    Args:
+        messages: 消息列表
+
+    Returns:
+        估算的 token 数
+    """
+    total = REPLY_PRIMING
+    for message in messages:
+        total += _estimate_message(
+            message.get("role", ""),
+            _message_text(message.get("content"))
+        )
+    return total
+
+
+class TokenCounter:
+    """流式增量 token 计数器，每个分块只做一次编码"""
+
+    __slots__ = ("_ascii", "_other")
+
+    def __init__(self):
+        self._ascii = 0
+        self._other = 0
+
+    def add(self, text: str) -> None:
+        """累加一个增量分块"""
+        ascii_len = len(text.encode("ascii", "ignore"))
+        self._ascii += ascii_len
+        self._other += len(text) - ascii_len
+
+    @property
+    def count(self) -> int:
+        """当前估算的 token 数"""
+        if not self._ascii:
+            return self._other
+        return (self._ascii + 3) // 4 + self._other
@@ -0,0 +1,402 @@
+"""
+性能基准测试
+
+启动一个本地的模拟 OpenAI 上游和 Ollama Mock Server，对服务器施加负载并统计结果。
+
+用法:
+    python benchmark.py load --workers 1,2,4 --concurrency 64 --duration 10
+    python benchmark.py ttft --handshake 0.1 --runs 5
+    python benchmark.py startup --workers 4 --runs 5
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+import httpx
+import yaml
+
+ROOT_DIR = Path(__file__).resolve().parent
+
+
+# ---------------------------------------------------------------------------
+# 模拟上游
+# ---------------------------------------------------------------------------
+
+def create_upstream_app(delay: float, chunks: int, handshake: float = 0.0):
+    """
+    创建模拟的 OpenAI 兼容上游（流式返回 chunks 个分块，每个间隔 delay 秒）
+
+    handshake 大于 0 时，每个新连接上的第一个请求额外等待 handshake 秒，模拟 DNS/TCP/TLS 建连开销。
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    async def chat(request):
+        body = await request.json()
+
+        async def stream():
+            for i in range(chunks):
+                if delay:
+                    await asyncio.sleep(delay)
+                chunk = {
+                    "id": "bench", "object": "chat.completion.chunk", "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": f"token{i} "}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            usage = {
+                "id": "bench", "object": "chat.completion.chunk", "created": 0,
+                "model": body["model"], "choices": [],
+                "usage": {"prompt_tokens": 10, "completion_tokens": chunks, "total_tokens": 10 + chunks}
+            }
+            yield f"data: {json.dumps(usage)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def models(request):
+        return JSONResponse({"object": "list", "data": []})
+
+    app = Starlette(routes=[
+        Route("/v1/chat/completions", chat, methods=["POST"]),
+        Route("/v1/models", models),
+    ])
+    if not handshake:
+        return app
+
+    seen_connections = set()
+
+    async def handshake_app(scope, receive, send):
+        if scope["type"] == "http" and scope.get("client") not in seen_connections:
+            seen_connections.add(scope.get("client"))
+            await asyncio.sleep(handshake)
+        await app(scope, receive, send)
+
+    return handshake_app
+
+
+def run_upstream(port: int, delay: float, chunks: int, handshake: float = 0.0) -> None:
+    import uvicorn
+    uvicorn.run(create_upstream_app(delay, chunks, handshake), host="127.0.0.1", port=port, log_level="warning")
+
+
+# ---------------------------------------------------------------------------
+# 进程管理
+# ---------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> float:
+    """等待端口可以连接，返回等待的时间"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return time.perf_counter() - start
+        except OSError:
+            time.sleep(0.02)
+    raise TimeoutError(f"Port {port} not ready after {timeout}s")
+
+
+@contextmanager
+def upstream(delay: float, chunks: int, handshake: float = 0.0) -> Iterator[int]:
+    """在子进程中运行模拟上游，返回端口"""
+    port = free_port()
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_upstream, args=(port, delay, chunks, handshake), daemon=True
+    )
+    process.start()
+    try:
+        wait_for_port(port)
+        yield port
+    finally:
+        process.terminate()
+        process.join()
+
+
+@contextmanager
+def workdir(upstream_port: int, extra_provider: Dict = None, server: Dict = None) -> Iterator[Path]:
+    """创建服务器的临时工作目录（配置文件与数据库）"""
+    path = Path(tempfile.mkdtemp(prefix="ollama-mock-bench-"))
+    provider = {
+        "provider_name": "bench",
+        "base_url": f"http://127.0.0.1:{upstream_port}/v1",
+        "api_key": "bench",
+        "rate_limit": 1e9,
+        "default_model": "bench-model",
+    }
+    provider.update(extra_provider or {})
+    config = {"api_providers": [provider], "server": dict(server or {}, config_reload_interval=0)}
+    (path / "config").mkdir()
+    (path / "data").mkdir()
+    (path / "config" / "config.yaml").write_text(yaml.safe_dump(config), encoding="utf-8")
+    shutil.copy(ROOT_DIR / "data" / "db.json.example", path / "data" / "db.json")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def mock_server(cwd: Path, workers: int, env: Dict[str, str] = None) -> Iterator[int]:
+    """以生产模式启动服务器，返回端口"""
+    port = free_port()
+    process_env = dict(
+        os.environ, PORT=str(port), HOST="127.0.0.1", WORKERS=str(workers), RELOAD="false",
+        **(env or {})
+    )
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT_DIR / "run.py")],
+        cwd=cwd, env=process_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        # 等待所有工作进程完成启动
+        time.sleep(1.0 + 0.2 * workers)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+
+# ---------------------------------------------------------------------------
+# 负载
+# ---------------------------------------------------------------------------
+
+CHAT_BODY = {
+    "model": "llama2",
+    "messages": [{"role": "user", "content": "Hello, how are you?"}],
+}
+# 各接口的路径和请求体
+APIS = {
+    "ollama": ("/api/chat", CHAT_BODY),
+    "openai": ("/v1/chat/completions", dict(CHAT_BODY, stream=True)),
+}
+
+
+async def _load(port: int, concurrency: int, duration: float, api: str = "ollama") -> Dict[str, List[float]]:
+    path, body = APIS[api]
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                first = None
+                try:
+                    async with client.stream("POST", path, json=body) as response:
+                        async for _ in response.aiter_lines():
+                            if first is None:
+                                first = time.perf_counter()
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                end = time.perf_counter()
+                latencies.append(end - start)
+                ttfts.append((first or end) - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return {"latencies": latencies, "ttfts": ttfts, "errors": [errors]}
+
+
+def _load_process(port: int, concurrency: int, duration: float, api: str, queue) -> None:
+    queue.put(asyncio.run(_load(port, concurrency, duration, api)))
+
+
+def run_load(
+    port: int, concurrency: int, duration: float, processes: int, api: str = "ollama"
+) -> Dict[str, List[float]]:
+    """用多个进程施加负载，避免压测端成为瓶颈"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    per_process = max(1, concurrency // processes)
+    procs = [
+        context.Process(target=_load_process, args=(port, per_process, duration, api, queue))
+        for _ in range(processes)
+    ]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    merged: Dict[str, List[float]] = {"latencies": [], "ttfts": [], "errors": []}
+    for result in results:
+        for key, values in result.items():
+            merged[key].extend(values)
+    return merged
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(label: str, result: Dict[str, List[float]], duration: float) -> None:
+    latencies = result["latencies"]
+    ttfts = result["ttfts"]
+    print(
+        f"{label:<24} {len(latencies) / duration:>9.1f} req/s"
+        f"  p50 {percentile(latencies, 0.5) * 1000:>7.1f}ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:>7.1f}ms"
+        f"  ttft p50 {percentile(ttfts, 0.5) * 1000:>7.1f}ms"
+        f"  errors {sum(result['errors']):.0f}"
+    )
+
+
+def cmd_load(args) -> None:
+    """不同工作进程数下的吞吐量与延迟"""
+    workers = [int(w) for w in args.workers.split(",")]
+    with upstream(args.delay, args.chunks) as upstream_port, workdir(upstream_port) as cwd:
+        print(f"cpus={os.cpu_count()} concurrency={args.concurrency} duration={args.duration}s")
+        for count in workers:
+            with mock_server(cwd, count) as port:
+                for api in args.api.split(","):
+                    result = run_load(port, args.concurrency, args.duration, args.load_processes, api)
+                    report(f"workers={count} {api}", result, args.duration)
+
+
+async def _first_request_ttft(port: int) -> float:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+        start = time.perf_counter()
+        async with client.stream("POST", "/api/chat", json=CHAT_BODY) as response:
+            async for _ in response.aiter_lines():
+                return time.perf_counter() - start
+    return time.perf_counter() - start
+
+
+def cmd_ttft(args) -> None:
+    """冷启动后第一个请求的 TTFT（上游连接预热关闭 / 开启）"""
+    with upstream(args.delay, args.chunks, args.handshake) as upstream_port:
+        print(f"upstream handshake={args.handshake * 1000:.0f}ms runs={args.runs}")
+        for min_warm in (0, args.min_warm):
+            provider = {"min_warm": min_warm, "ping_interval": 0}
+            samples = []
+            with workdir(upstream_port, extra_provider=provider) as cwd:
+                for _ in range(args.runs):
+                    with mock_server(cwd, 1) as port:
+                        samples.append(asyncio.run(_first_request_ttft(port)))
+            print(
+                f"min_warm={min_warm:<3} first-request ttft"
+                f"  p50 {percentile(samples, 0.5) * 1000:>7.1f}ms"
+                f"  max {max(samples) * 1000:>7.1f}ms"
+            )
+
+
+IMPORT_SCRIPT = (
+    "import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter(); "
+    "import app.main; print(time.perf_counter() - start)"
+)
+
+
+def measure_import(cwd: Path) -> float:
+    """在新的解释器中导入 app.main 的耗时"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, str(ROOT_DIR)],
+        cwd=cwd, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_boot(cwd: Path, workers: int, env: Dict[str, str] = None) -> Dict[str, float]:
+    """启动服务器，返回从启动进程到第一个请求成功、到 /ready 返回就绪的时间"""
+    port = free_port()
+    process_env = dict(
+        os.environ, PORT=str(port), HOST="127.0.0.1", WORKERS=str(workers), RELOAD="false",
+        **(env or {})
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT_DIR / "run.py")],
+        cwd=cwd, env=process_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result: Dict[str, float] = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while time.perf_counter() - start < 60 and len(result) < 2:
+                try:
+                    if "first_request" not in result and client.get("/api/tags").status_code == 200:
+                        result["first_request"] = time.perf_counter() - start
+                    if "ready" not in result and client.get("/ready").status_code == 200:
+                        result["ready"] = time.perf_counter() - start
+                except httpx.HTTPError:
+                    time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+    return result
+
+
+def cmd_startup(args) -> None:
+    """冷启动：导入耗时和第一个请求成功的时间"""
+    with upstream(0.0, 1) as upstream_port, workdir(upstream_port) as cwd:
+        imports = [measure_import(cwd) for _ in range(args.runs)]
+        print(f"import app.main  p50 {percentile(imports, 0.5) * 1000:>7.1f}ms  min {min(imports) * 1000:>7.1f}ms")
+        for preload in ("false", "true"):
+            runs = [measure_boot(cwd, args.workers, {"PRELOAD_APP": preload}) for _ in range(args.runs)]
+            line = f"workers={args.workers} preload={preload:<5}"
+            for key in ("first_request", "ready"):
+                line += f"  {key} p50 {percentile([r[key] for r in runs], 0.5) * 1000:>7.1f}ms"
+            print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ollama Mock Server benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser("load", help=cmd_load.__doc__)
+    load.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="逗号分隔的工作进程数")
+    load.add_argument("--concurrency", type=int, default=64)
+    load.add_argument("--duration", type=float, default=10.0)
+    load.add_argument("--load-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    load.add_argument("--delay", type=float, default=0.0, help="上游每个分块的间隔（秒）")
+    load.add_argument("--chunks", type=int, default=16, help="上游每个响应的分块数")
+    load.add_argument("--api", default="ollama", help="逗号分隔的接口：ollama（/api/chat）、openai（/v1/chat/completions 透传）")
+    load.set_defaults(func=cmd_load)
+
+    ttft = subparsers.add_parser("ttft", help=cmd_ttft.__doc__)
+    ttft.add_argument("--handshake", type=float, default=0.1, help="模拟的新连接建连开销（秒）")
+    ttft.add_argument("--min-warm", type=int, default=1)
+    ttft.add_argument("--runs", type=int, default=5)
+    ttft.add_argument("--delay", type=float, default=0.0)
+    ttft.add_argument("--chunks", type=int, default=16)
+    ttft.set_defaults(func=cmd_ttft)
+
+    startup = subparsers.add_parser("startup", help=cmd_startup.__doc__)
+    startup.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=cmd_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
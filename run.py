@@ -15,13 +15,17 @@ sys.path.append(str(ROOT_DIR))
 if __name__ == "__main__":
     # 设置日志
     setup_logging()
-    
-    # 运行服务器
-    uvicorn.run(
-        "app.main:app",
-        host=os.getenv("HOST", "0.0.0.0"),
-        port=int(os.getenv("PORT", "11434")),
-        reload=os.getenv("RELOAD", "true").lower() == "true",
-        workers=int(os.getenv("WORKERS", "1")),
-        log_config=None  # 使用自定义日志配置
-    ) 
\ No newline at end of file
+
+    if os.getenv("RELOAD", "false").lower() == "true":
+        # 开发模式：单进程，代码变更自动重载
+        uvicorn.run(
+            "app.main:app",
+            host=os.getenv("HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", "11434")),
+            reload=True,
+            log_config=None  # 使用自定义日志配置
+        )
+    else:
+        # 生产模式：预派生多个工作进程，优雅退出
+        from app.server import serve
+        serve()
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# 将项目根目录添加到 Python 路径
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
@@ -0,0 +1,25 @@
+import asyncio
+import socket
+import uvicorn
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def serve(app, port):
+    """在当前事件循环中启动 uvicorn，返回 (server, task)"""
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def shutdown(servers):
+    for server, task in servers:
+        server.should_exit = server.force_exit = True
+        await task
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import httpx
+from fastapi import FastAPI
+from app.api.batch import Batch
+from app.api.client import Client
+from app.core.config import ApiProvider, settings
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    async def aiter_lines(self):
+        chunk = {"choices": [{"index": 0, "delta": {"content": self.content}}]}
+        yield f"data: {json.dumps(chunk)}"
+        yield "data: [DONE]"
+
+    async def aclose(self):
+        pass
+
+
+class FakePool:
+    """按消息内容决定耗时，记录同时进行的请求数；fail 为 True 时总是失败"""
+
+    def __init__(self, stats, fail=False):
+        self.stats = stats
+        self.fail = fail
+
+    async def open_chat(self, payload, headers=None):
+        text = payload["messages"][-1]["content"]
+        if self.fail or text == "bad":
+            raise ConnectionError("upstream down")
+        self.stats["active"] += 1
+        self.stats["peak"] = max(self.stats["peak"], self.stats["active"])
+        try:
+            await asyncio.sleep(float(text))
+        finally:
+            self.stats["active"] -= 1
+        self.stats["calls"] += 1
+        return FakeResponse(f"echo {text}")
+
+
+class FakeDb:
+    def get_model_mapping(self, model):
+        return {"a": "m", "b": "m"}
+
+
+def run_batch(body, params="", fail_a=False):
+    stats = {"active": 0, "peak": 0, "calls": 0}
+
+    async def run():
+        api_client = Client([
+            ApiProvider(provider_name=name, base_url="http://127.0.0.1:1/v1", api_key="key",
+                        default_model="m", rate_limit=1000)
+            for name in ("a", "b")
+        ])
+        api_client.provider_set.clients["a"] = FakePool(stats, fail=fail_a)
+        api_client.provider_set.clients["b"] = FakePool(stats)
+        app = FastAPI()
+        app.post("/api/batch")(Batch(FakeDb(), api_client).run)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as http:
+            response = await http.post(f"/api/batch{params}", content=body)
+        return response
+
+    response = asyncio.run(asyncio.wait_for(run(), 10))
+    return response, [json.loads(line) for line in response.text.splitlines()], stats
+
+
+def jsonl(*items):
+    return "\n".join(json.dumps(item) for item in items).encode()
+
+
+def item(item_id, delay):
+    return {"id": item_id, "model": "llama2", "messages": [{"role": "user", "content": str(delay)}]}
+
+
+def test_results_in_completion_order_with_bounded_concurrency():
+    body = jsonl(item("slow", 0.3), item("fast", 0.0), item("mid", 0.1), *[item(i, 0.05) for i in range(6)])
+    response, lines, stats = run_batch(body, "?concurrency=3")
+    assert response.status_code == 200
+    ids = [line["id"] for line in lines]
+    assert sorted(map(str, ids)) == sorted(map(str, ["slow", "fast", "mid", *range(6)]))
+    assert ids.index("fast") < ids.index("mid") < ids.index("slow")
+    assert stats["peak"] == 3
+    fast = next(line for line in lines if line["id"] == "fast")
+    assert fast["response"]["message"]["content"] == "echo 0.0"
+    assert fast["response"]["model"] == "llama2" and fast["response"]["done"]
+
+
+def test_invalid_lines_and_failover():
+    body = b"\n".join([
+        b"not json",
+        json.dumps({"model": "llama2"}).encode(),
+        jsonl(item(1, 0), item(1, 0), item("x", "bad")),
+    ])
+    # 提供商 a 总是失败，请求由 b 完成
+    response, lines, stats = run_batch(body, fail_a=True)
+    by_id = {}
+    for line in lines:
+        by_id.setdefault(line["id"], []).append(line)
+    # 无效的行以行号为 id，先于执行结果返回
+    assert [line.get("error") for line in by_id[1][:2]] == ["Invalid JSON", "Duplicate id"]
+    assert by_id[1][2]["response"]["message"]["content"] == "echo 0"
+    assert "required" in by_id[2][0]["error"]
+    assert by_id["x"][0]["error"]
+
+
+def test_checkpoint_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.server, "batch_checkpoint_dir", str(tmp_path))
+    body = jsonl(item("a1", 0), item("a2", 0), item("a3", "bad"))
+    response, lines, stats = run_batch(body, "?batch_id=job-1")
+    assert stats["calls"] == 2
+    checkpoint = tmp_path / "job-1.jsonl"
+    assert sorted(json.loads(line)["id"] for line in checkpoint.read_text().splitlines()) == ["a1", "a2"]
+
+    # 模拟中断时写了一半的行
+    with open(checkpoint, "a") as f:
+        f.write('{"id": "a3", "resp')
+    body = jsonl(item("a1", 0), item("a2", 0), item("a3", 0), item("a4", 0))
+    response, lines, stats = run_batch(body, "?batch_id=job-1")
+    # 只执行没有完成的请求，已完成的结果从断点返回
+    assert stats["calls"] == 2
+    assert sorted(line["id"] for line in lines) == ["a1", "a2", "a3", "a4"]
+    assert all("response" in line for line in lines)
+    saved = [json.loads(line)["id"] for line in checkpoint.read_text().splitlines() if line.endswith("}")]
+    assert sorted(saved) == ["a1", "a2", "a3", "a4"]
+
+    response, lines, stats = run_batch(body, "?batch_id=../etc")
+    assert response.status_code == 400
@@ -0,0 +1,57 @@
+import asyncio
+from app.api.client import Client
+from app.core.config import ApiProvider
+
+
+def make_provider(name="a", **kwargs):
+    data = {
+        "provider_name": name,
+        "base_url": "http://127.0.0.1:1/v1",
+        "api_key": "key",
+        "default_model": "model",
+    }
+    data.update(kwargs)
+    return ApiProvider(**data)
+
+
+def closed_clients(client_set):
+    return {name for name, c in client_set.clients.items() if c.is_closed()}
+
+
+def test_reload_reuses_unchanged_state():
+    client = Client([make_provider("a"), make_provider("b", rate_limit=1.0)])
+    old = client.provider_set
+    asyncio.run(client.update_providers([
+        make_provider("a", weight=5),
+        make_provider("b", rate_limit=3.0, api_key="rotated"),
+    ]))
+    new = client.provider_set
+    # a 只改了权重：客户端和速率限制器都复用
+    assert new.clients["a"] is old.clients["a"]
+    assert new.limiters["a"] is old.limiters["a"]
+    # b 改了速率和密钥：都重新创建，旧集合空闲，旧客户端立即关闭
+    assert new.clients["b"] is not old.clients["b"]
+    assert new.limiters["b"] is not old.limiters["b"]
+    assert closed_clients(old) == {"b"}
+    assert not closed_clients(new)
+
+
+def test_client_kept_open_while_any_retired_set_uses_it():
+    client = Client([make_provider("a")])
+    set1 = client.provider_set
+    set1.active += 1
+    asyncio.run(client.update_providers([make_provider("a", weight=2)]))
+    set2 = client.provider_set
+    assert set2.clients["a"] is set1.clients["a"]
+    set2.active += 1
+    asyncio.run(client.update_providers([make_provider("a", api_key="rotated")]))
+    set3 = client.provider_set
+    shared = set1.clients["a"]
+
+    # set1 排空时 set2 仍在使用同一个客户端，不能关闭
+    client._release(set1)
+    assert not shared.is_closed()
+
+    client._release(set2)
+    assert shared.is_closed()
+    assert not set3.clients["a"].is_closed()
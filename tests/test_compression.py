@@ -0,0 +1,142 @@
+import asyncio
+import gzip
+import json
+import zlib
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from starlette.responses import StreamingResponse
+from app.core import compression
+from app.core.compression import CompressionMiddleware, choose_encoding, stream_compressor
+from app.core.config import settings
+from helpers import free_port, serve, shutdown
+
+LARGE = {"models": [{"name": f"model-{i}:latest", "size": 4661216384, "digest": "a" * 64} for i in range(200)]}
+
+
+def make_app(stream_gate=None):
+    app = FastAPI()
+
+    @app.get("/large")
+    async def large():
+        return LARGE
+
+    @app.get("/small")
+    async def small():
+        return {"status": "ok"}
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        data = await request.json()
+        return {"count": len(data["input"]), "length": request.headers["content-length"]}
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            yield b'{"n": 1}\n'
+            await stream_gate.wait()
+            yield b'{"n": 2}\n'
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    app.add_middleware(CompressionMiddleware)
+    return app
+
+
+def request(method, path, **kwargs):
+    async def run():
+        transport = httpx.ASGITransport(make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.request(method, path, **kwargs)
+
+    return asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert choose_encoding("gzip, deflate, br") == "gzip"
+    assert choose_encoding("zstd, gzip;q=0.5") == "gzip"
+    assert choose_encoding("*") == "gzip"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("") is None
+
+
+def test_large_responses_are_compressed(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    response = request("GET", "/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(json.dumps(LARGE)) / 5
+    assert response.json() == LARGE
+
+    small = request("GET", "/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers and small.json() == {"status": "ok"}
+    identity = request("GET", "/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers and identity.json() == LARGE
+
+    # 超过线程阈值时在线程中压缩，结果相同
+    monkeypatch.setattr(settings.server, "compression_offload_size", 0)
+    offloaded = request("GET", "/large", headers={"Accept-Encoding": "gzip"})
+    assert offloaded.headers["content-encoding"] == "gzip" and offloaded.json() == LARGE
+
+
+def test_compressed_request_bodies(monkeypatch):
+    body = json.dumps({"input": ["text"] * 1000}).encode()
+    response = request("POST", "/echo", content=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    assert response.json() == {"count": 1000, "length": str(len(body))}
+
+    assert request("POST", "/echo", content=b"garbage", headers={"Content-Encoding": "gzip"}).status_code == 400
+    assert request("POST", "/echo", content=body, headers={"Content-Encoding": "br"}).status_code == 415
+    monkeypatch.setattr(settings.server, "max_request_body", 1000)
+    too_large = request("POST", "/echo", content=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    assert too_large.status_code == 413
+
+
+def test_stream_compressor_flushes_each_chunk():
+    compress_chunk, finish = stream_compressor("gzip")
+    decompressor = zlib.decompressobj(31)
+    for line in (b'{"n": 1}\n', b'{"n": 2}\n'):
+        assert decompressor.decompress(compress_chunk(line)) == line
+    assert decompressor.decompress(finish()) == b"" and decompressor.eof
+
+
+def test_streams_are_compressed_per_chunk_when_enabled(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+
+    async def run():
+        gate, port = asyncio.Event(), free_port()
+        servers = [await serve(make_app(gate), port)]
+        try:
+            async with httpx.AsyncClient() as http:
+                url = f"http://127.0.0.1:{port}/stream"
+                headers = {"Accept-Encoding": "gzip"}
+                # 默认不压缩流式响应
+                gate.set()
+                response = await http.get(url, headers=headers)
+                assert "content-encoding" not in response.headers
+                assert response.text == '{"n": 1}\n{"n": 2}\n'
+                gate.clear()
+                monkeypatch.setattr(settings.server, "compression_streams", True)
+                async with http.stream("GET", url, headers=headers) as response:
+                    assert response.headers["content-encoding"] == "gzip"
+                    decompressor = zlib.decompressobj(31)
+                    received = b""
+                    async for raw in response.aiter_raw():
+                        received += decompressor.decompress(raw)
+                        # 第一个分块在生成器继续之前就能完整解压
+                        if received == b'{"n": 1}\n':
+                            gate.set()
+                    assert received == b'{"n": 1}\n{"n": 2}\n'
+                    assert decompressor.eof
+        finally:
+            await shutdown(servers)
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_zstd_round_trip():
+    zstandard = pytest.importorskip("zstandard")
+    assert choose_encoding("gzip, zstd") == "zstd"
+    data = json.dumps(LARGE).encode()
+    assert zstandard.ZstdDecompressor().decompress(compression.compress(data, "zstd")) == data
+    assert compression.decompress(compression.compress(data, "zstd"), "zstd", len(data)) == data
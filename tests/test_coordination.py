@@ -0,0 +1,185 @@
+import asyncio
+import time
+from app.api.client import Client
+from app.api.coordination import CircuitBreaker, LocalCoordinator, RedisCoordinator
+from app.api.limiter import RateLimiter
+from app.core.config import ApiProvider, CoordinationSettings
+from helpers import free_port
+
+
+class RespServer:
+    """最小的 Redis 协议服务（INCR / INCRBY / PEXPIRE / SET PX / MGET / AUTH / SELECT），记录收到的命令"""
+
+    def __init__(self):
+        self.values = {}
+        self.commands = []
+
+    async def start(self, port):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _get(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self.execute(args))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def execute(self, args):
+        name = args[0].decode().upper()
+        self.commands.append(name)
+        if name in ("INCR", "INCRBY"):
+            key = args[1]
+            _, expires = self.values.get(key, (None, None))
+            value = int(self._get(key) or 0) + (int(args[2]) if name == "INCRBY" else 1)
+            self.values[key] = (str(value).encode(), expires)
+            return b":%d\r\n" % value
+        if name == "PEXPIRE":
+            if self._get(args[1]) is None:
+                return b":0\r\n"
+            self.values[args[1]] = (self.values[args[1]][0], time.monotonic() + int(args[2]) / 1000)
+            return b":1\r\n"
+        if name == "SET":
+            self.values[args[1]] = (args[2], time.monotonic() + int(args[4]) / 1000)
+            return b"+OK\r\n"
+        if name == "MGET":
+            out = b"*%d\r\n" % (len(args) - 1)
+            for key in args[1:]:
+                value = self._get(key)
+                out += b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            return out
+        if name in ("AUTH", "SELECT", "PING"):
+            return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+
+def with_server(test):
+    async def run():
+        server, port = RespServer(), free_port()
+        await server.start(port)
+        try:
+            await test(server, f"redis://:secret@127.0.0.1:{port}/2")
+        finally:
+            await server.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_leased_limit_is_shared_across_instances():
+    async def test(server, url):
+        coordinators = [RedisCoordinator(url, "t"), RedisCoordinator(url, "t")]
+        # 两个实例共用每分钟 20 个请求的额度，每次领取 2 个
+        limiters = [
+            RateLimiter(1000, rpm=20, coordinator=c, key="p", lease_fraction=0.1) for c in coordinators
+        ]
+        window = int(time.time() // 60)
+        sent = 0
+        blocked = set()
+        for i in range(200):
+            if len(blocked) == 2:
+                break
+            if i % 2 in blocked:
+                continue
+            reservation = limiters[i % 2].reserve()
+            if reservation.wait > 1:
+                # 共享额度已用完，需要等到下一个窗口
+                blocked.add(i % 2)
+                continue
+            await asyncio.sleep(reservation.wait)
+            sent += 1
+        if int(time.time() // 60) == window:
+            # 各实例只在续租往返期间透支
+            assert len(blocked) == 2
+            assert 20 <= sent <= 24
+        assert server.commands[:2] == ["AUTH", "SELECT"]
+        # 请求路径上不需要每个请求一次往返
+        assert server.commands.count("INCRBY") < sent
+        for c in coordinators:
+            await c.aclose()
+
+    with_server(test)
+
+
+def test_unreachable_store_falls_back_to_local_limits():
+    async def run():
+        limiter = RateLimiter(
+            1000, tpm=1000, coordinator=RedisCoordinator(f"redis://127.0.0.1:{free_port()}", timeout=0.5), key="p"
+        )
+        for _ in range(5):
+            reservation = limiter.reserve(10)
+            assert reservation.wait < 1
+            await asyncio.sleep(reservation.wait + 0.01)
+        assert limiter.shared_token_bucket.tokens > 0
+        limiter.reconcile(reservation, 5)
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_circuit_state_is_shared():
+    async def test(server, url):
+        config = CoordinationSettings.model_construct(
+            circuit_threshold=3, circuit_window=10.0, circuit_cooldown=30.0, sync_interval=0.05
+        )
+        first = CircuitBreaker(RedisCoordinator(url), config)
+        second = CircuitBreaker(RedisCoordinator(url), config)
+        second.start(lambda: ["a", "b"])
+        for _ in range(3):
+            first.record_failure("a")
+            await asyncio.sleep(0.01)
+        assert first.is_open("a") and not first.is_open("b")
+        await asyncio.sleep(0.2)
+        assert second.is_open("a") and not second.is_open("b")
+        for breaker in (first, second):
+            await breaker.aclose()
+            await breaker.coordinator.aclose()
+
+    with_server(test)
+
+
+def test_open_circuit_is_skipped_by_selection():
+    async def run():
+        client = Client([
+            ApiProvider(provider_name=name, base_url="http://127.0.0.1:1/v1", default_model="m", rate_limit=1000)
+            for name in ("a", "b")
+        ])
+        for _ in range(5):
+            client.breaker.record_failure("a")
+        await asyncio.sleep(0.01)
+        assert all(client._select_provider(0).provider_name == "b" for _ in range(20))
+        # 所有提供商都熔断时仍然选择
+        for _ in range(5):
+            client.breaker.record_failure("b")
+        await asyncio.sleep(0.01)
+        assert client._select_provider(0).provider_name in ("a", "b")
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_local_coordinator_take():
+    async def run():
+        coordinator = LocalCoordinator()
+        assert await coordinator.take("k", 6, 10, 1) == 6
+        assert await coordinator.take("k", 6, 10, 1) == 4
+        assert await coordinator.take("k", 6, 10, 1) == 0
+        assert await coordinator.get_many(["k", "missing"]) == ["10", None]
+
+    asyncio.run(run())
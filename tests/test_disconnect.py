@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from starlette.responses import StreamingResponse
+from app.api.client import Client
+from app.api.mock import Mock
+from app.core.config import ApiProvider
+from helpers import free_port, serve, shutdown
+
+
+class Upstream:
+    """无限生成的模拟上游，记录生成的分块数和生成器何时被停止"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.generated = 0
+        self.stopped_at = None
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat)
+
+    async def chat(self, request: Request):
+        async def stream():
+            try:
+                while True:
+                    self.generated += 1
+                    chunk = {"choices": [{"index": 0, "delta": {"content": "token "}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(self.interval)
+            finally:
+                self.stopped_at = time.monotonic()
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+class FakeDb:
+    def get_model_mapping(self, model):
+        return {"up": "upstream-model"}
+
+
+def with_spec_version(app, spec_version):
+    """模拟不同 ASGI 规范版本的服务器（2.4 起 Starlette 不再并发监听断开）"""
+    async def wrapped(scope, receive, send):
+        if scope["type"] == "http":
+            scope = dict(scope, asgi=dict(scope.get("asgi", {}), spec_version=spec_version))
+        await app(scope, receive, send)
+    return wrapped
+
+
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+@pytest.mark.parametrize("interval", [0.01, 5.0], ids=["streaming", "stalled"])
+def test_client_abort_stops_upstream(interval, spec_version):
+    async def run():
+        upstream = Upstream(interval)
+        upstream_port, mock_port = free_port(), free_port()
+        api_client = Client([ApiProvider(
+            provider_name="up", base_url=f"http://127.0.0.1:{upstream_port}/v1", api_key="key",
+            default_model="upstream-model", rate_limit=1000, tpm=100000, min_warm=0
+        )])
+        api_mock = Mock(FakeDb(), api_client)
+        app = FastAPI()
+        app.post("/api/chat")(api_mock.chat)
+
+        servers = [await serve(upstream.app, upstream_port), await serve(with_spec_version(app, spec_version), mock_port)]
+        try:
+            limiter = api_client.limiters["up"]
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{mock_port}") as http:
+                async with http.stream("POST", "/api/chat", json={
+                    "model": "llama2", "messages": [{"role": "user", "content": "hi"}]
+                }) as response:
+                    async for line in response.aiter_lines():
+                        assert json.loads(line)["done"] is False
+                        break
+                    # 第一个分块已经到达，生成中途断开
+                    assert api_client.provider_set.active == 1
+                    aborted_at = time.monotonic()
+
+            for _ in range(100):
+                if upstream.stopped_at is not None:
+                    break
+                await asyncio.sleep(0.01)
+            assert upstream.stopped_at is not None
+            # 断开后上游在毫秒级内停止，而不是等下一个分块或生成结束
+            assert upstream.stopped_at - aborted_at < 0.5
+            generated = upstream.generated
+            await asyncio.sleep(0.1)
+            assert upstream.generated == generated
+
+            # 提供商集合的引用已释放，预扣的额度已按实际用量退回
+            assert api_client.provider_set.active == 0
+            assert limiter.token_bucket.tokens > limiter.token_bucket.capacity - 100
+        finally:
+            await shutdown(servers)
+            await api_client.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
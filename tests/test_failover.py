@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+import pytest
+from app.api.client import Client, DeadlineExceeded, _PrefixFilter
+from app.core.config import ApiProvider
+
+
+class FakeResponse:
+    def __init__(self, contents, hang_after):
+        self.contents = contents
+        self.hang_after = hang_after
+        self.closed = False
+
+    async def aiter_lines(self):
+        for content in self.contents:
+            chunk = {"choices": [{"index": 0, "delta": {"content": content}}]}
+            yield f"data: {json.dumps(chunk)}"
+        if self.hang_after:
+            await asyncio.sleep(3600)
+        yield "data: [DONE]"
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakePool:
+    """按调用顺序依次返回预设的响应，记录每次请求的 payload"""
+
+    def __init__(self, script, payloads):
+        self.script = script
+        self.payloads = payloads
+
+    async def open_chat(self, payload, headers=None):
+        self.payloads.append(payload)
+        contents, hang_after = self.script.pop(0)
+        return FakeResponse(contents, hang_after)
+
+
+def make_client(script, stall_timeout=0.1, ttft_timeout=0.1):
+    providers = [
+        ApiProvider(
+            provider_name=name, base_url="http://127.0.0.1:1/v1", api_key="key", default_model=name,
+            rate_limit=1000, stall_timeout=stall_timeout, ttft_timeout=ttft_timeout
+        )
+        for name in ("a", "b")
+    ]
+    client = Client(providers)
+    payloads = []
+    for name in ("a", "b"):
+        client.provider_set.clients[name] = FakePool(script, payloads)
+    return client, payloads
+
+
+def collect(client, **kwargs):
+    async def run():
+        parts, final = [], None
+        async for chunk in client.chat_completion(
+            model={"a": "a", "b": "b"}, messages=[{"role": "user", "content": "hi"}], **kwargs
+        ):
+            if chunk["done"]:
+                final = chunk
+            else:
+                parts.append(chunk["message"]["content"])
+        return parts, final
+    return asyncio.run(run())
+
+
+def test_stall_fails_over_with_assistant_prefix():
+    client, payloads = make_client([(["Hello", " wor"], True), (["ld!"], False)])
+    parts, final = collect(client)
+    assert "".join(parts) == "Hello world!"
+    assert payloads[1]["model"] != payloads[0]["model"]
+    assert payloads[1]["messages"][-1] == {"role": "assistant", "content": "Hello wor"}
+    assert final["done"] is True
+
+
+def test_regenerated_prefix_is_not_duplicated():
+    # 第二个提供商忽略前缀从头生成
+    client, _ = make_client([(["Hello", " wor"], True), (["Hello", " world!"], False)])
+    parts, _ = collect(client)
+    assert "".join(parts) == "Hello world!"
+
+
+def test_ttft_timeout_retries_from_scratch():
+    client, payloads = make_client([([], True), (["Hi"], False)])
+    parts, _ = collect(client)
+    assert parts == ["Hi"]
+    assert payloads[1]["messages"] == [{"role": "user", "content": "hi"}]
+
+
+def test_deadline_stops_without_failover():
+    client, payloads = make_client([(["Hello"], True), (["unused"], False)], stall_timeout=0)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        collect(client, deadline=time.monotonic() + 0.2)
+    assert time.monotonic() - start < 1
+    assert len(payloads) == 1
+    assert client.provider_set.active == 0
+
+
+def test_prefix_filter_passes_diverging_continuation():
+    prefix_filter = _PrefixFilter("Hello wor")
+    # 与前缀一致的部分先暂存，不一致后连同暂存内容一起发出
+    assert prefix_filter.feed("Hel") == ""
+    assert prefix_filter.feed("icopter") == "Helicopter"
+    assert prefix_filter.feed(" ride") == " ride"
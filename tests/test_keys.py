@@ -0,0 +1,94 @@
+import asyncio
+import json
+import time
+import httpx
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+from app.api.client import Client
+from app.api.keys import KeyPool
+from app.api.limiter import RateLimiter
+from app.core.config import ApiProvider
+from helpers import free_port, serve, shutdown
+
+
+def make_provider(port=1, keys=("k1", "k2", "k3"), **kwargs):
+    return ApiProvider(
+        provider_name="pool", base_url=f"http://127.0.0.1:{port}/v1", api_keys=list(keys),
+        default_model="m", min_warm=0, **kwargs
+    )
+
+
+def test_keys_rotate_and_throughput_scales():
+    # 每个 key 每秒 1 个请求：3 个 key 可以立即发出 3 个请求
+    pool = KeyPool(make_provider(rate_limit=1))
+    reservations = [pool.reserve() for _ in range(4)]
+    assert [r.key for r in reservations] == ["k1", "k2", "k3", "k1"]
+    assert [r.wait for r in reservations[:3]] == [0, 0, 0]
+    assert reservations[3].wait > 0.9
+
+    single = RateLimiter(1)
+    assert single.reserve().wait == 0 and single.reserve().wait > 0.9
+
+
+def test_rate_limited_key_cools_down():
+    pool = KeyPool(make_provider(rate_limit=1000, tpm=6000, key_cooldown=0.2))
+    reservation = pool.reserve(10)
+    assert pool.penalize(reservation, retry_after=None)
+    assert {pool.reserve().key for _ in range(10)} == {"k2", "k3"}
+    # 预扣的 token 退回到对应 key 的限速器
+    pool.reconcile(reservation, 0)
+    assert pool.keys[0].limiter.token_bucket.tokens == 6000
+
+    for key in ("k2", "k3"):
+        reservation.key = key
+        pool.penalize(reservation, retry_after=0.1)
+    # 所有 key 都在冷却时等待最早恢复的一个
+    head = pool.reserve()
+    assert head.key == "k2" and 0.05 < head.wait <= 0.1
+    time.sleep(0.25)
+    assert pool.wait_time() == 0
+    assert {pool.reserve().key for _ in range(6)} == {"k1", "k2", "k3"}
+
+
+class Upstream:
+    """k1 总是返回 429"""
+
+    def __init__(self):
+        self.keys = []
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat)
+
+    async def chat(self, request: Request):
+        key = request.headers["authorization"].removeprefix("Bearer ")
+        self.keys.append(key)
+        if key == "k1":
+            return JSONResponse({"error": {"message": "quota"}}, status_code=429, headers={"Retry-After": "30"})
+
+        async def stream():
+            chunk = {"choices": [{"index": 0, "delta": {"content": key}}]}
+            yield f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def test_client_switches_keys_on_429():
+    async def run():
+        upstream, port = Upstream(), free_port()
+        servers = [await serve(upstream.app, port)]
+        client = Client([make_provider(port, rate_limit=1000)])
+        try:
+            contents = []
+            for _ in range(6):
+                async for chunk in client.chat_completion({"pool": "m"}, [{"role": "user", "content": "hi"}]):
+                    contents.append(chunk["message"]["content"])
+            # 每个请求都成功，k1 只被使用一次就进入冷却（Retry-After: 30）
+            assert "".join(contents) == "".join(upstream.keys[1:])
+            assert upstream.keys.count("k1") == 1
+            assert set(upstream.keys[1:]) == {"k2", "k3"}
+            assert not client.breaker.is_open("pool")
+            assert client.limiters["pool"].keys[0].cooling_until - time.monotonic() > 25
+        finally:
+            await shutdown(servers)
+            await client.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import time
+import httpx
+from fastapi import FastAPI
+from app.api.lifecycle import DEFAULT_MODEL_SIZE, Lifecycle, ProgressClock, model_layers
+from app.api.mock import Mock
+from app.core.config import settings
+
+
+class FakeDb:
+    def __init__(self):
+        self.models = {"tiny": {"name": "tiny", "size": 1_000_000}}
+
+    def get_models_db(self):
+        return self.models
+
+    def add_model(self, name, data):
+        self.models[name] = data
+
+
+def collect(events):
+    async def run():
+        return [event async for event in events]
+    return run()
+
+
+def test_instant_profile_has_no_delay(monkeypatch):
+    monkeypatch.setattr(settings.server, "lifecycle_profile", "instant")
+    app = FastAPI()
+    mock = Mock(FakeDb(), None)
+    app.post("/api/pull")(mock.pull_model)
+    app.post("/api/push")(mock.push_model)
+    app.post("/api/create")(mock.create_model)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as http:
+            start = time.monotonic()
+            pull = await http.post("/api/pull", json={"model": "tiny"})
+            push = await http.post("/api/push", json={"model": "tiny"})
+            create = await http.post("/api/create", json={"name": "new"})
+            blocking = await http.post("/api/pull", json={"model": "tiny", "stream": False})
+            return time.monotonic() - start, pull, push, create, blocking
+
+    elapsed, pull, push, create, blocking = asyncio.run(run())
+    assert elapsed < 0.5
+    events = [json.loads(line[len("data: "):]) for line in pull.text.split("\n\n") if line]
+    layers = [e for e in events if "digest" in e]
+    # 模型大小取自数据库，各层之和等于声明的大小
+    assert sum(e["total"] for e in layers) == 1_000_000
+    assert all(e["completed"] == e["total"] for e in layers)
+    assert events[0]["status"] == "pulling manifest" and events[-1]["status"] == "success"
+    assert json.loads(push.text.splitlines()[-1]) == {"status": "success"}
+    assert json.loads(create.text.splitlines()[-1]) == {"status": "success"}
+    assert blocking.json() == {"status": "success"}
+
+
+def test_realistic_pull_follows_bandwidth(monkeypatch):
+    monkeypatch.setattr(settings.server, "lifecycle_profile", "realistic")
+    monkeypatch.setattr(settings.server, "lifecycle_bandwidth", 4_000_000.0)
+    monkeypatch.setattr(settings.server, "lifecycle_step_delay", 0.0)
+    monkeypatch.setattr(settings.server, "lifecycle_tick", 0.02)
+    lifecycle = Lifecycle(FakeDb())
+
+    start = time.monotonic()
+    events = asyncio.run(collect(lifecycle.pull("tiny")))
+    elapsed = time.monotonic() - start
+    # 1MB / 4MB/s
+    assert 0.2 < elapsed < 0.6
+    weights = [e for e in events if e.get("digest") == f"sha256:{model_layers('tiny', 1_000_000)[0][0]}"]
+    completed = [e["completed"] for e in weights]
+    assert len(completed) > 5
+    assert completed == sorted(completed) and completed[-1] == weights[0]["total"]
+    assert events[-1] == {"status": "success"}
+
+
+def test_unknown_model_uses_default_size():
+    lifecycle = Lifecycle(FakeDb())
+    assert lifecycle.model_size("missing") == DEFAULT_MODEL_SIZE
+    assert model_layers("a", 100) == model_layers("a", 100)
+    assert model_layers("a", 100)[0][0] != model_layers("b", 100)[0][0]
+
+
+def test_many_concurrent_pulls_share_one_timer(monkeypatch):
+    monkeypatch.setattr(settings.server, "lifecycle_profile", "realistic")
+    monkeypatch.setattr(settings.server, "lifecycle_bandwidth", 5_000_000.0)
+    monkeypatch.setattr(settings.server, "lifecycle_step_delay", 0.05)
+    monkeypatch.setattr(settings.server, "lifecycle_tick", 0.05)
+    lifecycle = Lifecycle(FakeDb())
+
+    async def run():
+        tasks = [asyncio.ensure_future(collect(lifecycle.pull("tiny"))) for _ in range(2000)]
+        # 所有拉取只挂着一个定时器（定时器触发后、重新安排前的瞬间为 0 个）
+        counts = []
+        for _ in range(10):
+            await asyncio.sleep(0.013)
+            counts.append(sum(
+                1 for h in asyncio.get_running_loop()._scheduled
+                if not h.cancelled() and h._callback == lifecycle.clock._fire
+            ))
+        assert max(counts) == 1
+        # 取消其中一个不影响其他拉取
+        tasks[0].cancel()
+        results = await asyncio.gather(*tasks[1:])
+        assert all(events[-1] == {"status": "success"} for events in results)
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_clock_is_idle_without_waiters():
+    async def run():
+        clock = ProgressClock(0.01)
+        first = await clock.tick()
+        second = await clock.tick()
+        assert second - first >= 0.009
+        await asyncio.sleep(0.05)
+        assert clock._waiter is None
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import pytest
+from app.api import limiter as limiter_module
+from app.api.limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(limiter_module.time, "monotonic", clock)
+    return clock
+
+
+def test_rate_limit_spaces_requests(clock):
+    limiter = RateLimiter(rate_limit=2.0)
+    assert limiter.reserve().wait == 0
+    # 桶已透支，下一个请求需要等待 1/rate_limit 秒
+    assert limiter.reserve().wait == pytest.approx(0.5)
+    # 再下一个在前一个之后排队
+    assert limiter.reserve().wait == pytest.approx(1.0)
+    clock.now += 1.5
+    assert limiter.wait_time() == pytest.approx(0.0)
+
+
+def test_rpm_limits_burst(clock):
+    limiter = RateLimiter(rate_limit=1000.0, rpm=2)
+    clock.now += 1
+    limiter.reserve()
+    clock.now += 1
+    limiter.reserve()
+    clock.now += 1
+    # rpm 桶每 30 秒补充一个请求，前两秒已补充 2/30 个
+    assert limiter.wait_time() == pytest.approx(28.0)
+
+
+def test_tpm_reserve_and_overdraft(clock):
+    limiter = RateLimiter(rate_limit=1000.0, tpm=600)
+    assert limiter.reserve(500).wait == 0
+    # 剩余 100 个 token，预扣 300 个需要补充 200 个，速率为 10/s
+    assert limiter.wait_time(300) == pytest.approx(20.0)
+    reservation = limiter.reserve(300)
+    assert reservation.wait == pytest.approx(20.0)
+    assert limiter.token_bucket.tokens == pytest.approx(-200)
+
+
+def test_tpm_cost_capped_at_capacity(clock):
+    limiter = RateLimiter(rate_limit=1000.0, tpm=100)
+    # 超过桶容量的请求按容量计算，否则永远无法发出
+    reservation = limiter.reserve(1000)
+    assert reservation.wait == 0
+    assert reservation.tokens == 100
+    assert limiter.token_bucket.tokens == pytest.approx(0)
+
+
+def test_reconcile_refunds_and_charges(clock):
+    limiter = RateLimiter(rate_limit=1000.0, tpm=1000)
+    reservation = limiter.reserve(400)
+    limiter.reconcile(reservation, 100)
+    assert limiter.token_bucket.tokens == pytest.approx(900)
+    assert reservation.tokens == 100
+
+    reservation = limiter.reserve(100)
+    limiter.reconcile(reservation, 500)
+    assert limiter.token_bucket.tokens == pytest.approx(400)
+
+
+def test_reconcile_without_tpm_is_noop(clock):
+    limiter = RateLimiter(rate_limit=1.0)
+    reservation = limiter.reserve(100)
+    limiter.reconcile(reservation, 10)
+    assert limiter.token_bucket is None
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import random
+import httpx
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+from app.api.client import Client
+from app.api.mock import Mock
+from app.core.config import ApiProvider
+from helpers import free_port, serve, shutdown
+
+# 故意使用 Ollama 的紧凑格式和非 ASCII 内容，检验转发不做重新编码
+NDJSON = [
+    b'{"model":"llama3.2:3b","created_at":"2024-01-01T00:00:00Z","message":{"role":"assistant","content":"\xe4\xbd\xa0\xe5\xa5\xbd"},"done":false}\n',
+    b'{"model":"llama3.2:3b","created_at":"2024-01-01T00:00:01Z","message":{"role":"assistant","content":""},'
+    b'"done":true,"done_reason":"stop","prompt_eval_count":11,"eval_count":5}\n',
+]
+
+
+class OllamaUpstream:
+    def __init__(self):
+        self.requests = []
+        self.app = FastAPI()
+        self.app.post("/api/chat")(self.chat)
+        self.app.get("/api/ps")(self.ps)
+
+    async def chat(self, request: Request):
+        self.requests.append(await request.json())
+
+        async def stream():
+            for line in NDJSON:
+                yield line
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    async def ps(self):
+        return JSONResponse({"models": [{"name": "llama3.2:3b", "size_vram": 1}]})
+
+
+class FakeDb:
+    def get_model_mapping(self, model):
+        return {"box": "llama3.2:3b"}
+
+
+def make_ollama(name, port=1, **kwargs):
+    return ApiProvider(
+        provider_name=name, type="ollama", base_url=f"http://127.0.0.1:{port}",
+        default_model="llama3.2:3b", rate_limit=1000, **kwargs
+    )
+
+
+def test_ndjson_is_relayed_and_ps_is_polled():
+    async def run():
+        upstream = OllamaUpstream()
+        upstream_port, port = free_port(), free_port()
+        api_client = Client([make_ollama("box", upstream_port, tpm=60000)])
+        app = FastAPI()
+        app.post("/api/chat")(Mock(FakeDb(), api_client).chat)
+        servers = [await serve(upstream.app, upstream_port), await serve(app, port)]
+        try:
+            await api_client.start()
+            assert api_client.clients["box"].loaded_models == {"llama3.2:3b"}
+
+            bucket = api_client.limiters["box"].token_bucket
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+                response = await http.post("/api/chat", json={
+                    "model": "llama2", "messages": [{"role": "user", "content": "hi"}],
+                    "options": {"temperature": 0.1, "num_ctx": 4096}, "keep_alive": "10m"
+                })
+            assert response.status_code == 200
+            # 只有 model 字段被改回客户端请求的名称，其他字节保持不变
+            assert response.content == b"".join(NDJSON).replace(b'"llama3.2:3b"', b'"llama2"')
+            sent = upstream.requests[0]
+            assert sent["model"] == "llama3.2:3b"
+            assert sent["options"] == {"temperature": 0.1, "num_ctx": 4096}
+            assert sent["keep_alive"] == "10m"
+            # 用最后一个分块中的 prompt_eval_count + eval_count 校正额度
+            assert abs(bucket.tokens - (bucket.capacity - 16)) < 5
+            assert api_client.provider_set.active == 0
+        finally:
+            await shutdown(servers)
+            await api_client.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_ollama_with_model_loaded_is_preferred():
+    client = Client([make_ollama("cold"), make_ollama("warm")])
+    client.clients["warm"].loaded_models = {"llama3.2:3b"}
+    random.seed(0)
+    picks = [
+        client._select_provider(0, candidates={"cold": "llama3.2:3b", "warm": "llama3.2:3b"}).provider_name
+        for _ in range(1000)
+    ]
+    # 权重 1:4
+    assert 700 < picks.count("warm") < 900
+
+
+def test_provider_type_filter():
+    openai = ApiProvider(
+        provider_name="hosted", base_url="http://127.0.0.1:1/v1", api_key="key", default_model="m"
+    )
+    client = Client([openai, make_ollama("box")])
+    for _ in range(20):
+        assert client._select_provider(0, provider_type="openai").provider_name == "hosted"
+        assert client._select_provider(0, provider_type="ollama").provider_name == "box"
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import httpx
+from fastapi import FastAPI
+from app.api.client import Client, _StopFilter
+from app.api.mock import Mock
+from app.api.options import completion_params, generate_messages
+from app.core.config import ApiProvider
+
+
+def test_ollama_options_map_to_openai_params():
+    params = completion_params({
+        "format": "json",
+        "options": {
+            "num_predict": 64, "stop": ["\n\n", "END"], "temperature": 0.2, "top_p": 0.9,
+            "seed": 7, "num_ctx": 4096, "top_k": 40
+        }
+    })
+    assert params == {
+        "num_predict": 64, "stop": ["\n\n", "END"], "temperature": 0.2, "top_p": 0.9, "seed": 7,
+        "response_format": {"type": "json_object"}
+    }
+    # -1 表示不限制；stop 可以是字符串
+    assert completion_params({"options": {"num_predict": -1, "stop": "x"}}) == {"stop": ["x"]}
+    schema = {"type": "object"}
+    assert completion_params({"format": schema})["response_format"] == {
+        "type": "json_schema", "json_schema": {"name": "response", "schema": schema}
+    }
+
+
+def test_generate_messages():
+    data = {"prompt": "hi", "system": "be brief"}
+    assert generate_messages(data) == [
+        {"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}
+    ]
+    assert generate_messages(dict(data, raw=True)) == [{"role": "user", "content": "hi"}]
+    assert generate_messages({"prompt": ""}) == []
+
+
+def test_stop_filter_across_chunks():
+    stop_filter = _StopFilter(["STOP", "\n\n"])
+    assert stop_filter.feed("hello ST") == ("hello ", False)
+    assert stop_filter.feed("ay S") == ("STay ", False)
+    assert stop_filter.feed("TO") == ("", False)
+    assert stop_filter.feed("P and more") == ("", True)
+    assert stop_filter.flush() == ""
+
+    stop_filter = _StopFilter(["STOP"])
+    assert stop_filter.feed("end ST") == ("end ", False)
+    assert stop_filter.flush() == "ST"
+
+
+class FakeResponse:
+    def __init__(self, contents):
+        self.contents = contents
+        self.sent = 0
+        self.closed = False
+
+    async def aiter_lines(self):
+        for content in self.contents:
+            self.sent += 1
+            chunk = {"choices": [{"index": 0, "delta": {"content": content}}]}
+            yield f"data: {json.dumps(chunk)}"
+        yield "data: [DONE]"
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakePool:
+    """忽略 max_tokens 和 stop 的上游，记录请求"""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.payloads = []
+        self.responses = []
+
+    async def open_chat(self, payload, headers=None):
+        self.payloads.append(payload)
+        self.responses.append(FakeResponse(self.contents))
+        return self.responses[-1]
+
+
+def make_client(contents):
+    client = Client([ApiProvider(
+        provider_name="a", base_url="http://127.0.0.1:1/v1", api_key="key", default_model="m", rate_limit=1000
+    )])
+    pool = FakePool(contents)
+    client.provider_set.clients["a"] = pool
+    return client, pool
+
+
+def collect(client, **kwargs):
+    async def run():
+        parts, final = [], None
+        async for chunk in client.chat_completion(
+            model={"a": "m"}, messages=[{"role": "user", "content": "hi"}], **kwargs
+        ):
+            if chunk["done"]:
+                final = chunk
+            else:
+                parts.append(chunk["message"]["content"])
+        return "".join(parts), final
+
+    return asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_limits_enforced_locally_when_upstream_ignores_them():
+    client, pool = make_client([f"t{i} " for i in range(1000)])
+    text, final = collect(client, num_predict=5, stop=["a", "b", "c", "d", "t7"], temperature=0)
+    assert pool.payloads[0]["max_tokens"] == 5
+    assert pool.payloads[0]["stop"] == ["a", "b", "c", "d"]
+    assert pool.payloads[0]["temperature"] == 0
+    assert text == "t0 t1 t2 t3 t4 "
+    assert final["done_reason"] == "length"
+    # 上游连接在限制处关闭，没有读完整个流
+    assert pool.responses[0].closed and pool.responses[0].sent < 10
+
+    # 第五个之后的停止序列只在本地执行
+    client, pool = make_client(["t0 ", "t1 t", "7 t8"])
+    text, final = collect(client, stop=["a", "b", "c", "d", "t7"])
+    assert text == "t0 t1 "
+    assert final["done_reason"] == "stop"
+    assert "max_tokens" not in pool.payloads[0]
+
+
+class FakeDb:
+    def get_model_mapping(self, model):
+        return {"a": "m"}
+
+
+def test_generate_sends_prompt_and_returns_response_field():
+    async def run():
+        client, pool = make_client(["Hel", "lo"])
+        app = FastAPI()
+        app.post("/api/generate")(Mock(FakeDb(), client).generate)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://test") as http:
+            body = {"model": "llama2", "prompt": "hi", "system": "sys", "options": {"num_predict": 10}}
+            single = (await http.post("/api/generate", json=dict(body, stream=False))).json()
+            lines = (await http.post("/api/generate", json=body)).text.splitlines()
+        return pool, single, [json.loads(line) for line in lines]
+
+    pool, single, chunks = asyncio.run(asyncio.wait_for(run(), 10))
+    assert pool.payloads[0]["messages"] == [
+        {"role": "system", "content": "sys"}, {"role": "user", "content": "hi"}
+    ]
+    assert pool.payloads[0]["max_tokens"] == 10
+    assert single["response"] == "Hello" and "message" not in single
+    assert "".join(chunk["response"] for chunk in chunks) == "Hello"
+    assert chunks[-1]["done"] and "message" not in chunks[-1]
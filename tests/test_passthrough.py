@@ -0,0 +1,133 @@
+import asyncio
+import json
+import httpx
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from app.api.client import Client
+from app.api.passthrough import Passthrough
+from app.core.config import ApiProvider
+from helpers import free_port, serve, shutdown
+
+USAGE = {"prompt_tokens": 7, "completion_tokens": 2, "total_tokens": 9}
+
+
+def sse_events(model):
+    chunks = [
+        {"id": "1", "model": model, "choices": [{"index": 0, "delta": {"content": f'say "{model}"'}}]},
+        {"id": "1", "model": model, "choices": [{"index": 0, "delta": {"content": "!"}, "finish_reason": "stop"}]},
+        {"id": "1", "model": model, "choices": [], "usage": USAGE},
+    ]
+    return [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"]
+
+
+class Upstream:
+    def __init__(self):
+        self.requests = []
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat)
+        self.app.post("/v1/embeddings")(self.embeddings)
+        self.fail_status = None
+
+    async def chat(self, request: Request):
+        body = await request.json()
+        self.requests.append(body)
+        if self.fail_status:
+            return JSONResponse({"error": {"message": "nope"}}, status_code=self.fail_status)
+        if body.get("stream"):
+            # 每个事件单独发送，并故意在事件中间切开，检验改写不受分块边界影响
+            data = "".join(sse_events(body["model"])).encode()
+            async def stream():
+                for i in range(0, len(data), 37):
+                    yield data[i:i + 37]
+            return StreamingResponse(stream(), media_type="text/event-stream")
+        return JSONResponse({"model": body["model"], "choices": [], "usage": USAGE})
+
+    async def embeddings(self, request: Request):
+        body = await request.json()
+        self.requests.append(body)
+        return Response(
+            json.dumps({"model": body["model"], "data": [{"embedding": [0.5]}], "usage": USAGE}),
+            media_type="application/json"
+        )
+
+
+class FakeDb:
+    def get_model_mapping(self, model):
+        return {"up": "upstream-model"}
+
+
+def run_with_servers(test):
+    async def run():
+        upstream = Upstream()
+        upstream_port, port = free_port(), free_port()
+        api_client = Client([ApiProvider(
+            provider_name="up", base_url=f"http://127.0.0.1:{upstream_port}/v1", api_key="key",
+            default_model="upstream-model", rate_limit=1000, tpm=60000, min_warm=0
+        )])
+        passthrough = Passthrough(FakeDb(), api_client)
+        app = FastAPI()
+        app.post("/v1/chat/completions")(passthrough.chat_completions)
+        app.post("/v1/embeddings")(passthrough.embeddings)
+        servers = [await serve(upstream.app, upstream_port), await serve(app, port)]
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+                await test(http, upstream, api_client)
+        finally:
+            await shutdown(servers)
+            await api_client.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_stream_is_relayed_with_model_rewritten():
+    async def test(http, upstream, api_client):
+        bucket = api_client.limiters["up"].token_bucket
+        response = await http.post("/v1/chat/completions", json={
+            "model": "llama2", "stream": True, "temperature": 0.3,
+            "messages": [{"role": "user", "content": "hi"}],
+        })
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        # 只改写 model 字段，内容中的同名字符串（被转义）保持不变
+        expected = "".join(sse_events("upstream-model")).replace('"model": "upstream-model"', '"model": "llama2"')
+        assert response.text == expected
+        assert upstream.requests[0]["model"] == "upstream-model"
+        assert upstream.requests[0]["temperature"] == 0.3
+        # 按响应中的 usage 校正额度
+        assert abs(bucket.tokens - (bucket.capacity - USAGE["total_tokens"])) < 5
+        assert api_client.provider_set.active == 0
+
+    run_with_servers(test)
+
+
+def test_non_stream_and_embeddings():
+    async def test(http, upstream, api_client):
+        response = await http.post("/v1/chat/completions", json={
+            "model": "llama2", "messages": [{"role": "user", "content": "hi"}],
+        })
+        assert response.json() == {"model": "llama2", "choices": [], "usage": USAGE}
+
+        response = await http.post("/v1/embeddings", json={"model": "llama2", "input": ["a", "b"]})
+        assert response.json()["model"] == "llama2"
+        assert response.json()["data"] == [{"embedding": [0.5]}]
+        assert upstream.requests[-1]["input"] == ["a", "b"]
+
+    run_with_servers(test)
+
+
+def test_upstream_errors_are_passed_through():
+    async def test(http, upstream, api_client):
+        upstream.fail_status = 400
+        response = await http.post("/v1/chat/completions", json={
+            "model": "llama2", "messages": [{"role": "user", "content": "hi"}],
+        })
+        assert response.status_code == 400
+        assert response.json() == {"error": {"message": "nope"}}
+        # 4xx 不重试
+        assert len(upstream.requests) == 1
+        assert api_client.provider_set.active == 0
+
+        response = await http.post("/v1/chat/completions", content=b"{")
+        assert response.status_code == 400
+
+    run_with_servers(test)
@@ -0,0 +1,43 @@
+import asyncio
+import httpx
+from app.api.pool import DnsCache, iter_sse
+
+
+def test_dns_cache_reuses_lookups(monkeypatch):
+    calls = []
+
+    async def fake_getaddrinfo(host, port, type=0):
+        calls.append(host)
+        return [(None, None, None, "", ("10.0.0.1", port)), (None, None, None, "", ("10.0.0.2", port))]
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        monkeypatch.setattr(loop, "getaddrinfo", fake_getaddrinfo)
+        cache = DnsCache(ttl=60)
+        addresses = {await cache.resolve("api.example.com", 443) for _ in range(4)}
+        # IP 地址不做解析
+        assert await cache.resolve("127.0.0.1", 80) == "127.0.0.1"
+        return addresses
+
+    assert asyncio.run(run()) == {"10.0.0.1", "10.0.0.2"}
+    assert calls == ["api.example.com"]
+
+
+def test_iter_sse():
+    body = (
+        b'data: {"choices": [{"delta": {"content": "a"}}]}\n\n'
+        b': keep-alive comment\n\n'
+        b'data: {"choices": [], "usage": {"total_tokens": 3}}\n\n'
+        b'data: [DONE]\n\n'
+    )
+
+    async def run():
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+        async with httpx.AsyncClient(transport=transport) as client:
+            async with client.stream("POST", "http://upstream/chat/completions") as response:
+                return [chunk async for chunk in iter_sse(response)]
+
+    chunks = asyncio.run(run())
+    assert chunks[0]["choices"][0]["delta"]["content"] == "a"
+    assert chunks[1]["usage"]["total_tokens"] == 3
+    assert len(chunks) == 2
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+from app.core import routing
+from app.core.routing import RoutingTable, strip_tag
+
+
+def provider(name, default, mappings):
+    return SimpleNamespace(provider_name=name, default_model=default, provider_mappings=mappings)
+
+
+def make_table():
+    return RoutingTable([
+        provider("a", "a-default", {"llama2": "a-llama2", "llama2:13b": "a-llama2-13b", "qwen2.5*": "a-qwen"}),
+        provider("b", "b-default", {"llama2": "b-llama2", "qwen*": "b-qwen"}),
+    ])
+
+
+def test_strip_tag():
+    assert strip_tag("llama2:13b") == "llama2"
+    assert strip_tag("llama2") == "llama2"
+
+
+def test_exact_match():
+    assert make_table().resolve("llama2") == {"a": "a-llama2", "b": "b-llama2"}
+
+
+def test_exact_with_tag_takes_precedence_over_stripped():
+    assert make_table().resolve("llama2:13b") == {"a": "a-llama2-13b", "b": "b-llama2"}
+
+
+def test_tag_stripped_match():
+    assert make_table().resolve("llama2:7b") == {"a": "a-llama2", "b": "b-llama2"}
+
+
+def test_glob_match():
+    assert make_table().resolve("qwen2.5:7b-instruct") == {"a": "a-qwen", "b": "b-qwen"}
+    # 只有匹配的提供商才服务该模型
+    assert make_table().resolve("qwen1.5") == {"b": "b-qwen"}
+
+
+def test_first_matching_pattern_wins():
+    table = RoutingTable([provider("a", "d", {"qwen2*": "first", "qwen*": "second"})])
+    assert table.resolve("qwen2.5") == {"a": "first"}
+
+
+def test_fallback_to_default_model():
+    assert make_table().resolve("mistral") == {"a": "a-default", "b": "b-default"}
+
+
+def test_routes_are_memoized_and_bounded(monkeypatch):
+    monkeypatch.setattr(routing, "MAX_CACHED_ROUTES", 2)
+    table = make_table()
+    route = table.resolve("llama2")
+    assert table.resolve("llama2") is route
+    table.resolve("mistral")
+    table.resolve("qwen2.5")
+    # 超过上限时清空缓存
+    assert list(table._routes) == ["qwen2.5"]
@@ -0,0 +1,56 @@
+import json
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from app.db.manager import Manager
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "db.json").write_text(json.dumps({
+        "models_db": {"llama2": {"name": "llama2"}},
+        "running_models": {},
+        "model_mappings": {},
+    }), encoding="utf-8")
+    return tmp_path
+
+
+def test_background_load_blocks_readers_until_loaded(data_dir):
+    db = Manager("db.json", load=False)
+    assert not db.ready
+
+    result = {}
+    reader = threading.Thread(target=lambda: result.update(models=db.get_models_db()))
+    reader.start()
+    reader.join(0.05)
+    # 加载完成前读取方等待，而不是看到空数据
+    assert reader.is_alive()
+
+    db.load()
+    reader.join(1)
+    assert db.ready
+    assert result["models"] == {"llama2": {"name": "llama2"}}
+
+
+def test_failed_load_is_reported(data_dir):
+    (data_dir / "data" / "db.json").write_text("{", encoding="utf-8")
+    db = Manager("db.json", load=False)
+    with pytest.raises(json.JSONDecodeError):
+        db.load()
+    assert not db.ready
+    with pytest.raises(RuntimeError):
+        db.get_models_db()
+
+
+def test_ready_is_separate_from_health(data_dir):
+    import app.main as main
+
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        for _ in range(100):
+            if client.get("/ready").status_code == 200:
+                break
+        assert client.get("/ready").json() == {"status": "ready"}
+        assert client.get("/api/tags").json() == {"models": [{"name": "llama2"}]}
@@ -0,0 +1,31 @@
+from app.utils import tokens
+from app.utils.tokens import TokenCounter, estimate_messages, estimate_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    # 非 ASCII 字符按 1 个 token 计算
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("hi你好") == 3
+
+
+def test_estimate_messages_uses_bounded_cache():
+    tokens._message_cache.clear()
+    messages = [
+        {"role": "system", "content": "x" * 1000},
+        {"role": "user", "content": [{"type": "text", "text": "hello"}]},
+    ]
+    first = estimate_messages(messages)
+    assert first == estimate_messages(messages)
+    assert len(tokens._message_cache) == 2
+    # 缓存键与内容长度无关
+    assert all(len(key[2]) <= 64 and len(key[3]) <= 64 for key in tokens._message_cache)
+
+
+def test_token_counter_matches_estimate():
+    counter = TokenCounter()
+    for part in ["Hel", "lo ", "世界", " again"]:
+        counter.add(part)
+    assert counter.count == estimate_tokens("Hello 世界 again")
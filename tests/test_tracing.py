@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.api.client import Client
+from app.api.mock import Mock
+from app.core import profiler
+from app.core.config import ApiProvider, settings
+from app.core.tracing import TRACE_HEADER, TracingMiddleware, Trace, span
+from helpers import free_port, serve, shutdown
+
+
+class FakeResponse:
+    async def aiter_lines(self):
+        for content in ("a", "b"):
+            chunk = {"choices": [{"index": 0, "delta": {"content": content}}]}
+            yield f"data: {json.dumps(chunk)}"
+        yield "data: [DONE]"
+
+    async def aclose(self):
+        pass
+
+
+class FakePool:
+    async def open_chat(self, payload, headers=None):
+        await asyncio.sleep(0.01)
+        return FakeResponse()
+
+
+class FakeDb:
+    def get_model_mapping(self, model):
+        return {"up": "m"}
+
+
+def run_with_app(test):
+    async def run():
+        api_client = Client([ApiProvider(
+            provider_name="up", base_url="http://127.0.0.1:1/v1", api_key="key",
+            default_model="m", rate_limit=1000
+        )])
+        api_client.provider_set.clients["up"] = FakePool()
+        app = FastAPI()
+        app.post("/api/chat")(Mock(FakeDb(), api_client).chat)
+        app.add_middleware(TracingMiddleware)
+        port = free_port()
+        servers = [await serve(app, port)]
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+                await test(http)
+        finally:
+            await shutdown(servers)
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def chat(http, stream, headers=None):
+    return http.post("/api/chat", headers=headers or {}, json={
+        "model": "llama2", "stream": stream, "messages": [{"role": "user", "content": "hi"}]
+    })
+
+
+def test_stream_final_chunk_carries_trace(caplog):
+    async def test(http):
+        response = await chat(http, True, {TRACE_HEADER: "1"})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert all("trace" not in line for line in lines[:-1])
+        spans = lines[-1]["trace"]
+        for name in ("parse", "route", "select", "upstream_headers", "ttft", "stream", "total"):
+            assert name in spans
+        assert spans["upstream_headers"] >= 10
+        assert "server-timing" in response.headers
+
+        # 没有请求头且抽样率为 0 时不记录
+        response = await chat(http, True)
+        assert "trace" not in json.loads(response.text.splitlines()[-1])
+        assert "server-timing" not in response.headers
+
+    with caplog.at_level(logging.INFO, logger="app.trace"):
+        run_with_app(test)
+    records = [json.loads(r.getMessage()) for r in caplog.records if r.name == "app.trace"]
+    assert len(records) == 1
+    assert "write" in records[0]["spans_ms"]
+
+
+def test_sampled_non_stream_has_server_timing(monkeypatch):
+    monkeypatch.setattr(settings.server, "trace_sample_rate", 1.0)
+
+    async def test(http):
+        response = await chat(http, False)
+        assert response.status_code == 200
+        timing = response.headers["server-timing"]
+        assert "route;dur=" in timing and "total;dur=" in timing
+        assert response.headers["x-trace-id"]
+
+    run_with_app(test)
+
+
+def test_span_accumulates():
+    trace = Trace()
+    trace.add("write", 1_000_000)
+    trace.add("write", 2_000_000)
+    assert trace.summary()["write"] == 3.0
+    # 未记录时 span 不做任何事
+    with span("noop"):
+        pass
+
+
+def busy_loop_for_profile(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_profiler_samples_event_loop():
+    async def run():
+        task = asyncio.ensure_future(profiler.profile(0.2, 0.002))
+        await asyncio.sleep(0)
+        # 阻塞事件循环，采样应落在这个函数中
+        busy_loop_for_profile(0.2)
+        with pytest.raises(profiler.ProfilerBusy):
+            await profiler.profile(0.1)
+        return await task
+
+    folded = asyncio.run(run())
+    lines = folded.splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert "busy_loop_for_profile" in stack.split(";")[-1]
+    assert int(count) > 10
+    assert not profiler._running.locked()